@@ -1,9 +1,26 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-from datetime import datetime, date, timedelta
+from datetime import date
 import json
 import os
+import time
+
+from storage import LEDGERS, cached_load, file_lock, rejected_path, update_json, write_json_atomic
+from backends import (ConflictError, append_ledger, date_bounds, filter_frame, get_backend, ingest_reports,
+                      ledger_fingerprint, ledger_page, parse_dates, read_ledger, register_derived_stores, row_delta,
+                      update_rows)
+from ledger import Expense, Income
+from recurring import reset_catch_up, run_catch_up
+import balance_index
+import metrics
+import rollups
+import search_index
+import write_queue
+from budget_analytics import budget_utilization, trailing_months, utilization_table
+from cashflow import MAX_CHART_POINTS, cashflow_series, downsample
+from forecast import forecast
+from importer import import_csv
+from exporter import EXPORT_FORMATS, export_file, export_filename
 
 # ==========================
 # ---- App Configuration ----
@@ -17,9 +34,6 @@ st.set_page_config(
 # --------------------------
 # ---- File Definitions ----
 # --------------------------
-EXP_FILE = 'expenses.csv'
-INC_FILE = 'income.csv'
-REC_FILE = 'recurring.csv'
 CFG_FILE = 'settings.json'  # stores categories
 BUDGET_FILE = 'budgets.json'  # stores monthly budgets per category
 
@@ -30,21 +44,16 @@ DEFAULT_CATEGORIES = ['Food', 'Transport', 'Utilities', 'Fun', 'Health', 'Other'
 # ---------------------------
 
 def ensure_files_exist():
-    if not os.path.exists(EXP_FILE):
-        pd.DataFrame(columns=["date", "category", "description", "amount"]).to_csv(EXP_FILE, index=False)
-    if not os.path.exists(INC_FILE):
-        pd.DataFrame(columns=["date", "source", "amount"]).to_csv(INC_FILE, index=False)
-    if not os.path.exists(REC_FILE):
-        pd.DataFrame(columns=["type", "category_or_source", "description", "amount", "frequency", "next_date"]).to_csv(REC_FILE, index=False)
-    if not os.path.exists(CFG_FILE):
-        with open(CFG_FILE, 'w') as f:
-            json.dump({"categories": DEFAULT_CATEGORIES}, f, indent=2)
-    if not os.path.exists(BUDGET_FILE):
-        with open(BUDGET_FILE, 'w') as f:
-            json.dump({}, f, indent=2)
+    get_backend().ensure()
+    register_derived_stores()
+    for path, default in ((CFG_FILE, {"categories": DEFAULT_CATEGORIES}), (BUDGET_FILE, {})):
+        if not os.path.exists(path):
+            with file_lock(path):
+                if not os.path.exists(path):
+                    write_json_atomic(path, default)
 
 
-def load_categories():
+def _load_categories():
     try:
         with open(CFG_FILE, 'r') as f:
             cfg = json.load(f)
@@ -56,12 +65,26 @@ def load_categories():
         return DEFAULT_CATEGORIES
 
 
-def save_categories(categories):
-    with open(CFG_FILE, 'w') as f:
-        json.dump({"categories": categories}, f, indent=2)
+def load_categories():
+    return cached_load(CFG_FILE, _load_categories)
+
 
+def update_categories(renamed: dict, removed: list, added: list):
+    """Apply one session's category edits on top of the current list.
 
-def load_budgets():
+    Other sessions' concurrent additions and removals are kept. Returns the new list.
+    """
+    def apply(cfg):
+        cfg = dict(cfg or {})
+        current = cfg.get("categories") or list(DEFAULT_CATEGORIES)
+        cats = [renamed.get(c, c) for c in current if c not in removed]
+        cats += [c for c in added if c not in cats]
+        cfg["categories"] = list(dict.fromkeys(cats)) or current
+        return cfg
+    return update_json(CFG_FILE, apply)["categories"]
+
+
+def _load_budgets():
     try:
         with open(BUDGET_FILE, 'r') as f:
             return json.load(f)
@@ -69,161 +92,57 @@ def load_budgets():
         return {}
 
 
-def save_budgets(budgets: dict):
-    with open(BUDGET_FILE, 'w') as f:
-        json.dump(budgets, f, indent=2)
-
-
-import pandas as pd
-
-def read_expenses():
-    expected_cols = ["date", "category", "description", "amount"]
-    try:
-        df = pd.read_csv(EXP_FILE)
-        # Reset if missing headers or empty
-        if df.empty or not all(col in df.columns for col in expected_cols):
-            df = pd.DataFrame(columns=expected_cols)
-        else:
-            df['date'] = pd.to_datetime(df['date'], errors="coerce").dt.date
-        return df
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=expected_cols)
-        df.to_csv(EXP_FILE, index=False)
-        return df
-
-
-def read_income():
-    expected_cols = ["date", "source", "amount"]
-    try:
-        df = pd.read_csv(INC_FILE)
-        if df.empty or not all(col in df.columns for col in expected_cols):
-            df = pd.DataFrame(columns=expected_cols)
-        else:
-            df['date'] = pd.to_datetime(df['date'], errors="coerce").dt.date
-        return df
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=expected_cols)
-        df.to_csv(INC_FILE, index=False)
-        return df
-
+def load_budgets():
+    return cached_load(BUDGET_FILE, _load_budgets)
 
-def read_recurring():
-    expected_cols = ["date", "category", "description", "amount", "frequency", "next_date"]
-    try:
-        df = pd.read_csv("recurring.csv")
-        if df.empty or not all(col in df.columns for col in expected_cols):
-            df = pd.DataFrame(columns=expected_cols)
-        else:
-            df['date'] = pd.to_datetime(df['date'], errors="coerce").dt.date
-            df['next_date'] = pd.to_datetime(df['next_date'], errors="coerce").dt.date
-        return df
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=expected_cols)
-        df.to_csv("recurring.csv", index=False)
-        return df
 
+def update_budgets(changed: dict, removed: list = ()):
+    """Merge one session's budget edits into the current budgets; others' edits are kept."""
+    def apply(budgets):
+        budgets = {k: v for k, v in (budgets or {}).items() if k not in removed}
+        budgets.update(changed)
+        return budgets
+    return update_json(BUDGET_FILE, apply, default={})
 
 
-def write_csv(df: pd.DataFrame, path: str):
-    df.to_csv(path, index=False)
+def frame_edits(before: pd.DataFrame, after: pd.DataFrame, key: str):
+    """What a dynamic st.data_editor changed, as (changed rows, removed keys, added rows).
 
+    Rows keep their index label through the editor; new rows get fresh labels.
+    """
+    removed = before.loc[before.index.difference(after.index), key].tolist()
+    added = after.loc[after.index.difference(before.index)]
+    common = before.index.intersection(after.index)
+    old, new = before.loc[common], after.loc[common]
+    changed = new[(old != new).any(axis=1)]
+    return changed, removed, added
 
-# ---------------------------
-# ---- Recurring Engine  ----
-# ---------------------------
 
-def add_period(d: date, freq: str) -> date:
-    if freq == 'daily':
-        return d + timedelta(days=1)
-    if freq == 'weekly':
-        return d + timedelta(weeks=1)
-    if freq == 'monthly':
-        # Add ~1 month by advancing to next month same day when possible
-        month = d.month + 1
-        year = d.year + (month - 1) // 12
-        month = (month - 1) % 12 + 1
-        day = min(d.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
-        return date(year, month, day)
-    if freq == 'yearly':
-        try:
-            return date(d.year + 1, d.month, d.day)
-        except ValueError:
-            # Feb 29 -> Feb 28 next year
-            return date(d.year + 1, d.month, 28)
-    return d
+def read_expenses():
+    return read_ledger('expenses')
 
 
-def process_recurring_transactions():
-    """Apply due recurring transactions up to today, then bump next_date accordingly."""
-    rec = read_recurring()
-    if rec.empty:
-        return
+def read_income():
+    return read_ledger('income')
 
-    expenses = read_expenses()
-    income = read_income()
 
-    today = date.today()
-    changed = False
-
-    for idx, row in rec.iterrows():
-        r_type = str(row['type']).strip().lower()
-        freq = str(row['frequency']).strip().lower()
-        next_dt: date = row['next_date']
-        while pd.notna(next_dt) and next_dt <= today:
-            amt = float(row['amount'])
-            name = str(row['category_or_source'])
-            if r_type == 'expense':
-                new_row = {
-                    'date': next_dt,
-                    'category': name,
-                    'description': row.get('description', ''),
-                    'amount': amt,
-                }
-                expenses = pd.concat([expenses, pd.DataFrame([new_row])], ignore_index=True)
-                changed = True
-            elif r_type == 'income':
-                new_row = {
-                    'date': next_dt,
-                    'source': name,
-                    'amount': amt,
-                }
-                income = pd.concat([income, pd.DataFrame([new_row])], ignore_index=True)
-                changed = True
-            next_dt = add_period(next_dt, freq)
-        rec.at[idx, 'next_date'] = next_dt
-
-    if changed:
-        # Normalize date/amount types before saving
-        if not expenses.empty:
-            expenses['date'] = pd.to_datetime(expenses['date']).dt.date
-            expenses['amount'] = pd.to_numeric(expenses['amount'], errors='coerce').fillna(0.0)
-            write_csv(expenses, EXP_FILE)
-        if not income.empty:
-            income['date'] = pd.to_datetime(income['date']).dt.date
-            income['amount'] = pd.to_numeric(income['amount'], errors='coerce').fillna(0.0)
-            write_csv(income, INC_FILE)
-        write_csv(rec, REC_FILE)
+def read_recurring():
+    return read_ledger('recurring')
 
 
 # ---------------------------
 # ---- Sidebar Filters  ----
 # ---------------------------
 
-def sidebar_filters(expenses: pd.DataFrame, income: pd.DataFrame, categories: list):
+def sidebar_filters(categories: list):
     st.sidebar.header("Filters")
     # Date range defaults: this month
     today = date.today()
     first_of_month = today.replace(day=1)
-    min_date = min([
-        first_of_month,
-        expenses['date'].min() if not expenses.empty else first_of_month,
-        income['date'].min() if not income.empty else first_of_month,
-    ])
-    max_date = max([
-        today,
-        expenses['date'].max() if not expenses.empty else today,
-        income['date'].max() if not income.empty else today,
-    ])
+    exp_min, exp_max = date_bounds('expenses')
+    inc_min, inc_max = date_bounds('income')
+    min_date = min(d for d in [first_of_month, exp_min, inc_min] if d is not None and pd.notna(d))
+    max_date = max(d for d in [today, exp_max, inc_max] if d is not None and pd.notna(d))
 
     date_range = st.sidebar.date_input(
         "Date range",
@@ -241,22 +160,20 @@ def sidebar_filters(expenses: pd.DataFrame, income: pd.DataFrame, categories: li
     min_amt = float(st.sidebar.number_input("Min amount", min_value=0.0, value=0.0, step=100.0))
     max_amt = float(st.sidebar.number_input("Max amount (0 = no cap)", min_value=0.0, value=0.0, step=100.0))
 
-    return start_date, end_date, cat_sel, min_amt, max_amt
+    search = st.sidebar.text_input("Search", placeholder="Expense descriptions, income sources",
+                                   help="Words are matched as prefixes; all of them must match").strip()
 
+    return start_date, end_date, cat_sel, min_amt, max_amt, search
 
-def apply_filters(df: pd.DataFrame, start_date: date, end_date: date, categories: list, min_amt: float, max_amt: float):
-    if df.empty:
-        return df
-    mask = (
-        (df['date'] >= start_date) & (df['date'] <= end_date)
-    )
-    if 'category' in df.columns and categories:
-        mask &= df['category'].isin(categories)
-    if 'amount' in df.columns:
-        mask &= df['amount'] >= min_amt
-        if max_amt > 0:
-            mask &= df['amount'] <= max_amt
-    return df.loc[mask].copy()
+
+def apply_filters(df: pd.DataFrame, start_date: date, end_date: date, categories: list, min_amt: float, max_amt: float,
+                  ids=None):
+    # In-memory filtering; ledger views should prefer get_backend().query(), which
+    # pushes the same predicates down to the storage engine.
+    with metrics.stage('apply_filters'):
+        metrics.count(rows=len(df))
+        return filter_frame(df, start_date=start_date, end_date=end_date, categories=categories,
+                            min_amt=min_amt, max_amt=max_amt, ids=ids)
 
 
 # ---------------------------
@@ -267,10 +184,15 @@ def kpi_card(label: str, value: float):
     st.metric(label, f"₹{value:,.2f}")
 
 
-def dashboard(expenses_f: pd.DataFrame, income_f: pd.DataFrame):
+def dashboard(exp_filters: dict, inc_filters: dict):
     st.subheader("Overview")
-    total_exp = float(expenses_f['amount'].sum()) if not expenses_f.empty else 0.0
-    total_inc = float(income_f['amount'].sum()) if not income_f.empty else 0.0
+    # Served from the materialized rollups (the engine only for amount-bounded filters)
+    by_cat = rollups.totals('expenses', 'category', **exp_filters)
+    exp_daily = rollups.totals('expenses', 'date', **exp_filters)
+    inc_daily = rollups.totals('income', 'date', **inc_filters)
+    # KPIs from the prefix-sum index: a couple of binary searches per category
+    total_exp = balance_index.filtered_total('expenses', **exp_filters)
+    total_inc = balance_index.filtered_total('income', **inc_filters)
     balance = total_inc - total_exp
 
     c1, c2, c3 = st.columns(3)
@@ -284,29 +206,28 @@ def dashboard(expenses_f: pd.DataFrame, income_f: pd.DataFrame):
     st.divider()
 
     # Expenses by Category
-    if not expenses_f.empty:
-        by_cat = expenses_f.groupby('category', as_index=False)['amount'].sum()
+    if not by_cat.empty:
         by_cat = by_cat.sort_values('amount', ascending=False)
         st.write("### Expenses by Category")
         st.bar_chart(by_cat.set_index('category'))
 
-    # Cashflow over time
-    if not expenses_f.empty or not income_f.empty:
+    # Cashflow over time: income and expenses merged per bucket, capped in points
+    if not exp_daily.empty or not inc_daily.empty:
         st.write("### Cashflow Over Time")
-        exp_daily = expenses_f.groupby('date', as_index=False)['amount'].sum() if not expenses_f.empty else pd.DataFrame(columns=['date', 'amount'])
-        inc_daily = income_f.groupby('date', as_index=False)['amount'].sum() if not income_f.empty else pd.DataFrame(columns=['date', 'amount'])
-        exp_daily['amount'] = -exp_daily['amount']  # negative for expenses
-        inc_daily['amount'] = inc_daily['amount']
-        cash = pd.concat([exp_daily, inc_daily], ignore_index=True).sort_values('date')
-        cash['cumulative'] = cash['amount'].cumsum()
-        st.line_chart(cash.set_index('date')[['amount', 'cumulative']])
+        c1, c2 = st.columns([3, 1])
+        granularity = c1.radio("Granularity", ["auto", "daily", "weekly", "monthly"], horizontal=True, key="cash_granularity")
+        reduce = c2.checkbox(f"Downsample (≤ {MAX_CHART_POINTS:,} points)", value=True, key="cash_downsample")
+        cash = cashflow_series(exp_daily, inc_daily, granularity)
+        if reduce:
+            cash = downsample(cash, MAX_CHART_POINTS, columns=['net', 'cumulative'])
+        st.line_chart(cash[['net', 'cumulative']])
 
 
 # ---------------------------
 # ---- Budgets  ----
 # ---------------------------
 
-def budgets_ui(categories: list, expenses: pd.DataFrame):
+def budgets_ui(categories: list):
     st.subheader("Monthly Budgets by Category")
     budgets = load_budgets()
 
@@ -318,26 +239,32 @@ def budgets_ui(categories: list, expenses: pd.DataFrame):
 
     edited = st.data_editor(df_b, num_rows="dynamic", use_container_width=True, key="budget_editor")
     if st.button("Save Budgets", type="primary"):
-        new_budgets = {row['category']: float(row['budget']) for _, row in edited.iterrows() if str(row['category']).strip()}
-        save_budgets(new_budgets)
+        # Only this session's edits are merged into the file, so concurrent saves
+        # from other sessions for other categories are not overwritten
+        changed, removed, added = frame_edits(df_b, edited, 'category')
+        removed += [df_b.at[i, 'category'] for i in changed.index if df_b.at[i, 'category'] != changed.at[i, 'category']]
+        rows = pd.concat([changed, added])
+        update_budgets({str(row['category']).strip(): float(row['budget']) if pd.notna(row['budget']) else 0.0
+                        for _, row in rows.iterrows() if str(row['category']).strip()}, removed)
         st.success("Budgets saved!")
         st.rerun()
 
-    # Utilization for current month
-    if not expenses.empty:
-        now = date.today()
-        start_m = now.replace(day=1)
-        end_m = (start_m + timedelta(days=40)).replace(day=1) - timedelta(days=1)
-        month_exp = expenses[(expenses['date'] >= start_m) & (expenses['date'] <= end_m)]
-        spent_by_cat = month_exp.groupby('category', as_index=False)['amount'].sum() if not month_exp.empty else pd.DataFrame(columns=['category', 'amount'])
+    # Utilization for the current month and trailing history, from one aggregation
+    if date_bounds('expenses')[0] is not None:
+        window = st.radio("History window (months)", [12, 24], horizontal=True, key="budget_window")
+        months = trailing_months(window)
+        util = budget_utilization(budgets, categories, months)
+        current = util[util['month'] == months[-1]]
+
         st.write("### This Month: Budget Utilization")
-        for cat in categories:
-            budget = float(budgets.get(cat, 0.0))
-            spent = float(spent_by_cat.loc[spent_by_cat['category'] == cat, 'amount'].sum()) if not spent_by_cat.empty else 0.0
-            pct = 0 if budget <= 0 else min(100, (spent / budget) * 100)
-            st.progress(int(pct), text=f"{cat}: Spent ₹{spent:,.2f} / Budget ₹{budget:,.2f} ({pct:.0f}%)")
-            if budget > 0 and spent > budget:
-                st.warning(f"Over budget in **{cat}** by ₹{spent - budget:,.2f}")
+        for row in current.itertuples(index=False):
+            pct = min(100, row.pct)
+            st.progress(int(pct), text=f"{row.category}: Spent ₹{row.spent:,.2f} / Budget ₹{row.budget:,.2f} ({pct:.0f}%)")
+            if row.over:
+                st.warning(f"Over budget in **{row.category}** by ₹{row.spent - row.budget:,.2f}")
+
+        st.write(f"### Last {window} Months: Utilization (%)")
+        st.dataframe(utilization_table(util).style.format("{:.0f}"), use_container_width=True)
 
 
 # ---------------------------
@@ -355,9 +282,7 @@ def add_transactions_ui(categories: list):
         inc_amount = st.number_input("Amount", min_value=0.0, step=100.0, key="inc_amount")
         if st.button("Add Income", use_container_width=True, type="primary"):
             if inc_source and inc_amount > 0:
-                df = read_income()
-                df = pd.concat([df, pd.DataFrame([{ 'date': inc_date, 'source': inc_source, 'amount': float(inc_amount)}])], ignore_index=True)
-                write_csv(df, INC_FILE)
+                write_queue.submit_append('income', [Income(inc_date, inc_source, inc_amount).as_row()])
                 st.success("Income added")
                 st.rerun()
             else:
@@ -371,98 +296,119 @@ def add_transactions_ui(categories: list):
         exp_amount = st.number_input("Amount ", min_value=0.0, step=100.0, key="exp_amount")
         if st.button("Add Expense", use_container_width=True, type="primary"):
             if exp_category and exp_amount > 0:
-                df = read_expenses()
-                df = pd.concat([df, pd.DataFrame([{ 'date': exp_date, 'category': exp_category, 'description': exp_desc, 'amount': float(exp_amount)}])], ignore_index=True)
-                write_csv(df, EXP_FILE)
+                write_queue.submit_append('expenses', [Expense(exp_date, exp_category, exp_desc, exp_amount).as_row()])
                 st.success("Expense added")
                 st.rerun()
             else:
                 st.error("Please provide a category and an amount > 0")
 
 
-def manage_expenses_ui(expenses: pd.DataFrame, categories: list):
-    st.subheader("Manage Expenses")
-    if expenses.empty:
-        st.info("No expenses yet.")
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def ledger_editor(ledger: str, column_config: dict, key: str, save_label: str):
+    """Paginated editor over one ledger.
+
+    Only the visible page is loaded from storage (sorted and searched there), and
+    only the rows that were edited or ticked for deletion are written back, by id.
+    """
+    columns = LEDGERS[ledger][1]
+    c1, c2, c3, c4 = st.columns([3, 2, 2, 1])
+    search = c1.text_input("Search", key=f"{key}_search", placeholder="Text in any column")
+    sort_by = c2.selectbox("Sort by", options=columns, index=0, key=f"{key}_sort")
+    order = c3.radio("Order", ["Descending", "Ascending"], horizontal=True, key=f"{key}_order")
+    page_size = c4.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_size")
+    page = st.number_input("Page", min_value=1, step=1, key=f"{key}_page")
+
+    # The loaded page is kept in session state while there are pending edits, since
+    # st.data_editor tracks edits by position on the page. It is refreshed when the
+    # view changes, or when the ledger changed underneath and nothing is pending.
+    view = (search, sort_by, order, page_size, page)
+    editor_key = f"{key}_editor_" + "_".join(map(str, view))
+    snap_key = f"{key}_snapshot"
+    fingerprint = ledger_fingerprint(ledger)
+    snap = st.session_state.get(snap_key)
+    pending = st.session_state.get(editor_key, {}).get('edited_rows')
+    if snap is None or snap['view'] != view or (snap['fingerprint'] != fingerprint and not pending):
+        rows, total = ledger_page(ledger, page, page_size, sort_by=sort_by,
+                                  ascending=order == "Ascending", search=search)
+        last_page = max((total - 1) // page_size + 1, 1)
+        if page > last_page:
+            rows, total = ledger_page(ledger, last_page, page_size, sort_by=sort_by,
+                                      ascending=order == "Ascending", search=search)
+        snap = {'view': view, 'fingerprint': fingerprint, 'rows': rows, 'total': total}
+        st.session_state[snap_key] = snap
+
+    rows, total = snap['rows'], snap['total']
+    if total == 0:
+        st.info("No matching rows." if search else f"No {ledger} yet.")
         return
+    first = (min(page, (total - 1) // page_size + 1) - 1) * page_size
+    st.caption(f"Rows {first + 1:,}–{first + len(rows):,} of {total:,}")
 
-    # Provide editing via data_editor
-    editable = expenses.copy()
-    editable = editable.sort_values('date', ascending=False).reset_index(drop=True)
-    editable['date'] = pd.to_datetime(editable['date'])
-
+    editable = rows.copy()
+    editable['delete'] = False
     edited = st.data_editor(
         editable,
-        column_config={
-            'date': st.column_config.DateColumn("date", format="YYYY-MM-DD"),
-            'category': st.column_config.SelectboxColumn("category", options=categories),
-            'description': st.column_config.TextColumn("description"),
-            'amount': st.column_config.NumberColumn("amount", step=100.0, min_value=0.0),
-        },
+        column_config={**column_config, 'delete': st.column_config.CheckboxColumn("delete")},
         use_container_width=True,
         num_rows="fixed",
-        key="expense_table",
+        key=editor_key,
     )
 
     col1, col2 = st.columns([1, 1])
     with col1:
-        if st.button("Save Changes", type="primary"):
-            # Normalize and save
-            edited['date'] = pd.to_datetime(edited['date']).dt.date
-            edited['amount'] = pd.to_numeric(edited['amount'], errors='coerce').fillna(0.0)
-            write_csv(edited, EXP_FILE)
-            st.success("Saved changes")
-            st.rerun()
+        save = st.button(save_label, type="primary", key=f"{key}_save")
     with col2:
-        del_idx = st.multiselect("Select rows to delete", options=edited.index.tolist(), help="Pick by row number from the table above")
-        if st.button("Delete Selected", type="secondary"):
-            remaining = edited.drop(index=del_idx)
-            remaining['date'] = pd.to_datetime(remaining['date']).dt.date
-            remaining['amount'] = pd.to_numeric(remaining['amount'], errors='coerce').fillna(0.0)
-            write_csv(remaining, EXP_FILE)
-            st.success(f"Deleted {len(del_idx)} rows")
-            st.rerun()
+        reload = st.button("Reload", key=f"{key}_reload")
+    if save:
+        deleted = edited.index[edited['delete'].astype(bool)]
+        kept = edited.drop(index=deleted, columns='delete')
+        kept[LEDGERS[ledger][2]] = parse_dates(kept[LEDGERS[ledger][2]])
+        changed, _ = row_delta(rows.drop(index=deleted), kept)
+        try:
+            n_changed, n_deleted = update_rows(ledger, changed, deleted, original=rows)
+        except (ConflictError, TimeoutError) as e:
+            st.error(str(e))
+            return
+        st.session_state.pop(snap_key, None)
+        st.session_state.pop(editor_key, None)
+        st.success(f"Saved {n_changed} changed and {n_deleted} deleted rows")
+        st.rerun()
+    if reload:
+        st.session_state.pop(snap_key, None)
+        st.session_state.pop(editor_key, None)
+        st.rerun()
 
 
-def manage_income_ui(income: pd.DataFrame):
-    st.subheader("Manage Income")
-    if income.empty:
-        st.info("No income yet.")
-        return
+def manage_expenses_ui(categories: list):
+    st.subheader("Manage Expenses")
+    ledger_editor(
+        'expenses',
+        column_config={
+            'date': st.column_config.DateColumn("date", format="YYYY-MM-DD"),
+            'category': st.column_config.SelectboxColumn("category", options=categories),
+            'description': st.column_config.TextColumn("description"),
+            'amount': st.column_config.NumberColumn("amount", step=100.0, min_value=0.0),
+        },
+        key="expense_table",
+        save_label="Save Changes",
+    )
 
-    editable = income.copy().sort_values('date', ascending=False).reset_index(drop=True)
-    editable['date'] = pd.to_datetime(editable['date'])
 
-    edited = st.data_editor(
-        editable,
+def manage_income_ui():
+    st.subheader("Manage Income")
+    ledger_editor(
+        'income',
         column_config={
             'date': st.column_config.DateColumn("date", format="YYYY-MM-DD"),
             'source': st.column_config.TextColumn("source"),
             'amount': st.column_config.NumberColumn("amount", step=100.0, min_value=0.0),
         },
-        use_container_width=True,
-        num_rows="fixed",
         key="income_table",
+        save_label="Save Income Changes",
     )
 
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        if st.button("Save Income Changes", type="primary"):
-            edited['date'] = pd.to_datetime(edited['date']).dt.date
-            edited['amount'] = pd.to_numeric(edited['amount'], errors='coerce').fillna(0.0)
-            write_csv(edited, INC_FILE)
-            st.success("Saved changes")
-            st.rerun()
-    with col2:
-        del_idx = st.multiselect("Select rows to delete", options=edited.index.tolist(), key="inc_del_idx")
-        if st.button("Delete Selected Income"):
-            remaining = edited.drop(index=del_idx)
-            remaining['date'] = pd.to_datetime(remaining['date']).dt.date
-            remaining['amount'] = pd.to_numeric(remaining['amount'], errors='coerce').fillna(0.0)
-            write_csv(remaining, INC_FILE)
-            st.success(f"Deleted {len(del_idx)} rows")
-            st.rerun()
-
 
 # ---------------------------
 # ---- Recurring UI  ----
@@ -485,7 +431,6 @@ def recurring_ui(categories: list):
         freq = st.selectbox("Frequency", options=["daily", "weekly", "monthly", "yearly"], index=2)
         next_dt = st.date_input("Next Date", value=date.today())
         if st.button("Add Recurring", type="primary"):
-            df = read_recurring()
             new = {
                 'type': r_type,
                 'category_or_source': name,
@@ -494,8 +439,8 @@ def recurring_ui(categories: list):
                 'frequency': freq,
                 'next_date': next_dt,
             }
-            df = pd.concat([df, pd.DataFrame([new])], ignore_index=True)
-            write_csv(df, REC_FILE)
+            append_ledger('recurring', [new])
+            reset_catch_up()
             st.success("Recurring transaction added")
             st.rerun()
 
@@ -505,10 +450,10 @@ def recurring_ui(categories: list):
         st.info("No recurring transactions configured.")
         return
 
-    rec_disp = rec.copy()
-    rec_disp['next_date'] = pd.to_datetime(rec_disp['next_date'])
+    editable = rec.copy()
+    editable['delete'] = False
     edited = st.data_editor(
-        rec_disp,
+        editable,
         column_config={
             'type': st.column_config.SelectboxColumn("type", options=['expense', 'income']),
             'category_or_source': st.column_config.TextColumn("category_or_source"),
@@ -516,87 +461,108 @@ def recurring_ui(categories: list):
             'amount': st.column_config.NumberColumn("amount", step=100.0, min_value=0.0),
             'frequency': st.column_config.SelectboxColumn("frequency", options=['daily', 'weekly', 'monthly', 'yearly']),
             'next_date': st.column_config.DateColumn("next_date", format="YYYY-MM-DD"),
+            'delete': st.column_config.CheckboxColumn("delete"),
         },
         use_container_width=True,
         num_rows="fixed",
         key="rec_table",
     )
 
-    col1, col2 = st.columns([1, 1])
-    with col1:
-        if st.button("Save Recurring Changes", type="primary"):
-            edited['next_date'] = pd.to_datetime(edited['next_date']).dt.date
-            edited['amount'] = pd.to_numeric(edited['amount'], errors='coerce').fillna(0.0)
-            write_csv(edited, REC_FILE)
-            st.success("Saved changes")
-            st.rerun()
-    with col2:
-        del_idx = st.multiselect("Select rows to delete", options=edited.index.tolist(), key="rec_del_idx")
-        if st.button("Delete Selected Recurring"):
-            remaining = edited.drop(index=del_idx)
-            remaining['next_date'] = pd.to_datetime(remaining['next_date']).dt.date
-            remaining['amount'] = pd.to_numeric(remaining['amount'], errors='coerce').fillna(0.0)
-            write_csv(remaining, REC_FILE)
-            st.success(f"Deleted {len(del_idx)} rows")
-            st.rerun()
+    if st.button("Save Recurring Changes", type="primary"):
+        deleted = edited.index[edited['delete'].astype(bool)]
+        kept = edited.drop(index=deleted, columns='delete')
+        kept['next_date'] = parse_dates(kept['next_date'])
+        changed, _ = row_delta(rec.drop(index=deleted), kept)
+        try:
+            n_changed, n_deleted = update_rows('recurring', changed, deleted, original=rec)
+        except (ConflictError, TimeoutError) as e:
+            st.error(str(e))
+            return
+        reset_catch_up()
+        st.success(f"Saved {n_changed} changed and {n_deleted} deleted rules")
+        st.rerun()
+
+
+FORECAST_HORIZONS = {"3 months": 91, "1 year": 365, "2 years": 730, "5 years": 1826}
+
+
+def forecast_ui():
+    st.write("### Balance Forecast")
+    st.caption("Current balance plus every recurring rule projected forward.")
+    horizon = st.radio("Horizon", list(FORECAST_HORIZONS), index=1, horizontal=True, key="forecast_horizon")
+    with metrics.stage('forecast'):
+        fc = forecast(FORECAST_HORIZONS[horizon])
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        kpi_card("Balance today", fc.opening)
+    with c2:
+        kpi_card(f"Balance on {fc.until:%Y-%m-%d}", fc.closing)
+    with c3:
+        st.metric("Goes negative", f"{fc.first_negative:%Y-%m-%d}" if fc.first_negative else "Never")
+    if fc.first_negative:
+        st.warning(f"The projected balance drops below zero on {fc.first_negative:%Y-%m-%d}.")
+    st.line_chart(downsample(fc.daily, MAX_CHART_POINTS, columns=['balance'])[['balance']])
+    with st.expander("Monthly projection"):
+        st.dataframe(fc.monthly.set_axis(fc.monthly.index.strftime('%Y-%m')).style.format("{:,.2f}"),
+                     use_container_width=True)
 
 
 # ---------------------------
 # ---- Import/Export  ----
 # ---------------------------
 
-def import_export_ui():
+def import_export_ui(exp_filters: dict, inc_filters: dict):
     st.subheader("Import / Export")
 
     st.markdown("#### Export Current Data")
-    exp_bytes = open(EXP_FILE, 'rb').read() if os.path.exists(EXP_FILE) else b''
-    inc_bytes = open(INC_FILE, 'rb').read() if os.path.exists(INC_FILE) else b''
-    rec_bytes = open(REC_FILE, 'rb').read() if os.path.exists(REC_FILE) else b''
-
-    st.download_button("Download expenses.csv", data=exp_bytes, file_name="expenses.csv")
-    st.download_button("Download income.csv", data=inc_bytes, file_name="income.csv")
-    st.download_button("Download recurring.csv", data=rec_bytes, file_name="recurring.csv")
+    st.caption("Exports are generated only when requested and streamed from storage in chunks.")
+    fmt = st.selectbox("Format", list(EXPORT_FORMATS), key="export_fmt")
+    use_filters = st.checkbox("Apply sidebar filters", value=False, key="export_filtered")
+
+    for ledger, filters in [('expenses', exp_filters), ('income', inc_filters), ('recurring', {})]:
+        name = export_filename(ledger, fmt)
+        request = (fmt, use_filters)
+        if st.button(f"Prepare {name}", key=f"prep_{ledger}"):
+            st.session_state[f"export_{ledger}"] = request
+        if st.session_state.get(f"export_{ledger}") == request:
+            try:
+                data = export_file(ledger, fmt, filters if use_filters else None)
+            except TimeoutError as e:
+                st.error(str(e))
+                continue
+            st.download_button(
+                f"Download {name}", data=data, file_name=name, mime=EXPORT_FORMATS[fmt][0],
+                key=f"dl_{ledger}", on_click=st.session_state.pop, args=(f"export_{ledger}", None),
+            )
 
     st.divider()
 
     st.markdown("#### Import / Merge CSVs")
-    st.caption("Uploaded rows are appended. Column names must match the target file.")
-
-    up_exp = st.file_uploader("Upload expenses.csv", type=['csv'], key="up_exp")
-    if up_exp is not None:
-        new = pd.read_csv(up_exp)
-        cur = read_expenses()
-        merged = pd.concat([cur, new], ignore_index=True)
-        # Normalize types
-        if not merged.empty:
-            merged['date'] = pd.to_datetime(merged['date']).dt.date
-            merged['amount'] = pd.to_numeric(merged['amount'], errors='coerce').fillna(0.0)
-        write_csv(merged, EXP_FILE)
-        st.success("Merged expenses.csv")
-        st.rerun()
-
-    up_inc = st.file_uploader("Upload income.csv", type=['csv'], key="up_inc")
-    if up_inc is not None:
-        new = pd.read_csv(up_inc)
-        cur = read_income()
-        merged = pd.concat([cur, new], ignore_index=True)
-        if not merged.empty:
-            merged['date'] = pd.to_datetime(merged['date']).dt.date
-            merged['amount'] = pd.to_numeric(merged['amount'], errors='coerce').fillna(0.0)
-        write_csv(merged, INC_FILE)
-        st.success("Merged income.csv")
-        st.rerun()
-
-    up_rec = st.file_uploader("Upload recurring.csv", type=['csv'], key="up_rec")
-    if up_rec is not None:
-        new = pd.read_csv(up_rec)
-        cur = read_recurring()
-        merged = pd.concat([cur, new], ignore_index=True)
-        if not merged.empty:
-            merged['amount'] = pd.to_numeric(merged['amount'], errors='coerce').fillna(0.0)
-            merged['next_date'] = pd.to_datetime(merged['next_date']).dt.date
-        write_csv(merged, REC_FILE)
-        st.success("Merged recurring.csv")
+    st.caption("Uploaded rows are appended in chunks. Column names must match the target file; "
+               "rows already in the ledger are skipped and invalid rows are rejected.")
+
+    report = st.session_state.pop('import_report', None)
+    if report:
+        st.success(report)
+
+    for ledger in ['expenses', 'income', 'recurring']:
+        upload = st.file_uploader(f"Upload {ledger}.csv", type=['csv'], key=f"up_{ledger}")
+        # The uploader keeps its file across reruns; import each upload only once
+        if upload is None or st.session_state.get(f"imported_{ledger}") == upload.file_id:
+            continue
+        try:
+            result = import_csv(upload, ledger)
+        except (ValueError, TimeoutError) as e:
+            st.error(str(e))
+            continue
+        st.session_state[f"imported_{ledger}"] = upload.file_id
+        if ledger == 'recurring':
+            reset_catch_up()
+        st.session_state['import_report'] = (
+            f"{ledger}.csv: inserted {result.inserted}, skipped {result.skipped} duplicates, "
+            f"rejected {result.rejected} invalid rows"
+        )
         st.rerun()
 
 
@@ -619,7 +585,11 @@ def settings_ui():
         if len(new_cats) == 0:
             st.error("You must have at least one category.")
         else:
-            save_categories(new_cats)
+            changed, removed, added = frame_edits(df, edited, 'category')
+            renamed = {df.at[i, 'category']: str(changed.at[i, 'category']).strip() for i in changed.index}
+            removed += [old for old, new in renamed.items() if not new]
+            added = [str(c).strip() for c in added['category'] if str(c).strip()]
+            update_categories({k: v for k, v in renamed.items() if v}, removed, added)
             st.success("Saved categories")
             st.rerun()
 
@@ -628,56 +598,116 @@ def settings_ui():
 # ---- Main App  ----
 # ---------------------------
 
+DEBUG_PANEL_KEY = "metrics_debug"
+
+
+def metrics_panel(run):
+    """Sidebar table of this rerun's stages (the panel itself is not included)."""
+    with st.sidebar.expander("Performance", expanded=True):
+        df = pd.DataFrame([s.as_dict() for s in run.stages], columns=['stage', 'seconds', 'rows', 'bytes'])
+        df['ms'] = df.pop('seconds') * 1000
+        st.dataframe(df.style.format({'ms': "{:,.1f}", 'rows': "{:,}", 'bytes': "{:,}"}),
+                     hide_index=True, use_container_width=True)
+        st.caption(f"Rerun so far: {(time.time() - run.started) * 1000:,.1f} ms")
+
+
+def conversion_notice():
+    # Legacy ledgers are converted on their first load; report rows that had to be left out
+    for ledger in list(ingest_reports):
+        report = ingest_reports.pop(ledger, None)
+        if report is not None and report.rejected:
+            st.warning(f"Converted **{ledger}** from the {report.layout} CSV layout: {report.rows:,} rows kept, "
+                       f"{len(report.rejected):,} unreadable rows moved to "
+                       f"`{rejected_path(LEDGERS[ledger][0])}`.")
+
+
+def write_failures_notice():
+    # Batches the write-behind queue gave up on are kept until retried or discarded
+    failed = write_queue.failed_writes()
+    if not failed:
+        return
+    for f in failed:
+        st.error(f"{len(f.rows):,} {f.ledger} rows could not be saved: {f.error}")
+    c1, c2, _ = st.columns([1, 1, 4])
+    if c1.button("Retry saving", key="retry_failed_writes"):
+        write_queue.retry_failed()
+        st.rerun()
+    if c2.button("Discard unsaved rows", key="discard_failed_writes"):
+        write_queue.discard_failed()
+        st.rerun()
+
+
 def main():
-    ensure_files_exist()
+    # The debug panel is opened with ?debug=1 and records this session's reruns
+    # even when EXPENSE_TRACKER_METRICS is off
+    debug = st.query_params.get("debug") == "1" or st.session_state.get(DEBUG_PANEL_KEY, False)
+    st.session_state[DEBUG_PANEL_KEY] = debug
+    with metrics.rerun(force=debug) as run:
+        render(run)
 
-    # Apply recurring transactions that are due
-    process_recurring_transactions()
 
-    categories = load_categories()
-    expenses = read_expenses()
-    income = read_income()
+def render(run=None):
+    with metrics.stage('ensure_files'):
+        ensure_files_exist()
 
-    # Sidebar filters
-    start_date, end_date, cat_sel, min_amt, max_amt = sidebar_filters(expenses, income, categories)
+    # Apply recurring transactions that are due (at most once per day per ledger)
+    with metrics.stage('recurring'):
+        run_catch_up()
 
-    # Filtered views
-    expenses_f = apply_filters(expenses, start_date, end_date, cat_sel, min_amt, max_amt)
-    # For income, only filter by date/amount (no category)
-    income_f = income.copy()
-    if not income_f.empty:
-        income_f = income_f[(income_f['date'] >= start_date) & (income_f['date'] <= end_date)]
+    with metrics.stage('load_categories'):
+        categories = load_categories()
+
+    # Sidebar filters
+    with metrics.stage('sidebar_filters'):
+        start_date, end_date, cat_sel, min_amt, max_amt, search = sidebar_filters(categories)
+    exp_filters = dict(start_date=start_date, end_date=end_date, categories=cat_sel, min_amt=min_amt, max_amt=max_amt)
+    # For income, only filter by date (no category)
+    inc_filters = dict(start_date=start_date, end_date=end_date)
+    if search:
+        # Matches from the inverted index, combined with the other filters by id
+        with metrics.stage('search'):
+            exp_filters['ids'] = search_index.search('expenses', search)
+            inc_filters['ids'] = search_index.search('income', search)
+            metrics.count(rows=len(exp_filters['ids']) + len(inc_filters['ids']))
+        st.sidebar.caption(f"Search matches {len(exp_filters['ids']):,} expenses and {len(inc_filters['ids']):,} income rows")
 
     # Header
     st.title("💸 Expense Tracker")
     st.caption("CSV-backed personal finance app with budgets, recurring transactions, filters, charts, and import/export.")
+    conversion_notice()
+    write_failures_notice()
 
     tabs = st.tabs(["Dashboard", "Add", "Expenses", "Income", "Budgets", "Recurring", "Import/Export", "Settings"]) 
 
-    with tabs[0]:
-        dashboard(expenses_f, income_f)
+    # Streamlit runs every tab's body on each rerun, so each is timed as its own stage
+    with tabs[0], metrics.stage('tab/dashboard'):
+        dashboard(exp_filters, inc_filters)
 
-    with tabs[1]:
+    with tabs[1], metrics.stage('tab/add'):
         add_transactions_ui(categories)
 
-    with tabs[2]:
-        manage_expenses_ui(expenses, categories)
+    with tabs[2], metrics.stage('tab/expenses'):
+        manage_expenses_ui(categories)
 
-    with tabs[3]:
-        manage_income_ui(income)
+    with tabs[3], metrics.stage('tab/income'):
+        manage_income_ui()
 
-    with tabs[4]:
-        budgets_ui(categories, expenses)
+    with tabs[4], metrics.stage('tab/budgets'):
+        budgets_ui(categories)
 
-    with tabs[5]:
+    with tabs[5], metrics.stage('tab/recurring'):
         recurring_ui(categories)
+        forecast_ui()
 
-    with tabs[6]:
-        import_export_ui()
+    with tabs[6], metrics.stage('tab/import_export'):
+        import_export_ui(exp_filters, inc_filters)
 
-    with tabs[7]:
+    with tabs[7], metrics.stage('tab/settings'):
         settings_ui()
 
+    if run is not None and st.session_state.get(DEBUG_PANEL_KEY):
+        metrics_panel(run)
+
 
 if __name__ == "__main__":
     main()
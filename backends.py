@@ -0,0 +1,1210 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from ledger import IngestReport, in_app_format, ingest_csv, parse_dates, read_csv
+from storage import (ID_COLUMN, LEDGERS, append_journal, append_rejected, append_rows, cached_load, drop_journal,
+                     file_fingerprint, file_lock, invalidate, journal_path, maybe_compact, new_ids, read_json,
+                     write_csv, write_json_atomic)
+
+# Storage engine selection. CSV stays the default and the import/export format.
+STORAGE_BACKEND = os.environ.get('EXPENSE_TRACKER_STORAGE', 'csv').strip().lower()
+SQLITE_FILE = os.environ.get('EXPENSE_TRACKER_DB', 'ledger.db')
+PARTITION_DIR = os.environ.get('EXPENSE_TRACKER_PARTITIONS', 'partitions')
+# How long writes and exports wait for rows still in the write-behind queue
+FLUSH_TIMEOUT = float(os.environ.get('EXPENSE_TRACKER_FLUSH_TIMEOUT', '30'))
+
+# ---------------------------
+# ---- Shared Helpers  ----
+# ---------------------------
+
+def empty_frame(ledger: str) -> pd.DataFrame:
+    _, columns, date_col = LEDGERS[ledger]
+    df = pd.DataFrame(columns=columns, index=pd.Index([], dtype=object, name=ID_COLUMN))
+    df[date_col] = df[date_col].astype('datetime64[ns]')
+    df['amount'] = df['amount'].astype(float)
+    return df
+
+
+def with_ids(df: pd.DataFrame) -> pd.DataFrame:
+    """``df`` indexed by row id, assigning fresh ids unless it already carries them."""
+    if df.index.name == ID_COLUMN:
+        return df
+    df = df.copy()
+    df.index = pd.Index(new_ids(len(df)), name=ID_COLUMN)
+    return df
+
+
+def _day(value) -> str:
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def coerce_frame(df: pd.DataFrame, ledger: str) -> pd.DataFrame:
+    """Project a raw frame onto the ledger schema and parse its date column."""
+    _, columns, date_col = LEDGERS[ledger]
+    if df.empty or not all(col in df.columns for col in columns):
+        return empty_frame(ledger)
+    df = df[columns].copy()
+    df[date_col] = parse_dates(df[date_col])
+    return df
+
+
+def filter_frame(df: pd.DataFrame, start_date: date = None, end_date: date = None,
+                 categories: list = None, min_amt: float = 0.0, max_amt: float = 0.0, ids=None):
+    """In-memory equivalent of the SQL WHERE clause built by SqliteBackend.
+
+    ``ids`` (e.g. search matches) restricts the result to those rows; they are
+    looked up in the index first, so the other predicates only see the matches.
+    """
+    if df.empty:
+        return df
+    if ids is not None:
+        pos = df.index.get_indexer(pd.Index(list(ids), dtype=object))
+        df = df.iloc[np.sort(pos[pos >= 0])]
+    mask = pd.Series(True, index=df.index)
+    if start_date is not None:
+        mask &= df['date'] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        mask &= df['date'] <= pd.Timestamp(end_date)
+    if 'category' in df.columns and categories:
+        mask &= df['category'].isin(categories)
+    if 'amount' in df.columns:
+        mask &= df['amount'] >= min_amt
+        if max_amt > 0:
+            mask &= df['amount'] <= max_amt
+    return df.loc[mask].copy()
+
+
+def text_columns(ledger: str) -> list:
+    """Free-text columns of a ledger, i.e. everything but the date and amount."""
+    _, columns, date_col = LEDGERS[ledger]
+    return [c for c in columns if c not in (date_col, 'amount')]
+
+
+def search_mask(df: pd.DataFrame, ledger: str, search: str) -> pd.Series:
+    """Rows whose text columns contain ``search`` (case-insensitive, literal)."""
+    mask = pd.Series(False, index=df.index)
+    for col in text_columns(ledger):
+        mask |= df[col].fillna('').astype(str).str.contains(search, case=False, regex=False)
+    return mask
+
+
+def _check_sort(ledger: str, sort_by):
+    if sort_by is not None and sort_by not in LEDGERS[ledger][1]:
+        raise ValueError(f"Unknown column for {ledger}: {sort_by}")
+
+
+def _sort_order(df: pd.DataFrame, sort_by, ascending: bool) -> np.ndarray:
+    """Row positions of ``df`` in sort order (row order when ``sort_by`` is None)."""
+    if sort_by is None:
+        order = np.arange(len(df))
+    else:
+        values = df[sort_by].reset_index(drop=True)
+        order = values.sort_values(kind='stable', na_position='first').index.to_numpy()
+    # Ties keep row order in the sort direction, missing values sort lowest
+    return order if ascending else order[::-1].copy()
+
+
+def cached_read(backend, ledger: str) -> pd.DataFrame:
+    """Full ledger via ``backend``, memoized on the fingerprint of its backing file."""
+    return cached_load(backend.fingerprint_path(ledger), lambda: backend.read(ledger),
+                       name=f'{backend.name}:{ledger}')
+
+
+def _to_records(df: pd.DataFrame, ledger: str, id_first: bool = False) -> list:
+    """Rows as tuples of SQLite-friendly values (ISO dates, float amounts, NULLs).
+
+    The row id comes last (table column order), or first with ``id_first``.
+    """
+    _, columns, date_col = LEDGERS[ledger]
+    out = df.reindex(columns=columns).copy()
+    out[date_col] = parse_dates(out[date_col]).dt.strftime('%Y-%m-%d')
+    out['amount'] = pd.to_numeric(out['amount'], errors='coerce').fillna(0.0)
+    out = out.astype(object).where(out.notna(), None)
+    ids = out.index.to_numpy()
+    if id_first:
+        out.insert(0, ID_COLUMN, ids)
+    else:
+        out[ID_COLUMN] = ids
+    return list(out.itertuples(index=False, name=None))
+
+
+# ---------------------------
+# ---- CSV Engine  ----
+# ---------------------------
+
+# The edit journal is folded into the CSV once it exceeds this size or a quarter
+# of the ledger, whichever is larger
+JOURNAL_MAX_BYTES = 256 * 1024
+
+
+# Reports of ledgers converted to the app format in this process, by ledger
+ingest_reports = {}
+
+
+class CsvBackend:
+    """One CSV file per ledger; filters and aggregates run in pandas."""
+
+    name = 'csv'
+
+    def fingerprint_path(self, ledger: str) -> str:
+        return LEDGERS[ledger][0]
+
+    def ensure(self):
+        for ledger, (path, columns, _) in LEDGERS.items():
+            if not os.path.exists(path):
+                pd.DataFrame(columns=columns + [ID_COLUMN]).to_csv(path, index=False)
+
+    def read(self, ledger: str) -> pd.DataFrame:
+        path = LEDGERS[ledger][0]
+        # Under the ledger lock so an in-progress append is never read half-written
+        with file_lock(path):
+            try:
+                df = read_csv(path, ledger)
+            except FileNotFoundError:
+                self.ensure()
+                return empty_frame(ledger)
+            except pd.errors.ParserError:
+                df = None
+            if df is not None and ID_COLUMN in df.columns:
+                df = df.set_index(ID_COLUMN)
+            if df is None or not in_app_format(df, ledger):
+                # Old CLI or hand-edited layout: convert once, later loads take the fast path
+                self.convert(ledger)
+                df = read_csv(path, ledger).set_index(ID_COLUMN)
+            journal = self._read_journal(path)
+            if journal is not None:
+                df = self._apply_journal(df, journal)
+        return coerce_frame(df, ledger)
+
+    def convert(self, ledger: str) -> IngestReport:
+        """Rewrite the ledger's CSV in the app format (header, ISO dates, row ids).
+
+        Reads whatever layout the file is in with ``ingest_csv``; rows that cannot be
+        read are moved to ``<ledger>.rejected.csv``. Ids already in the file are kept,
+        so the edit journal still applies. The report is kept in ``ingest_reports``.
+        """
+        path, columns, date_col = LEDGERS[ledger]
+        with file_lock(path):
+            df, report = ingest_csv(path, ledger)
+            out = df.reindex(columns=columns)
+            out[date_col] = out[date_col].dt.strftime('%Y-%m-%d')
+            out[ID_COLUMN] = out.index
+            append_rejected(path, report.rejected)
+            write_csv(out, path)
+        ingest_reports[ledger] = report
+        return report
+
+    def _read_journal(self, path: str):
+        """Last journal entry per id (op plus columns), or None without a journal."""
+        try:
+            journal = pd.read_csv(journal_path(path), dtype={ID_COLUMN: str})
+        except FileNotFoundError:
+            return None
+        return journal.drop_duplicates(ID_COLUMN, keep='last').set_index(ID_COLUMN)
+
+    def _apply_journal(self, df: pd.DataFrame, last: pd.DataFrame) -> pd.DataFrame:
+        puts = last[(last['op'] == 'put') & last.index.isin(df.index)]
+        cols = [c for c in df.columns if c in puts.columns]
+        df = df.copy()
+        for col in cols:
+            if df[col].dtype != puts[col].dtype:
+                # e.g. whole-number amounts read as int64, or an all-empty text column read
+                # as float64: newer pandas refuses to upcast on assignment
+                df[col] = df[col].astype(float if col == 'amount' else object)
+        df.loc[puts.index, cols] = puts[cols]
+        return df.drop(index=last.index[(last['op'] == 'del') & last.index.isin(df.index)])
+
+    def write(self, ledger: str, df: pd.DataFrame):
+        path, columns, _ = LEDGERS[ledger]
+        out = with_ids(df).reindex(columns=columns)
+        out[ID_COLUMN] = out.index
+        with file_lock(path):
+            write_csv(out, path)
+            drop_journal(path)
+
+    def append(self, ledger: str, rows) -> int:
+        path, columns, _ = LEDGERS[ledger]
+        if isinstance(rows, pd.DataFrame):
+            rows = with_ids(rows).reset_index()
+        return append_rows(path, rows, columns + [ID_COLUMN])
+
+    def rows(self, ledger: str, ids) -> pd.DataFrame:
+        df = cached_read(self, ledger)
+        return df.loc[df.index.intersection(pd.Index(list(ids)))]
+
+    def update(self, ledger: str, changed: pd.DataFrame, deleted=()):
+        """Record edits and deletions in the ledger's journal; compact it when it grows."""
+        path, columns, date_col = LEDGERS[ledger]
+        out = changed.reindex(columns=columns).copy()
+        out[date_col] = parse_dates(out[date_col])
+        out[ID_COLUMN] = out.index
+        with file_lock(path):
+            live = len(cached_read(self, ledger)) - len(deleted) if len(deleted) else None
+            append_journal(path, columns, puts=out.to_dict('records'), deletes=list(deleted))
+            if os.path.getsize(journal_path(path)) > max(JOURNAL_MAX_BYTES, os.path.getsize(path) // 4):
+                self.write(ledger, self.read(ledger))
+            elif live is not None:
+                maybe_compact(path, live)  # many tombstones: fold them in early
+
+    def query(self, ledger: str, **filters) -> pd.DataFrame:
+        return filter_frame(cached_read(self, ledger), **filters)
+
+    def totals(self, ledger: str, by: str, **filters) -> pd.DataFrame:
+        df = self.query(ledger, **filters)
+        if df.empty:
+            return pd.DataFrame(columns=[by, 'amount'])
+        return df.groupby(by, as_index=False)['amount'].sum()
+
+    def date_bounds(self, ledger: str):
+        df = cached_read(self, ledger)
+        col = LEDGERS[ledger][2]
+        lo, hi = df[col].min(), df[col].max()
+        if df.empty or pd.isna(lo):
+            return None, None
+        return lo.date(), hi.date()
+
+    def iter_query(self, ledger: str, chunk_rows: int, **filters):
+        """Like ``query`` but reads the CSV ``chunk_rows`` rows at a time, so memory stays bounded.
+
+        The journal is applied chunk by chunk, under the ledger lock for the whole
+        scan. A chunk that is not in the app format (see ``read``) has the file
+        converted, and the scan resumes after the rows already yielded.
+        """
+        path, _, date_col = LEDGERS[ledger]
+        with file_lock(path):
+            journal = self._read_journal(path)
+            done = dropped = 0  # rows yielded so far, and those among them a conversion drops
+            skip, converted = 0, False
+            while True:
+                try:
+                    for chunk in pd.read_csv(path, dtype={ID_COLUMN: str}, chunksize=chunk_rows):
+                        if skip:
+                            # Resuming after a conversion: these rows were yielded already
+                            chunk, skip = chunk.iloc[skip:], max(skip - len(chunk), 0)
+                            if chunk.empty:
+                                continue
+                        if ID_COLUMN in chunk.columns:
+                            chunk = chunk.set_index(ID_COLUMN)
+                        if not in_app_format(chunk, ledger):
+                            raise pd.errors.ParserError(f"{path} is not in the app format")
+                        df = coerce_frame(chunk if journal is None else self._apply_journal(chunk, journal), ledger)
+                        if not converted:
+                            # ingest_csv leaves out rows with an unreadable date or amount
+                            raw = df if journal is None else coerce_frame(chunk, ledger)
+                            dropped += int((raw[date_col].isna() | pd.to_numeric(raw['amount'], errors='coerce')
+                                            .isna()).sum())
+                            done += len(chunk)
+                        df = filter_frame(df, **filters)
+                        if not df.empty:
+                            yield df
+                    return
+                except (FileNotFoundError, pd.errors.EmptyDataError):
+                    return
+                except pd.errors.ParserError:
+                    if converted:
+                        raise
+                    self.convert(ledger)
+                    skip, converted = done - dropped, True
+
+    def _order(self, ledger: str, sort_by, ascending: bool) -> np.ndarray:
+        """Row positions in sort order, memoized per column and direction."""
+        return cached_load(self.fingerprint_path(ledger),
+                           lambda: _sort_order(cached_read(self, ledger), sort_by, ascending),
+                           name=f'{self.name}:{ledger}:order:{sort_by}:{ascending}')
+
+    def page(self, ledger: str, offset: int, limit: int, sort_by: str = None,
+             ascending: bool = True, search: str = None):
+        """One page of rows (indexed by row id) and the number of matching rows."""
+        _check_sort(ledger, sort_by)
+        df = cached_read(self, ledger)
+        order = self._order(ledger, sort_by, ascending)
+        if search:
+            order = order[search_mask(df, ledger, search).to_numpy()[order]]
+        return df.iloc[order[offset:offset + limit]], len(order)
+
+
+# ---------------------------
+# ---- SQLite Engine  ----
+# ---------------------------
+
+_SQL_TYPES = {'amount': 'REAL'}
+_SQL_CHUNK = 500  # ids per IN (...) / executemany batch
+
+# Secondary indexes per ledger; 'category' is the grouping key for expenses,
+# 'source' plays the same role for income.
+_SQL_INDEXES = {
+    'expenses': [('date',), ('category',), ('category', 'date')],
+    'income': [('date',), ('source',)],
+    'recurring': [('next_date',)],
+}
+
+
+class SqliteBackend:
+    """All ledgers in one SQLite file; filters and group-by sums are pushed into SQL."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = SQLITE_FILE):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def fingerprint_path(self, ledger: str) -> str:
+        return self.path
+
+    def ensure(self):
+        with self._init_lock:
+            if self._ready and os.path.exists(self.path):
+                return
+            is_new = not os.path.exists(self.path)
+            with self._connect() as con, con:
+                for ledger, (_, columns, _) in LEDGERS.items():
+                    cols = ", ".join(f'"{c}" {_SQL_TYPES.get(c, "TEXT")}' for c in columns + [ID_COLUMN])
+                    con.execute(f'CREATE TABLE IF NOT EXISTS {ledger} ({cols})')
+                    existing = [row[1] for row in con.execute(f'PRAGMA table_info({ledger})')]
+                    if ID_COLUMN not in existing:
+                        # Database created before row ids existed
+                        con.execute(f'ALTER TABLE {ledger} ADD COLUMN {ID_COLUMN} TEXT')
+                        con.execute(f'UPDATE {ledger} SET {ID_COLUMN} = lower(hex(randomblob(8)))')
+                    con.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{ledger}_{ID_COLUMN} ON {ledger} ({ID_COLUMN})')
+                    for idx_cols in _SQL_INDEXES[ledger]:
+                        name = f'idx_{ledger}_{"_".join(idx_cols)}'
+                        con.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {ledger} ({", ".join(idx_cols)})')
+            self._ready = True
+        if is_new:
+            # Seed a fresh database from the CSV ledgers, if any
+            csv_engine = CsvBackend()
+            for ledger, (path, _, _) in LEDGERS.items():
+                if os.path.exists(path):
+                    self.append(ledger, csv_engine.read(ledger))
+
+    def read(self, ledger: str) -> pd.DataFrame:
+        self.ensure()
+        with self._connect() as con:
+            df = pd.read_sql_query(f'SELECT * FROM {ledger} ORDER BY rowid', con, index_col=ID_COLUMN)
+        if df.empty:
+            return empty_frame(ledger)
+        return coerce_frame(df, ledger)
+
+    def write(self, ledger: str, df: pd.DataFrame):
+        self.ensure()
+        df = with_ids(df)
+        columns = LEDGERS[ledger][1] + [ID_COLUMN]
+        placeholders = ", ".join("?" for _ in columns)
+        with self._connect() as con, con:
+            con.execute(f'DELETE FROM {ledger}')
+            con.executemany(f'INSERT INTO {ledger} VALUES ({placeholders})', _to_records(df, ledger))
+        invalidate(self.path)
+
+    def append(self, ledger: str, rows) -> int:
+        self.ensure()
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+        if df.empty:
+            return 0
+        df = with_ids(df)
+        columns = LEDGERS[ledger][1] + [ID_COLUMN]
+        placeholders = ", ".join("?" for _ in columns)
+        records = _to_records(df, ledger)
+        with self._connect() as con, con:
+            con.executemany(f'INSERT INTO {ledger} VALUES ({placeholders})', records)
+        invalidate(self.path)
+        return len(records)
+
+    def rows(self, ledger: str, ids) -> pd.DataFrame:
+        """Current version of the rows with the given ids, via the id index."""
+        self.ensure()
+        ids = list(ids)
+        frames = []
+        with self._connect() as con:
+            for start in range(0, len(ids), _SQL_CHUNK):
+                batch = ids[start:start + _SQL_CHUNK]
+                sql = f'SELECT * FROM {ledger} WHERE {ID_COLUMN} IN ({", ".join("?" for _ in batch)})'
+                frames.append(pd.read_sql_query(sql, con, params=batch, index_col=ID_COLUMN))
+        df = pd.concat(frames) if frames else None
+        if df is None or df.empty:
+            return empty_frame(ledger)
+        return coerce_frame(df, ledger)
+
+    def update(self, ledger: str, changed: pd.DataFrame, deleted=()):
+        """UPDATE/DELETE only the given ids, in one transaction."""
+        self.ensure()
+        columns = LEDGERS[ledger][1]
+        assignments = ", ".join(f'"{c}" = ?' for c in columns)
+        records = _to_records(changed, ledger)
+        with self._connect() as con, con:
+            con.executemany(f'UPDATE {ledger} SET {assignments} WHERE {ID_COLUMN} = ?', records)
+            con.executemany(f'DELETE FROM {ledger} WHERE {ID_COLUMN} = ?', [(i,) for i in deleted])
+        invalidate(self.path)
+
+    def _where(self, ledger: str, start_date=None, end_date=None, categories=None,
+               min_amt: float = 0.0, max_amt: float = 0.0, ids=None):
+        columns = LEDGERS[ledger][1]
+        date_col = LEDGERS[ledger][2]
+        clauses, params = [], []
+        if start_date is not None:
+            clauses.append(f'{date_col} >= ?')
+            params.append(_day(start_date))
+        if end_date is not None:
+            clauses.append(f'{date_col} <= ?')
+            params.append(_day(end_date))
+        if 'category' in columns and categories:
+            clauses.append(f'category IN ({", ".join("?" for _ in categories)})')
+            params.extend(categories)
+        clauses.append('amount >= ?')
+        params.append(float(min_amt))
+        if max_amt > 0:
+            clauses.append('amount <= ?')
+            params.append(float(max_amt))
+        if ids is not None:
+            # One JSON parameter instead of a placeholder per id; probed via the id index
+            clauses.append(f'{ID_COLUMN} IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps([str(i) for i in ids]))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, ledger: str, **filters) -> pd.DataFrame:
+        self.ensure()
+        where, params = self._where(ledger, **filters)
+        with self._connect() as con:
+            df = pd.read_sql_query(f'SELECT * FROM {ledger}{where} ORDER BY rowid', con, params=params,
+                                   index_col=ID_COLUMN)
+        if df.empty:
+            return empty_frame(ledger)
+        return coerce_frame(df, ledger)
+
+    def totals(self, ledger: str, by: str, **filters) -> pd.DataFrame:
+        if by not in LEDGERS[ledger][1]:
+            raise ValueError(f"Unknown column for {ledger}: {by}")
+        self.ensure()
+        where, params = self._where(ledger, **filters)
+        sql = f'SELECT {by}, SUM(amount) AS amount FROM {ledger}{where} GROUP BY {by}'
+        with self._connect() as con:
+            df = pd.read_sql_query(sql, con, params=params)
+        if by in ('date', 'next_date') and not df.empty:
+            df[by] = parse_dates(df[by])
+        return df
+
+    def date_bounds(self, ledger: str):
+        self.ensure()
+        date_col = LEDGERS[ledger][2]
+        with self._connect() as con:
+            lo, hi = con.execute(f'SELECT MIN({date_col}), MAX({date_col}) FROM {ledger}').fetchone()
+        if lo is None:
+            return None, None
+        return date.fromisoformat(lo), date.fromisoformat(hi)
+
+    def iter_query(self, ledger: str, chunk_rows: int, **filters):
+        """Like ``query`` but yields frames of at most ``chunk_rows`` rows from a cursor."""
+        self.ensure()
+        where, params = self._where(ledger, **filters)
+        with self._connect() as con:
+            for chunk in pd.read_sql_query(f'SELECT * FROM {ledger}{where} ORDER BY rowid', con,
+                                           params=params, chunksize=chunk_rows, index_col=ID_COLUMN):
+                yield coerce_frame(chunk, ledger)
+
+    def page(self, ledger: str, offset: int, limit: int, sort_by: str = None,
+             ascending: bool = True, search: str = None):
+        """One page of rows (indexed by row id) and the number of matching rows.
+
+        Sorting, searching and slicing all happen in SQL, so only the page is read.
+        """
+        _check_sort(ledger, sort_by)
+        self.ensure()
+        where, params = '', []
+        if search:
+            cols = text_columns(ledger)
+            pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where = ' WHERE ' + ' OR '.join(f'"{c}" LIKE ? ESCAPE \'\\\'' for c in cols)
+            params = [pattern] * len(cols)
+        direction = 'ASC' if ascending else 'DESC'
+        order = f' ORDER BY "{sort_by}" {direction}, rowid {direction}' if sort_by else f' ORDER BY rowid {direction}'
+        with self._connect() as con:
+            total = con.execute(f'SELECT COUNT(*) FROM {ledger}{where}', params).fetchone()[0]
+            df = pd.read_sql_query(f'SELECT * FROM {ledger}{where}{order} LIMIT ? OFFSET ?',
+                                   con, params=params + [int(limit), int(offset)], index_col=ID_COLUMN)
+        if df.empty:
+            return empty_frame(ledger), total
+        return coerce_frame(df, ledger), total
+
+
+# ---------------------------
+# ---- Partitioned Engine  ----
+# ---------------------------
+# One CSV per ledger and year-month under PARTITION_DIR/<ledger>/, plus a manifest
+# with the row count, date range and amount total of each partition:
+#   {"partitions": {"2024-01": {"rows": 812, "min_date": "2024-01-01",
+#                               "max_date": "2024-01-31", "amount": 40213.5}, ...}}
+# Rows whose date does not parse go to the "undated" partition. The manifest is
+# rewritten atomically on every write, so it doubles as the ledger's fingerprint.
+# ids.csv maps row ids to their partition (id, partition; the last line per id
+# wins, an empty partition marks a deleted row) so reads by id open only the
+# partitions holding those rows. Appends and edits add lines, full writes
+# rewrite it, and a layout without one builds it on first use.
+
+UNDATED = 'undated'
+
+
+def _partition_keys(dates: pd.Series) -> pd.Series:
+    return dates.dt.strftime('%Y-%m').fillna(UNDATED)
+
+
+def _merge_stats(a: dict, b: dict) -> dict:
+    if not a:
+        return b
+    lows = [d for d in (a['min_date'], b['min_date']) if d]
+    highs = [d for d in (a['max_date'], b['max_date']) if d]
+    return {
+        'rows': a['rows'] + b['rows'],
+        'min_date': min(lows) if lows else None,
+        'max_date': max(highs) if highs else None,
+        'amount': round(a['amount'] + b['amount'], 2),
+    }
+
+
+class PartitionedBackend(CsvBackend):
+    """Month-partitioned CSVs; date-range reads open only the overlapping partitions."""
+
+    name = 'partitioned'
+
+    def __init__(self, root: str = PARTITION_DIR):
+        self.root = root
+
+    def _dir(self, ledger: str) -> str:
+        return os.path.join(self.root, ledger)
+
+    def _part_path(self, ledger: str, key: str) -> str:
+        return os.path.join(self._dir(ledger), f'{key}.csv')
+
+    def fingerprint_path(self, ledger: str) -> str:
+        return os.path.join(self._dir(ledger), 'manifest.json')
+
+    def _ids_path(self, ledger: str) -> str:
+        return os.path.join(self._dir(ledger), 'ids.csv')
+
+    def manifest(self, ledger: str) -> dict:
+        """Partition key -> stats, in key order (``undated`` last)."""
+        parts = cached_load(self.fingerprint_path(ledger),
+                            lambda: read_json(self.fingerprint_path(ledger), {}).get('partitions', {}),
+                            name=f'{self.name}:{ledger}:manifest')
+        return dict(sorted(parts.items(), key=lambda kv: (kv[0] == UNDATED, kv[0])))
+
+    def ensure(self):
+        for ledger, (flat, _, _) in LEDGERS.items():
+            manifest = self.fingerprint_path(ledger)
+            if os.path.exists(manifest):
+                continue
+            os.makedirs(self._dir(ledger), exist_ok=True)
+            with file_lock(manifest):
+                if not os.path.exists(manifest):
+                    # Seed a new layout from the flat CSV ledger, if any
+                    df = CsvBackend().read(ledger) if os.path.exists(flat) else empty_frame(ledger)
+                    self._write_parts(ledger, df, {})
+
+    def _read_part(self, ledger: str, key: str) -> pd.DataFrame:
+        path = self._part_path(ledger, key)
+
+        def load():
+            try:
+                df = read_csv(path, ledger)
+            except FileNotFoundError:
+                return empty_frame(ledger)
+            return coerce_frame(df.set_index(ID_COLUMN), ledger)
+
+        return cached_load(path, load, name=f'{self.name}:{ledger}:part')
+
+    def _stats(self, ledger: str, df: pd.DataFrame) -> dict:
+        dates = df[LEDGERS[ledger][2]]
+        lo, hi = dates.min(), dates.max()
+        return {
+            'rows': int(len(df)),
+            'min_date': None if pd.isna(lo) else lo.strftime('%Y-%m-%d'),
+            'max_date': None if pd.isna(hi) else hi.strftime('%Y-%m-%d'),
+            'amount': round(float(pd.to_numeric(df['amount'], errors='coerce').sum()), 2),
+        }
+
+    def _write_parts(self, ledger: str, df: pd.DataFrame, parts: dict, keys=None):
+        """Rewrite the partitions in ``keys`` (all of ``df``'s when None) from ``df``.
+
+        ``df`` holds the new contents of exactly those partitions; ones left empty
+        are removed. ``parts`` is the current manifest, updated and saved here.
+        """
+        columns, date_col = LEDGERS[ledger][1], LEDGERS[ledger][2]
+        df = with_ids(df)
+        groups = dict(tuple(df.groupby(_partition_keys(df[date_col]), sort=False))) if not df.empty else {}
+        parts = dict(parts)
+        for key in set(groups) | set(keys if keys is not None else parts):
+            path = self._part_path(ledger, key)
+            part = groups.get(key)
+            if part is None or part.empty:
+                parts.pop(key, None)
+                if os.path.exists(path):
+                    os.remove(path)
+                    invalidate(path)
+                continue
+            out = part.reindex(columns=columns)
+            out[ID_COLUMN] = out.index
+            write_csv(out, path)
+            parts[key] = self._stats(ledger, part)
+        write_json_atomic(self.fingerprint_path(ledger), {'partitions': parts})
+        if keys is None:
+            self._write_id_map(ledger, df)
+
+    def _write_id_map(self, ledger: str, df: pd.DataFrame):
+        keys = _partition_keys(df[LEDGERS[ledger][2]]) if not df.empty else pd.Series(dtype=object)
+        write_csv(pd.DataFrame({ID_COLUMN: df.index, 'partition': keys.to_numpy()}), self._ids_path(ledger))
+
+    def _log_ids(self, ledger: str, ids, keys):
+        """Record where rows now live; a map that does not exist yet is built later instead."""
+        path = self._ids_path(ledger)
+        if os.path.exists(path):
+            append_rows(path, pd.DataFrame({ID_COLUMN: list(ids), 'partition': list(keys)}),
+                        [ID_COLUMN, 'partition'])
+
+    def _id_map(self, ledger: str) -> pd.Series:
+        """Partition key per row id. Call with the ledger lock held."""
+        path = self._ids_path(ledger)
+        if not os.path.exists(path):
+            self._write_id_map(ledger, self._concat(ledger, list(self.manifest(ledger))))
+
+        def load():
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            keys = df.drop_duplicates(ID_COLUMN, keep='last').set_index(ID_COLUMN)['partition']
+            return keys[keys != '']
+
+        return cached_load(path, load, name=f'{self.name}:{ledger}:ids')
+
+    def _keys(self, ledger: str, start_date=None, end_date=None) -> list:
+        """Partitions whose date range overlaps [start_date, end_date]."""
+        lo = _day(start_date) if start_date is not None else None
+        hi = _day(end_date) if end_date is not None else None
+        keys = []
+        for key, stats in self.manifest(ledger).items():
+            if key == UNDATED or stats.get('min_date') is None:
+                # Undated rows never match a date bound
+                if lo is None and hi is None:
+                    keys.append(key)
+                continue
+            if (hi is None or stats['min_date'] <= hi) and (lo is None or stats['max_date'] >= lo):
+                keys.append(key)
+        return keys
+
+    def _concat(self, ledger: str, keys: list) -> pd.DataFrame:
+        frames = [self._read_part(ledger, key) for key in keys]
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return empty_frame(ledger)
+        return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+    def read(self, ledger: str) -> pd.DataFrame:
+        self.ensure()
+        with file_lock(self.fingerprint_path(ledger)):
+            return self._concat(ledger, list(self.manifest(ledger)))
+
+    def write(self, ledger: str, df: pd.DataFrame):
+        self.ensure()
+        with file_lock(self.fingerprint_path(ledger)):
+            self._write_parts(ledger, df, self.manifest(ledger))
+
+    def append(self, ledger: str, rows) -> int:
+        """Append to the partitions the rows fall in (normally just the current month)."""
+        self.ensure()
+        columns, date_col = LEDGERS[ledger][1], LEDGERS[ledger][2]
+        rows = with_ids(_as_frame(rows, ledger))
+        if rows.empty:
+            return 0
+        n = 0
+        with file_lock(self.fingerprint_path(ledger)):
+            parts = self.manifest(ledger)
+            keys = _partition_keys(rows[date_col])
+            for key, part in rows.groupby(keys, sort=False):
+                n += append_rows(self._part_path(ledger, key), part.reset_index(), columns + [ID_COLUMN])
+                parts[key] = _merge_stats(parts.get(key), self._stats(ledger, part))
+            write_json_atomic(self.fingerprint_path(ledger), {'partitions': parts})
+            self._log_ids(ledger, rows.index, keys)
+        return n
+
+    def rows(self, ledger: str, ids) -> pd.DataFrame:
+        """Rows by id, reading only the partitions that hold them."""
+        self.ensure()
+        ids = pd.Index(list(ids), dtype=object)
+        with file_lock(self.fingerprint_path(ledger)):
+            keys = set(self._id_map(ledger).reindex(ids).dropna())
+            df = self._concat(ledger, [k for k in self.manifest(ledger) if k in keys])
+        return df.loc[df.index.intersection(ids)]
+
+    def update(self, ledger: str, changed: pd.DataFrame, deleted=()):
+        """Rewrite only the partitions holding the edited or deleted rows, or receiving edits."""
+        date_col = LEDGERS[ledger][2]
+        with file_lock(self.fingerprint_path(ledger)):
+            parts = self.manifest(ledger)
+            ids = changed.index.append(pd.Index(list(deleted), dtype=object))
+            current = self.rows(ledger, ids)
+            changed = changed.copy()
+            changed[date_col] = parse_dates(changed[date_col])
+            keys = set(_partition_keys(current[date_col])) | set(_partition_keys(changed[date_col]))
+            df = self._concat(ledger, [k for k in parts if k in keys])
+            df = df.drop(index=df.index.intersection(ids))
+            df = pd.concat([df, changed.reindex(columns=df.columns)]) if not changed.empty else df
+            df.index.name = ID_COLUMN  # the rows keep their ids, even if an index lost its name
+            self._write_parts(ledger, df, parts, keys=keys)
+            gone = pd.Index(list(deleted), dtype=object).difference(changed.index)
+            self._log_ids(ledger, changed.index.append(gone),
+                          list(_partition_keys(changed[date_col])) + [''] * len(gone))
+
+    def query(self, ledger: str, **filters) -> pd.DataFrame:
+        self.ensure()
+        keys = self._keys(ledger, filters.get('start_date'), filters.get('end_date'))
+        return filter_frame(self._concat(ledger, keys), **filters)
+
+    def date_bounds(self, ledger: str):
+        """From the manifest alone; no partition is read."""
+        self.ensure()
+        stats = [s for s in self.manifest(ledger).values() if s.get('min_date')]
+        if not stats:
+            return None, None
+        return (date.fromisoformat(min(s['min_date'] for s in stats)),
+                date.fromisoformat(max(s['max_date'] for s in stats)))
+
+    def iter_query(self, ledger: str, chunk_rows: int, **filters):
+        """Filtered rows partition by partition, in frames of at most ``chunk_rows`` rows."""
+        self.ensure()
+        for key in self._keys(ledger, filters.get('start_date'), filters.get('end_date')):
+            df = filter_frame(self._read_part(ledger, key), **filters)
+            for start in range(0, len(df), chunk_rows):
+                yield df.iloc[start:start + chunk_rows]
+
+    def page(self, ledger: str, offset: int, limit: int, sort_by: str = None,
+             ascending: bool = True, search: str = None):
+        """One page of rows (indexed by row id) and the number of matching rows.
+
+        In row or date order, partitions follow each other, so the manifest's row
+        counts locate the page and only the partitions it spans are read. Other
+        sort columns and searches need every row.
+        """
+        date_col = LEDGERS[ledger][2]
+        if search or sort_by not in (None, date_col):
+            return super().page(ledger, offset, limit, sort_by=sort_by, ascending=ascending, search=search)
+        self.ensure()
+        with file_lock(self.fingerprint_path(ledger)):
+            parts = self.manifest(ledger)
+            keys = list(parts)
+            if sort_by is not None and UNDATED in parts:
+                keys.remove(UNDATED)
+                keys.insert(0, UNDATED)  # missing dates sort lowest
+            if not ascending:
+                keys.reverse()
+            frames, skip = [], offset
+            for key in keys:
+                if len(frames) and sum(map(len, frames)) >= limit:
+                    break
+                if skip >= parts[key]['rows']:
+                    skip -= parts[key]['rows']
+                    continue
+                df = self._read_part(ledger, key)
+                order = cached_load(self._part_path(ledger, key),
+                                    lambda: _sort_order(df, sort_by, ascending),
+                                    name=f'{self.name}:{ledger}:part-order:{sort_by}:{ascending}')
+                frames.append(df.iloc[order[skip:skip + limit - sum(map(len, frames))]])
+                skip = 0
+        total = sum(stats['rows'] for stats in parts.values())
+        return (pd.concat(frames) if frames else empty_frame(ledger)), total
+
+
+# ---------------------------
+# ---- Engine Selection  ----
+# ---------------------------
+
+_BACKENDS = {'csv': CsvBackend, 'sqlite': SqliteBackend, 'partitioned': PartitionedBackend}
+_backend = None
+
+
+def get_backend():
+    """Return the process-wide storage engine chosen by EXPENSE_TRACKER_STORAGE."""
+    global _backend
+    if _backend is None:
+        if STORAGE_BACKEND not in _BACKENDS:
+            raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND!r} (expected one of {sorted(_BACKENDS)})")
+        _backend = _BACKENDS[STORAGE_BACKEND]()
+    return _backend
+
+
+def read_ledger(ledger: str) -> pd.DataFrame:
+    """Full ledger, including rows still waiting in the write-behind queue."""
+    # Overlay first: a batch leaves it only after it is stored, so rows flushed
+    # between the two reads show up twice (and are dropped here), never zero times.
+    extra = pending_rows(ledger)
+    df = cached_read(get_backend(), ledger)
+    if extra is None:
+        return df
+    return pd.concat([df, extra.loc[~extra.index.isin(df.index)]])
+
+
+def migrate(source: str, target: str) -> dict:
+    """Copy every ledger from one storage engine to another, ids included.
+
+    Returns the number of rows copied per ledger.
+    """
+    src, dst = _BACKENDS[source](), _BACKENDS[target]()
+    src.ensure()
+    dst.ensure()
+    copied = {}
+    for ledger in LEDGERS:
+        with file_lock(dst.fingerprint_path(ledger)):
+            df = src.read(ledger)
+            dst.write(ledger, df)
+            copied[ledger] = len(df)
+    return copied
+
+
+def ledger_fingerprint(ledger: str):
+    fingerprint = file_fingerprint(get_backend().fingerprint_path(ledger))
+    token = pending_token(ledger)
+    return fingerprint if token is None else (fingerprint, token)
+
+
+def date_bounds(ledger: str):
+    """(first, last) date of a ledger, pending rows included, or (None, None)."""
+    extra = pending_rows(ledger)
+    lo, hi = get_backend().date_bounds(ledger)
+    if extra is not None:
+        dates = extra[LEDGERS[ledger][2]].dropna()
+        if not dates.empty:
+            lo = min(d for d in (lo, dates.min().date()) if d is not None)
+            hi = max(d for d in (hi, dates.max().date()) if d is not None)
+    return lo, hi
+
+
+def ledger_lock(ledger: str):
+    """Exclusive, re-entrant lock for writing ``ledger`` (all ledgers share one with SQLite)."""
+    return file_lock(get_backend().fingerprint_path(ledger))
+
+
+def ledger_page(ledger: str, page: int, page_size: int, sort_by: str = None,
+                ascending: bool = True, search: str = None):
+    """Rows of 1-based ``page`` (indexed by row id) and the number of matching rows."""
+    offset = (max(int(page), 1) - 1) * int(page_size)
+    if pending_token(ledger) is not None:
+        return _frame_page(read_ledger(ledger), ledger, offset, int(page_size), sort_by, ascending, search)
+    return get_backend().page(ledger, offset, int(page_size), sort_by=sort_by,
+                              ascending=ascending, search=search or None)
+
+
+def _frame_page(df: pd.DataFrame, ledger: str, offset: int, limit: int, sort_by=None,
+                ascending: bool = True, search: str = None):
+    # Same ordering as CsvBackend.page, for the short spells with writes pending
+    _check_sort(ledger, sort_by)
+    if search:
+        df = df[search_mask(df, ledger, search)]
+    if sort_by is not None:
+        df = df.iloc[df[sort_by].reset_index(drop=True).sort_values(kind='stable', na_position='first').index]
+    if not ascending:
+        df = df.iloc[::-1]
+    return df.iloc[offset:offset + limit], len(df)
+
+
+# ---------------------------
+# ---- Pending Writes  ----
+# ---------------------------
+
+# Rows acknowledged to the UI but not yet written by the write-behind queue
+# (write_queue.py), as {ledger: {batch key: frame indexed by row id}}. Reads merge
+# them in so every acknowledged write is visible before it reaches the disk.
+# Batches being written are also marked in _flushing until they leave the overlay.
+_pending = {}
+_flushing = set()
+_pending_lock = threading.Lock()
+_flushers = []
+
+
+def add_pending(ledger: str, key, rows: pd.DataFrame):
+    with _pending_lock:
+        _pending.setdefault(ledger, {})[key] = rows
+
+
+def set_flushing(ledger: str, keys, flushing: bool = True):
+    with _pending_lock:
+        for key in keys:
+            if flushing:
+                _flushing.add((ledger, key))
+            else:
+                _flushing.discard((ledger, key))
+
+
+def drop_pending(ledger: str, key):
+    with _pending_lock:
+        _flushing.discard((ledger, key))
+        batches = _pending.get(ledger, {})
+        batches.pop(key, None)
+        if not batches:
+            _pending.pop(ledger, None)
+
+
+def _pending_state(ledger: str):
+    with _pending_lock:
+        batches = _pending.get(ledger, {})
+        token = tuple((key, (ledger, key) in _flushing) for key in batches) or None
+        return token, list(batches.values())
+
+
+def pending_rows(ledger: str):
+    """Pending rows of ``ledger`` in submission order, or None if there are none."""
+    frames = _pending_state(ledger)[1]
+    return pd.concat(frames) if frames else None
+
+
+def pending_token(ledger: str):
+    """Hashable marker of the pending batches of ``ledger``, or None."""
+    return _pending_state(ledger)[0]
+
+
+def with_pending(ledger: str, read, retries: int = 100):
+    """``(read(), pending rows or None)`` where the two never overlap.
+
+    For readers that cannot drop duplicates by id (aggregates): ``read`` runs while
+    no batch is being written and the pending set stays unchanged, so each pending
+    row is either in the overlay or in what ``read`` saw, never in both.
+    """
+    for _ in range(retries):
+        token, frames = _pending_state(ledger)
+        if token is None:
+            return read(), None
+        if not any(flushing for _, flushing in token):
+            value = read()
+            if _pending_state(ledger)[0] == token:
+                return value, pd.concat(frames)
+        time.sleep(0.005)
+    flush_pending(ledger)
+    return read(), None
+
+
+def add_flusher(fn):
+    """Register ``fn(ledger, timeout)`` to write out pending rows (ledger None: all ledgers).
+
+    It returns False if they were not all stored within ``timeout`` seconds.
+    """
+    if fn not in _flushers:
+        _flushers.append(fn)
+
+
+def flush_pending(ledger: str = None, timeout: float = FLUSH_TIMEOUT):
+    """Wait until the pending writes of ``ledger`` (or of every ledger) are stored.
+
+    Raises TimeoutError if that takes longer than ``timeout`` seconds.
+    """
+    for fn in list(_flushers):
+        if not fn(ledger, timeout):
+            raise TimeoutError(f"Queued writes to {ledger or 'the ledgers'} were not stored within "
+                               f"{timeout:g}s; try again shortly.")
+
+
+# ---------------------------
+# ---- Ledger Writes  ----
+# ---------------------------
+
+# Derived stores (rollups, indexes) subscribe here to stay in step with the ledgers.
+# Listeners are called as fn(ledger, before, after, added=..., removed=...)
+# where before/after are fingerprints of the backing file around the write. Every
+# write and its notification run under the ledger lock, so listeners see writes
+# in the order they happened.
+_write_listeners = []
+
+
+class ConflictError(ValueError):
+    """An edit touched cells that another session changed since they were loaded."""
+
+    def __init__(self, message: str, ids=()):
+        super().__init__(message)
+        self.ids = list(ids)
+
+
+def add_write_listener(fn):
+    if fn not in _write_listeners:
+        _write_listeners.append(fn)
+
+
+def _notify(ledger: str, before, after, added=None, removed=None):
+    for fn in list(_write_listeners):
+        fn(ledger, before, after, added=added, removed=removed)
+
+
+def _as_frame(rows, ledger: str) -> pd.DataFrame:
+    if rows is None:
+        return None
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows), columns=LEDGERS[ledger][1])
+    return coerce_frame(df.reindex(columns=LEDGERS[ledger][1]), ledger) if not df.empty else empty_frame(ledger)
+
+
+def append_ledger(ledger: str, rows) -> int:
+    """Append new rows to a ledger and let derived stores apply them as a delta.
+
+    Rows get fresh row ids unless ``rows`` is already indexed by ``id``.
+    """
+    backend = get_backend()
+    rows = with_ids(_as_frame(rows, ledger))
+    path = backend.fingerprint_path(ledger)
+    with file_lock(path):
+        before = file_fingerprint(path)
+        n = backend.append(ledger, rows)
+        if n:
+            _notify(ledger, before, file_fingerprint(path), added=rows)
+    return n
+
+
+def _same_cells(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    return (a == b) | (a.isna() & b.isna())
+
+
+def row_delta(before: pd.DataFrame, after: pd.DataFrame):
+    """Rows of ``before`` that were dropped or changed, and their replacements in ``after``.
+
+    Both frames must share an index (as they do around st.data_editor).
+    """
+    common = before.index.intersection(after.index)
+    cols = [c for c in before.columns if c in after.columns]
+    same = _same_cells(before.loc[common, cols], after.loc[common, cols]).all(axis=1)
+    changed = same.index[~same]
+    removed = pd.concat([before.loc[before.index.difference(after.index)], before.loc[changed]])
+    added = pd.concat([after.loc[after.index.difference(before.index)], after.loc[changed]])
+    return added, removed
+
+
+def update_rows(ledger: str, changed: pd.DataFrame, deleted=(), original: pd.DataFrame = None):
+    """Apply edited rows and deletions, both keyed by row id, as a delta.
+
+    Only the affected ids are read and written: SQLite updates them in place, the
+    CSV engine records them in its journal. Ids that no longer exist (e.g. deleted
+    by another session) are ignored.
+
+    With ``original`` (the rows as they were loaded for editing) the save is an
+    optimistic, cell-level merge: only the cells that differ from ``original`` are
+    written on top of the current rows, so concurrent edits to other cells of the
+    same row survive. If another session changed one of the edited cells too,
+    nothing is written and ConflictError is raised.
+    Returns (rows updated, rows deleted).
+    """
+    flush_pending(ledger)  # edits may target rows that are still queued
+    backend = get_backend()
+    columns = LEDGERS[ledger][1]
+    changed = _as_frame(changed.reindex(columns=columns), ledger)
+    changed['amount'] = pd.to_numeric(changed['amount'], errors='coerce').fillna(0.0)
+    deleted = pd.Index(list(deleted), dtype=object)
+
+    path = backend.fingerprint_path(ledger)
+    with file_lock(path):
+        current = backend.rows(ledger, changed.index.union(deleted))
+        deleted = deleted.intersection(current.index)
+        changed = changed.loc[changed.index.intersection(current.index).difference(deleted)]
+        if original is not None and not changed.empty:
+            base = _as_frame(original.reindex(columns=columns), ledger).reindex(changed.index)
+            now = current.loc[changed.index, columns]
+            edited = ~_same_cells(changed[columns], base)
+            clash = (edited & ~_same_cells(now, base)).any(axis=1)
+            if clash.any():
+                ids = clash.index[clash]
+                raise ConflictError(f"{len(ids)} row(s) were changed by another session since they were "
+                                    f"loaded; reload and apply your edits again.", ids)
+            changed = now.where(~edited, changed[columns])
+            changed = changed.loc[~_same_cells(changed, now).all(axis=1)]
+        if changed.empty and deleted.empty:
+            return 0, 0
+
+        before = file_fingerprint(path)
+        backend.update(ledger, changed, deleted)
+        removed = current.loc[changed.index.append(deleted)]
+        _notify(ledger, before, file_fingerprint(path), added=changed, removed=removed)
+    return len(changed), len(deleted)
+
+
+# ---------------------------
+# ---- Derived Stores  ----
+# ---------------------------
+# Rollups and the search and balance indexes each record the fingerprint of the
+# ledger they were derived from. These helpers keep that fingerprint honest.
+
+def register_derived_stores():
+    """Subscribe the rollups and the search and balance indexes to ledger writes.
+
+    Called at startup by every process that writes ledgers (the app and the CLI).
+    Without it writes still land, but the stores are rebuilt on their next use
+    instead of absorbing the delta.
+    """
+    import balance_index  # these modules build on this one
+    import rollups
+    import search_index
+
+    for store in (rollups, search_index, balance_index):
+        add_write_listener(store.on_ledger_write)
+
+
+def carry_forward(ledger: str, before, after, stores: dict, stored_fingerprint, move):
+    """Move the stores of ledgers that share ``ledger``'s backing file from ``before`` to ``after``.
+
+    With SQLite all ledgers share one file: a write to one leaves the others'
+    stores valid, so their fingerprint is moved along instead of letting them go
+    stale. ``stores`` maps ledgers to store paths; for each store that exists and
+    whose ``stored_fingerprint(other)`` is ``before``, ``move(other, after)`` runs
+    under the store's lock.
+    """
+    if before is None:
+        return
+    backend = get_backend()
+    for other, path in stores.items():
+        if (other != ledger and os.path.exists(path)
+                and backend.fingerprint_path(other) == backend.fingerprint_path(ledger)):
+            with file_lock(path):
+                if stored_fingerprint(other) == before:
+                    move(other, after)
+
+
+def fresh_derived(ledger: str, lock_path: str, load, build, save, retries: int = 5):
+    """A store derived from ``ledger`` that matches its current contents.
+
+    ``load()`` returns the stored value and the ledger fingerprint it corresponds
+    to (value None if nothing is stored). When they do not match, ``build(df)``
+    derives a new value from the ledger rows and ``save(value, fingerprint)``
+    stores it. The ledger is read without holding the store's lock (writers take
+    the ledger lock first and the store lock second, so the reverse order could
+    deadlock); a build is only saved, under ``lock_path``, if the ledger did not
+    change while it was being read.
+    """
+    path = get_backend().fingerprint_path(ledger)
+    for _ in range(retries):
+        current = file_fingerprint(path)
+        value, fingerprint = load()
+        if value is not None and current is not None and fingerprint == list(current):
+            return value
+        df = cached_read(get_backend(), ledger)
+        if file_fingerprint(path) != current:
+            continue  # written while reading; try again
+        value = build(df)
+        with file_lock(lock_path):
+            if current is not None and file_fingerprint(path) == current:
+                save(value, list(current))
+        return value
+    return build(cached_read(get_backend(), ledger))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the ledgers between storage engines.")
+    parser.add_argument('--from', dest='source', choices=sorted(_BACKENDS), default='csv')
+    parser.add_argument('--to', dest='target', choices=sorted(_BACKENDS), required=True)
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+    for ledger, n in migrate(args.source, args.target).items():
+        print(f"{ledger}: {n} rows copied from {args.source} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
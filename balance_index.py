@@ -0,0 +1,235 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import rollups
+from backends import carry_forward, fresh_derived, parse_dates, with_pending
+from ledger import from_minor, to_minor_array
+from storage import BALANCE_INDEX_FILE, LEDGERS, SharedValue, cached_load, file_lock
+
+# Key column with its own running totals, per ledger
+BALANCE_KEYS = {'expenses': 'category', 'income': 'source'}
+
+# ---------------------------
+# ---- Persisted State  ----
+# ---------------------------
+# <ledger>_balance.npz holds, as int64 arrays:
+#   days, cum:          sorted day numbers (days since 1970-01-01) that have rows,
+#                       and the running total in minor units through each of them
+#   key_days, key_cum:  the same per key (category or source), stored back to back;
+#                       key_names[i] spans key_ptr[i]:key_ptr[i + 1]
+#   fingerprint:        JSON fingerprint of the ledger's backing file
+# Appends are merged in by the write listener. Any other write (edits, deletes)
+# drops the file, and it is rebuilt from the ledger on the next query.
+
+def _path(ledger: str) -> str:
+    return BALANCE_INDEX_FILE.format(ledger=ledger)
+
+
+def _day_number(value) -> int:
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64))
+
+
+def _daily(df: pd.DataFrame, ledger: str) -> pd.DataFrame:
+    """Exact per-(key, day) totals of ``df``, sorted by key then day."""
+    if df is None or df.empty:
+        return pd.DataFrame({'key': pd.Series(dtype=object), 'day': pd.Series(dtype=np.int64),
+                             'amount': pd.Series(dtype=np.int64)})
+    dates = parse_dates(df[LEDGERS[ledger][2]])
+    ok = dates.notna().to_numpy()
+    frame = pd.DataFrame({
+        'key': df[BALANCE_KEYS[ledger]].fillna('').astype(str).to_numpy()[ok],
+        'day': dates.to_numpy()[ok].astype('datetime64[D]').astype(np.int64),
+        'amount': to_minor_array(df['amount'])[ok],
+    })
+    return frame.groupby(['key', 'day'], sort=True, as_index=False)['amount'].sum()
+
+
+def _span(days: np.ndarray, cum: np.ndarray, start=None, end=None) -> int:
+    # Two binary searches and a subtraction
+    lo = 0 if start is None else int(np.searchsorted(days, _day_number(start), 'left'))
+    hi = len(days) if end is None else int(np.searchsorted(days, _day_number(end), 'right'))
+    if hi <= lo:
+        return 0
+    return int(cum[hi - 1] - (cum[lo - 1] if lo else 0))
+
+
+class PrefixIndex(SharedValue):
+    """Date-sorted running totals of one ledger, overall and per key."""
+
+    __slots__ = ('days', 'cum', 'key_names', 'key_ptr', 'key_days', 'key_cum', 'fingerprint', '_keys')
+
+    def __init__(self, days, cum, key_names, key_ptr, key_days, key_cum, fingerprint=None):
+        self.days = days
+        self.cum = cum
+        self.key_names = key_names
+        self.key_ptr = key_ptr
+        self.key_days = key_days
+        self.key_cum = key_cum
+        self.fingerprint = fingerprint
+        self._keys = {name: i for i, name in enumerate(key_names.tolist())}
+
+    @classmethod
+    def from_daily(cls, daily: pd.DataFrame, fingerprint=None) -> 'PrefixIndex':
+        # ``daily`` is sorted by key then day (see _daily), so each key is one run
+        overall = daily.groupby('day', sort=True)['amount'].sum()
+        sizes = daily.groupby('key', sort=True).size()
+        return cls(
+            overall.index.to_numpy(dtype=np.int64),
+            np.cumsum(overall.to_numpy(dtype=np.int64)),
+            sizes.index.to_numpy(dtype=str),
+            np.concatenate([[0], np.cumsum(sizes.to_numpy(dtype=np.int64))]),
+            daily['day'].to_numpy(dtype=np.int64),
+            daily.groupby('key', sort=False)['amount'].cumsum().to_numpy(dtype=np.int64),
+            fingerprint,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.days, self.cum, self.key_names, self.key_ptr, self.key_days, self.key_cum)
+        return sum(a.nbytes for a in arrays) + 100 * len(self._keys)
+
+    def total(self, start=None, end=None, key: str = None) -> int:
+        """Exact total in minor units over [start, end] (open ends allowed), overall or for one key."""
+        if key is None:
+            return _span(self.days, self.cum, start, end)
+        i = self._keys.get(key)
+        if i is None:
+            return 0
+        a, b = self.key_ptr[i], self.key_ptr[i + 1]
+        return _span(self.key_days[a:b], self.key_cum[a:b], start, end)
+
+    def month_totals(self) -> dict:
+        """``{'YYYY-MM': total}`` in minor units, one subtraction per month."""
+        if not len(self.days):
+            return {}
+        months = self.days.astype('datetime64[D]').astype('datetime64[M]')
+        labels, first = np.unique(months, return_index=True)
+        last = np.append(first[1:], len(self.days)) - 1
+        totals = self.cum[last] - np.where(first > 0, self.cum[first - 1], 0)
+        return {str(m): int(t) for m, t in zip(labels, totals)}
+
+    def daily(self) -> pd.DataFrame:
+        """Per-(key, day) totals recovered from the running sums."""
+        amounts = np.diff(self.key_cum, prepend=0)
+        heads = self.key_ptr[:-1][self.key_ptr[:-1] < self.key_ptr[1:]]
+        amounts[heads] = self.key_cum[heads]
+        keys = np.repeat(self.key_names, np.diff(self.key_ptr))
+        return pd.DataFrame({'key': keys.astype(object), 'day': self.key_days, 'amount': amounts})
+
+    def merged(self, delta: pd.DataFrame, fingerprint=None) -> 'PrefixIndex':
+        """Index with the per-(key, day) totals of ``delta`` added; cost depends on days x keys, not rows."""
+        both = pd.concat([self.daily(), delta]).groupby(['key', 'day'], sort=True, as_index=False)['amount'].sum()
+        return PrefixIndex.from_daily(both, fingerprint)
+
+
+def _stored_fingerprint(ledger: str):
+    # Only the fingerprint array is read from the archive
+    try:
+        with np.load(_path(ledger)) as data:
+            return json.loads(str(data['fingerprint']))
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+
+
+def _read_index(ledger: str):
+    try:
+        with np.load(_path(ledger)) as data:
+            return PrefixIndex(data['days'], data['cum'], data['key_names'], data['key_ptr'],
+                               data['key_days'], data['key_cum'], json.loads(str(data['fingerprint'])))
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        return None
+
+
+def _save_index(ledger: str, index: PrefixIndex, fingerprint):
+    path = _path(ledger)
+    tmp = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, days=index.days, cum=index.cum, key_names=index.key_names, key_ptr=index.key_ptr,
+             key_days=index.key_days, key_cum=index.key_cum,
+             fingerprint=np.array(json.dumps(list(fingerprint) if fingerprint else None)))
+    os.replace(tmp, path)
+
+
+# ---------------------------
+# ---- Incremental Upkeep  ----
+# ---------------------------
+
+def on_ledger_write(ledger: str, before, after, added=None, removed=None):
+    """Write listener: merge appended rows into the running totals, drop the index otherwise."""
+    before = list(before) if before else None
+    after = list(after) if after else None
+    carry_forward(ledger, before, after, {other: _path(other) for other in BALANCE_KEYS}, _stored_fingerprint,
+                  lambda other, fingerprint: _save_index(other, _read_index(other), fingerprint))
+    if ledger not in BALANCE_KEYS or not os.path.exists(_path(ledger)):
+        return  # nothing built yet; the first query builds it
+    with file_lock(_path(ledger)):
+        index = _read_index(ledger)
+        if (index is not None and before is not None and index.fingerprint == before
+                and (removed is None or removed.empty)):
+            index = index.merged(_daily(added, ledger))
+        else:
+            os.remove(_path(ledger))  # edited or out of sync: rebuild lazily
+            return
+        _save_index(ledger, index, after)
+
+
+
+def _fresh(ledger: str) -> PrefixIndex:
+    """Balance index for ``ledger``, rebuilding it if it no longer matches the ledger."""
+    def load():
+        if not os.path.exists(_path(ledger)):
+            return None, None
+        index = cached_load(_path(ledger), lambda: _read_index(ledger), name=f'balance:{ledger}')
+        return index, index.fingerprint if index is not None else None
+
+    return fresh_derived(ledger, _path(ledger), load, lambda df: PrefixIndex.from_daily(_daily(df, ledger)),
+                         lambda index, fingerprint: _save_index(ledger, index, fingerprint))
+
+
+# ---------------------------
+# ---- Queries  ----
+# ---------------------------
+
+def total(ledger: str, start_date=None, end_date=None, categories=None) -> int:
+    """Exact total in minor units of ``ledger`` rows dated in [start_date, end_date].
+
+    ``categories`` restricts expenses to those categories (ignored for income, as
+    in backends.filter_frame). Rows in the write-behind queue are included.
+    """
+    index, extra = with_pending(ledger, lambda: _fresh(ledger))
+    keys = list(dict.fromkeys(categories)) if categories and BALANCE_KEYS[ledger] == 'category' else None
+
+    def span(ix: PrefixIndex) -> int:
+        if keys is None:
+            return ix.total(start_date, end_date)
+        return sum(ix.total(start_date, end_date, key) for key in keys)
+
+    n = span(index)
+    if extra is not None:
+        n += span(PrefixIndex.from_daily(_daily(extra, ledger)))
+    return n
+
+
+def filtered_total(ledger: str, start_date=None, end_date=None, categories=None,
+                   min_amt: float = 0.0, max_amt: float = 0.0, ids=None) -> float:
+    """Total of the rows matching the sidebar filters, from the index when it can answer.
+
+    Per-row amount bounds and id sets (search matches) fall through to the rollups.
+    """
+    if min_amt or max_amt or ids is not None:
+        df = rollups.totals(ledger, 'date', start_date=start_date, end_date=end_date, categories=categories,
+                            min_amt=min_amt, max_amt=max_amt, ids=ids)
+        return float(df['amount'].sum()) if not df.empty else 0.0
+    return from_minor(total(ledger, start_date, end_date, categories))
+
+
+def balance_totals(by_month: bool = False) -> dict:
+    """``{key: (income, expenses)}`` in minor units with one key, ``'all'``, or one per month."""
+    if not by_month:
+        if not any(len(_fresh(ledger).days) for ledger in BALANCE_KEYS):
+            return {}
+        return {'all': (total('income'), total('expenses'))}
+    income, expenses = _fresh('income').month_totals(), _fresh('expenses').month_totals()
+    return {k: (income.get(k, 0), expenses.get(k, 0)) for k in sorted(set(income) | set(expenses))}
@@ -0,0 +1,368 @@
+"""Benchmark suite for the hot paths of the app and the CLI.
+
+Runs against a scratch copy of a synthetic dataset (see generate_data.py; it is
+generated on first use) and reports, per benchmark, the best and median wall time
+over --repeat runs, throughput in rows per second and peak Python heap usage
+(tracemalloc, measured in a separate run so it does not skew the timings).
+
+Results can be saved as a baseline and later runs compared against it:
+
+    python benchmark.py --size 1m --save          # record bench_baseline.json
+    python benchmark.py --size 1m                 # compare, flag regressions
+    python benchmark.py --size 1m --fail          # exit 1 on a regression
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(REPO, 'bench_baseline.json')
+
+# name -> (row count key, setup, run); filled by @bench in execution order
+BENCHMARKS = {}
+
+
+def bench(name: str, rows: str = 'expenses'):
+    def register(fn):
+        BENCHMARKS[name] = (rows, fn)
+        return fn
+    return register
+
+
+class Context:
+    """Shared state for one suite run: dataset counts, snapshot, preloaded inputs."""
+
+    def __init__(self, snapshot: str, counts: dict, end: date):
+        self.snapshot = snapshot
+        self.counts = counts
+        self.end = end
+        self.frames = {}
+
+    def restore(self, *names):
+        """Put files back to their state right after setup (and drop derived ones)."""
+        from storage import invalidate, journal_path
+
+        for name in names:
+            for extra in (journal_path(name), f'{os.path.basename(name).split(".")[0]}_hashes.npz', 'rollups.json'):
+                if os.path.exists(extra) and not os.path.exists(os.path.join(self.snapshot, extra)):
+                    os.remove(extra)
+            _copy(os.path.join(self.snapshot, name), name)
+        invalidate()
+
+
+def _copy(src: str, dst: str):
+    # Partitioned ledgers are directories (one CSV per month plus the manifest)
+    if os.path.isdir(src):
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def _ledger_files(ledger: str) -> list:
+    import backends
+    from storage import LEDGERS
+
+    if backends.STORAGE_BACKEND == 'sqlite':
+        return [backends.SQLITE_FILE]
+    if backends.STORAGE_BACKEND == 'partitioned':
+        return [os.path.join(backends.PARTITION_DIR, ledger)]
+    return [LEDGERS[ledger][0]]
+
+
+# ---------------------------
+# ---- Benchmarks  ----
+# ---------------------------
+# Each returns (setup, run); setup is excluded from the timing.
+
+@bench('read_expenses (cold)')
+def _read_expenses(ctx):
+    import app
+    from storage import invalidate
+    return invalidate, app.read_expenses
+
+
+@bench('read_income (cold)', rows='income')
+def _read_income(ctx):
+    import app
+    from storage import invalidate
+    return invalidate, app.read_income
+
+
+@bench('ledger core encode (columnar)')
+def _ledger_encode(ctx):
+    from backends import read_ledger
+    from ledger import Ledger
+
+    df = read_ledger('expenses')
+    return None, lambda: Ledger.from_frame(df, 'expenses')
+
+
+@bench('apply_filters')
+def _apply_filters(ctx):
+    import app
+
+    df = app.read_expenses()
+    start = ctx.end - timedelta(days=365)
+    return None, lambda: app.apply_filters(df, start, ctx.end, ['Food', 'Fun', 'Transport'], 100.0, 0.0)
+
+
+@bench('search index query (2 prefixes)')
+def _search(ctx):
+    import search_index
+
+    search_index.search('expenses', 'co')  # build and persist the index outside the timing
+    return None, lambda: search_index.search('expenses', 'co lu')
+
+
+@bench('rollup rebuild (cold)')
+def _rollup_rebuild(ctx):
+    import rollups
+    from storage import ROLLUP_FILE, invalidate
+
+    def setup():
+        if os.path.exists(ROLLUP_FILE):
+            os.remove(ROLLUP_FILE)
+        invalidate()
+
+    return setup, lambda: (rollups.daily_rollup('expenses'), rollups.daily_rollup('income'))
+
+
+@bench('dashboard aggregations')
+def _dashboard(ctx):
+    import rollups
+    from cashflow import cashflow_series, downsample
+
+    filters = dict(start_date=ctx.end - timedelta(days=3 * 365), end_date=ctx.end)
+
+    def run():
+        by_cat = rollups.totals('expenses', 'category', **filters)
+        exp_daily = rollups.totals('expenses', 'date', **filters)
+        inc_daily = rollups.totals('income', 'date', **filters)
+        return by_cat, downsample(cashflow_series(exp_daily, inc_daily), columns=['net', 'cumulative'])
+
+    run()  # build the rollups outside the timing
+    return None, run
+
+
+@bench('balance index KPIs (3 categories)', rows='expenses+income')
+def _balance_kpis(ctx):
+    import balance_index
+
+    filters = dict(start_date=ctx.end - timedelta(days=365), end_date=ctx.end)
+    balance_index.total('expenses')  # build the indexes outside the timing
+    balance_index.total('income')
+
+    def run():
+        return (balance_index.filtered_total('expenses', categories=['Food', 'Fun', 'Transport'], **filters),
+                balance_index.filtered_total('income', **filters))
+    return None, run
+
+
+@bench('budgets utilization (24 months)')
+def _budgets(ctx):
+    from budget_analytics import budget_utilization, trailing_months, utilization_table
+    from storage import read_json
+
+    budgets = read_json('budgets.json', {})
+    categories = read_json('settings.json', {}).get('categories', [])
+    months = trailing_months(24, ctx.end)
+    return None, lambda: utilization_table(budget_utilization(budgets, categories, months))
+
+
+@bench('cli generate_report')
+def _cli_report(ctx):
+    import expense_tracker
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            expense_tracker.generate_report()
+    return None, run
+
+
+@bench('cli calculate_balance', rows='expenses+income')
+def _cli_balance(ctx):
+    import expense_tracker
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            expense_tracker.calculate_balance()
+    return None, run
+
+
+@bench('process_recurring_transactions', rows='recurring')
+def _recurring(ctx):
+    from recurring import process_recurring_transactions
+
+    files = _ledger_files('recurring') + _ledger_files('expenses') + _ledger_files('income')
+    return (lambda: ctx.restore(*dict.fromkeys(files))), lambda: process_recurring_transactions(ctx.end)
+
+
+@bench('forecast 5 years (cold)', rows='recurring')
+def _forecast(ctx):
+    import forecast
+
+    forecast.forecast(1826, ctx.end)  # build the rollups outside the timing
+    return forecast._cache.clear, lambda: forecast.forecast(1826, ctx.end)
+
+
+@bench('csv import merge (50% duplicates)', rows='upload')
+def _import(ctx):
+    from importer import import_csv
+
+    files = _ledger_files('expenses')
+    return (lambda: ctx.restore(*files)), lambda: import_csv('upload.csv', 'expenses')
+
+
+# ---------------------------
+# ---- Runner  ----
+# ---------------------------
+
+def _make_upload(counts: dict, seed: int, end: date):
+    """An import file with 10% of the ledger's size, half of it rows already present."""
+    import numpy as np
+    import pandas as pd
+
+    from generate_data import expense_chunks
+    from storage import EXP_COLUMNS
+
+    n = max(counts['expenses'] // 10, 2)
+    existing = pd.read_csv('expenses.csv', nrows=n // 2)[EXP_COLUMNS]
+    first = np.datetime64(end, 'D') - np.timedelta64(365, 'D')
+    fresh = pd.concat(expense_chunks(n - len(existing), seed + 1, first, 365))[EXP_COLUMNS]
+    pd.concat([existing, fresh]).to_csv('upload.csv', index=False)
+    counts['upload'] = n
+
+
+def measure(setup, run, repeat: int, memory: bool) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    peak = None
+    if memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+    return {'seconds': min(times), 'median': statistics.median(times), 'peak_mb': peak}
+
+
+def _load_baselines() -> dict:
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='10k', help="dataset size: 10k, 1m or 10m")
+    parser.add_argument('--data', default=None, help="dataset directory (default bench_data/<size>)")
+    parser.add_argument('--backend', choices=['csv', 'sqlite', 'partitioned'], default='csv')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', default=None, help="run only benchmarks whose name contains this text")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak-memory runs")
+    parser.add_argument('--save', action='store_true', help=f"store results as the baseline ({os.path.basename(BASELINE_FILE)})")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="slowdown ratio flagged as a regression")
+    parser.add_argument('--fail', action='store_true', help="exit 1 if any benchmark regressed")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO)
+    from generate_data import SIZES, generate
+
+    data = os.path.abspath(args.data or os.path.join(REPO, 'bench_data', args.size))
+    end = date(2024, 12, 31)
+    if not os.path.exists(os.path.join(data, 'expenses.csv')):
+        if args.size not in SIZES:
+            parser.error(f"--size must be one of {sorted(SIZES)} to generate a dataset")
+        print(f"Generating {args.size} dataset in {data} ...")
+        generate(data, SIZES[args.size], seed=args.seed, end=end)
+
+    work = tempfile.mkdtemp(prefix='expense-bench-')
+    snapshot = tempfile.mkdtemp(prefix='expense-bench-snap-')
+    os.environ['EXPENSE_TRACKER_STORAGE'] = args.backend
+    os.environ['EXPENSE_TRACKER_DB'] = 'ledger.db'
+    try:
+        for name in os.listdir(data):
+            shutil.copy2(os.path.join(data, name), work)
+        os.chdir(work)
+
+        import backends
+        from storage import LEDGERS
+
+        backends.get_backend().ensure()
+        backends.register_derived_stores()
+        counts = {ledger: len(backends.read_ledger(ledger)) for ledger in LEDGERS}
+        counts['expenses+income'] = counts['expenses'] + counts['income']
+        _make_upload(counts, args.seed, end)
+        for name in os.listdir(work):
+            _copy(name, os.path.join(snapshot, name))
+        ctx = Context(snapshot, counts, end)
+
+        key = f'{args.size}-{args.backend}'
+        baseline = _load_baselines().get(key, {}).get('results', {})
+        results, regressions = {}, []
+        print(f"{key}: {counts['expenses']:,} expenses, {counts['income']:,} income, "
+              f"{counts['recurring']:,} recurring rules; best of {args.repeat}")
+        print(f"{'benchmark':<34}{'best s':>9}{'median s':>10}{'rows/s':>13}{'peak MB':>9}{'vs base':>9}")
+        for name, (rows_key, factory) in BENCHMARKS.items():
+            if args.only and args.only not in name:
+                continue
+            setup, run = factory(ctx)
+            res = measure(setup, run, args.repeat, memory=not args.no_memory)
+            res['rows'] = counts[rows_key]
+            results[name] = res
+            vs = ''
+            if name in baseline and baseline[name]['seconds'] > 0:
+                ratio = res['seconds'] / baseline[name]['seconds']
+                vs = f'{ratio:.2f}x'
+                if ratio > 1 + args.tolerance:
+                    vs += '!'
+                    regressions.append(name)
+            peak = f"{res['peak_mb']:.1f}" if res['peak_mb'] is not None else '-'
+            print(f"{name:<34}{res['seconds']:>9.4f}{res['median']:>10.4f}"
+                  f"{res['rows'] / res['seconds']:>13,.0f}{peak:>9}{vs:>9}")
+    finally:
+        os.chdir(REPO)
+        shutil.rmtree(work, ignore_errors=True)
+        shutil.rmtree(snapshot, ignore_errors=True)
+
+    if args.save:
+        baselines = _load_baselines()
+        baselines[key] = {
+            'recorded': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'results': {**baseline, **results},
+        }
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Saved baseline {key} to {os.path.basename(BASELINE_FILE)}")
+    if regressions:
+        print(f"Regressions (> {args.tolerance:.0%} slower than baseline): {', '.join(regressions)}")
+        if args.fail:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
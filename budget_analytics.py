@@ -0,0 +1,46 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import rollups
+
+
+def trailing_months(n: int, today: date = None) -> list:
+    """The last ``n`` months as 'YYYY-MM' strings, oldest first, ending with the current one."""
+    today = today or date.today()
+    end = pd.Period(today, freq='M')
+    return [str(p) for p in pd.period_range(end=end, periods=n, freq='M')]
+
+
+def budget_utilization(budgets: dict, categories: list, months: list) -> pd.DataFrame:
+    """Actual-vs-budget for every (month, category) pair in one pass.
+
+    Spending comes from the monthly rollup (already grouped by month and category)
+    and is aligned against the budgets with a single reindex, so the cost depends on
+    months x categories, not on the number of transactions or a scan per category.
+    Columns: month, category, budget, spent, remaining, pct (0-100+), over.
+    """
+    categories = list(dict.fromkeys(categories))
+    grid = pd.MultiIndex.from_product([months, categories], names=['month', 'category'])
+    monthly = rollups.monthly_rollup('expenses')
+    spent = monthly.groupby(['month', 'category'])['amount'].sum().reindex(grid, fill_value=0.0)
+
+    budget_by_cat = pd.Series({k: float(v) for k, v in budgets.items()}, dtype=float)
+    budget = budget_by_cat.reindex(grid.get_level_values('category')).fillna(0.0).to_numpy()
+
+    out = grid.to_frame(index=False)
+    out['budget'] = budget
+    out['spent'] = spent.to_numpy()
+    out['remaining'] = out['budget'] - out['spent']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['pct'] = np.where(out['budget'] > 0, out['spent'] / out['budget'] * 100, 0.0)
+    out['over'] = (out['budget'] > 0) & (out['spent'] > out['budget'])
+    return out
+
+
+def utilization_table(util: pd.DataFrame) -> pd.DataFrame:
+    """Category x month grid of utilization percentages, plus months over budget."""
+    table = util.pivot(index='category', columns='month', values='pct')
+    table['months over'] = util.groupby('category')['over'].sum().reindex(table.index)
+    return table
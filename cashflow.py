@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Cap on points sent to st.line_chart per rerun
+MAX_CHART_POINTS = int(os.environ.get('EXPENSE_TRACKER_CHART_POINTS', '1000'))
+
+# granularity -> pandas resample rule; weeks start on Monday and are labelled by it
+GRANULARITIES = {
+    'daily': dict(rule='D'),
+    'weekly': dict(rule='W-MON', closed='left', label='left'),
+    'monthly': dict(rule='MS'),
+}
+
+
+# ---------------------------
+# ---- Resampling  ----
+# ---------------------------
+
+def _flow(daily: pd.DataFrame) -> pd.Series:
+    if daily is None or daily.empty:
+        return pd.Series(dtype=float, index=pd.DatetimeIndex([], name='date'))
+    return daily.groupby(pd.to_datetime(daily['date']))['amount'].sum()
+
+
+def pick_granularity(start, end, max_points: int = MAX_CHART_POINTS) -> str:
+    """Finest granularity whose bucket count over [start, end] fits in ``max_points``."""
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    if days <= max_points:
+        return 'daily'
+    if days // 7 + 1 <= max_points:
+        return 'weekly'
+    return 'monthly'
+
+
+def cashflow_series(exp_daily: pd.DataFrame, inc_daily: pd.DataFrame, granularity: str = 'auto',
+                    max_points: int = MAX_CHART_POINTS) -> pd.DataFrame:
+    """Income, expenses, net and cumulative balance per time bucket.
+
+    Takes the per-day totals (columns ``date`` and ``amount``) of both ledgers and
+    aligns them on one DatetimeIndex, so a day or bucket with income and expenses
+    yields a single row. Empty buckets are kept with zero flow.
+    """
+    flows = pd.concat({'income': _flow(inc_daily), 'expenses': _flow(exp_daily)}, axis=1).fillna(0.0)
+    if flows.empty:
+        return pd.DataFrame(columns=['income', 'expenses', 'net', 'cumulative'],
+                            index=pd.DatetimeIndex([], name='date'), dtype=float)
+    flows = flows.sort_index()
+    if granularity == 'auto':
+        granularity = pick_granularity(flows.index[0], flows.index[-1], max_points)
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity!r} (expected auto or one of {sorted(GRANULARITIES)})")
+
+    out = flows.resample(**GRANULARITIES[granularity]).sum()
+    out.index.name = 'date'
+    out['net'] = out['income'] - out['expenses']
+    out['cumulative'] = out['net'].cumsum()
+    return out
+
+
+# ---------------------------
+# ---- Downsampling  ----
+# ---------------------------
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of ``threshold`` points that keep the shape.
+
+    The first and last points are always kept. Each bucket in between contributes
+    the point forming the largest triangle with the previously kept point and the
+    average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    every = (n - 2) / (threshold - 2)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        nxt = slice(end, min(int((i + 2) * every) + 1, n))
+        avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def downsample(df: pd.DataFrame, max_points: int = MAX_CHART_POINTS, columns: list = None) -> pd.DataFrame:
+    """At most ``max_points`` rows of a time-indexed frame, chosen by LTTB per column.
+
+    Each column gets an equal share of the budget and the union of the chosen rows
+    is returned, so spikes in any plotted series survive.
+    """
+    if len(df) <= max_points:
+        return df
+    columns = columns or list(df.columns)
+    x = df.index.asi8 if isinstance(df.index, pd.DatetimeIndex) else np.arange(len(df))
+    share = max(max_points // len(columns), 3)
+    rows = np.unique(np.concatenate([lttb(x, df[col].to_numpy(), share) for col in columns]))
+    return df.iloc[rows]
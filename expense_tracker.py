@@ -1,137 +1,422 @@
-import csv
-from datetime import datetime
-
-EXP_FILE = 'expenses.csv'
-INC_FILE = 'income.csv'
-
-CATEGORIES = ['Food',  'Transport',  'Utilities',  'Fun',  'Health',  'Other']
-
-def add_income(date,  source,  amount):
-    with open(INC_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([date,  source,  amount])
-
-def add_expense(date,  category,  description,  amount):
-    with open(EXP_FILE, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([date,  category,  description,  amount])
-
-def view_expenses():
-    try:
-        with open(EXP_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            expenses = list(reader)
-            for index, expense in enumerate(expenses):
-                print(f"{index}: Date: {expense[0]}, Category: {expense[1]}, Description: {expense[2]}, Amount: {expense[3]}")
-    except FileNotFoundError:
-        print("No expenses recorded yet.")
-
-def delete_expense(index):
-    try:
-        with open(EXP_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            expenses = list(reader)
-
-        if 0 <= index < len(expenses):
-            expenses.pop(index)
-            with open(EXP_FILE, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerows(expenses)
-            print("Expense deleted successfully.")
-        else:
-            print("Invalid index.")
-    except FileNotFoundError:
-        print("No expenses recorded yet.")
-
-def generate_report():
-    try:
-        with open(EXP_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            expenses = list(reader)
-
-            report = {}
-            for expense in expenses:
-                category = expense[1]
-                amount = float(expense[3])
-                if category in report:
-                    report[category] += amount
-                else:
-                    report[category] = amount
-
-            for category, total in report.items():
-                print(f"Category: {category}, Total Spent: ${total:.2f}")
-    except FileNotFoundError:
-        print("No expenses recorded yet.")
-
-def calculate_balance():
-    total_income = 0.0
-    total_expenses = 0.0
-
-    try:
-        with open(INC_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                total_income += float(row[2])
-    except FileNotFoundError:
-        pass
-
-    try:
-        with open(EXP_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                total_expenses += float(row[3])
-    except FileNotFoundError:
-        pass
-
-    balance = total_income - total_expenses
-    print(f"Total Income: ${total_income:.2f}")
-    print(f"Total Expenses: ${total_expenses:.2f}")
-    print(f"Remaining Balance: ${balance:.2f}")
-
-def main():
-    while True:
-        print("\nExpense Tracker")
-        print("1. Add Income")
-        print("2. Add Expense")
-        print("3. View Expenses")
-        print("4. Delete Expense")
-        print("5. Generate Report")
-        print("6. Calculate Balance")
-        print("7. Exit")
-
-        choice = input("Select an option: ")
-
-        if choice == '1':
-            date = input("Set the date (DD-MM-YYYY): ")
-            source = input("Set the income source: ")
-            amount = input("Set the amount from income: ")
-            add_income(date,  source,  amount)
-        elif choice == '2':
-            date = input("Set the date (DD-MM-YYYY): ")
-            print("Select a category:")
-            for i, category in enumerate(CATEGORIES, 1):
-                print(f"{i}. {category}")
-            category_choice = int(input("Set the the number corresponding to the category: "))
-            if 1 <= category_choice <= len(CATEGORIES):
-                category = CATEGORIES[category_choice - 1]
-            else:
-                category = 'Other'
-            description = input("Set the description of the expense: ")
-            amount = input("Set the amount in the expense: ")
-            add_expense(date,  category,  description,  amount)
-        elif choice == '3':
-            view_expenses()
-        elif choice == '4':
-            index = int(input("Select the index of the expense to be deleted: "))
-            delete_expense(index)
-        elif choice == '5':
-            generate_report()
-        elif choice == '6':
-            calculate_balance()
-        elif choice == '7':
-            break
-        else:
-            print("Invalid choice. Please select a valid choice.")
-
-if __name__ == "__main__":
-    main()
+import argparse
+import csv
+import operator
+import sys
+from itertools import islice
+
+import pandas as pd
+
+from backends import append_ledger, get_backend, register_derived_stores, update_rows
+from balance_index import balance_totals
+from ledger import Expense, Income, Ledger, format_minor, parse_date, to_minor, to_minor_array
+from storage import EXP_FILE, INC_FILE, EXP_COLUMNS, INC_COLUMNS, compact_ledger
+
+CATEGORIES = ['Food',  'Transport',  'Utilities',  'Fun',  'Health',  'Other']
+
+# Rows appended per write when adding in bulk from a file or stdin
+BATCH_ROWS = 1000
+
+# Rows read per chunk when listing, reporting or deleting, so memory stays bounded
+CHUNK_ROWS = 10000
+
+REPORT_GROUPS = ('category', 'month')
+
+# kind -> (path, columns, field that names the transaction)
+KINDS = {
+    'expense': (EXP_FILE, EXP_COLUMNS, 'category'),
+    'income': (INC_FILE, INC_COLUMNS, 'source'),
+}
+
+RECORDS = {'expense': Expense, 'income': Income}
+LEDGER_NAMES = {'expense': 'expenses', 'income': 'income'}
+
+def add_records(records):
+    """Append Expense/Income records to their ledgers; returns the number written.
+
+    Rows go through backends.append_ledger, whatever the storage engine, so the
+    rollups, search and balance indexes merge them instead of rebuilding.
+    """
+    added = 0
+    for kind in KINDS:
+        rows = [r.as_row() for r in records if isinstance(r, RECORDS[kind])]
+        if rows:
+            added += append_ledger(LEDGER_NAMES[kind], rows)
+    return added
+
+def add_income(date,  source,  amount):
+    add_records([Income(date, source, amount)])
+
+def add_expense(date,  category,  description,  amount):
+    add_records([Expense(date, category, description, amount)])
+
+def iter_expenses():
+    """Expense frames of at most CHUNK_ROWS rows, indexed by row id, from the storage engine."""
+    return get_backend().iter_query('expenses', CHUNK_ROWS)
+
+def view_expenses():
+    # Rows are listed by their persistent id, which deletes refer to
+    empty = True
+    for chunk in iter_expenses():
+        empty = False
+        dates = chunk['date'].dt.strftime('%Y-%m-%d').fillna('?')
+        for row_id, day, category, description, amount in zip(
+                chunk.index, dates, chunk['category'].fillna(''), chunk['description'].fillna(''),
+                to_minor_array(chunk['amount'])):
+            print(f"{row_id}: Date: {day}, Category: {category}, Description: {description}, "
+                  f"Amount: {format_minor(amount)}")
+    if empty:
+        print("No expenses recorded yet.")
+
+def delete_expenses(ids=(), where=()):
+    """Delete expenses by row id and/or by filter conditions, in one pass over the ledger.
+
+    A row is deleted if its id is in ``ids`` or it matches every condition in
+    ``where`` (see ``parse_condition``). Returns the deleted ids.
+    """
+    ids = set(ids)
+    conditions = [parse_condition(c) for c in where]
+    if not ids and not conditions:
+        return []
+    matched = []
+    for chunk in iter_expenses():
+        match = chunk.index.isin(list(ids))
+        if conditions:
+            match |= pd.concat([cond(chunk) for cond in conditions], axis=1).all(axis=1).to_numpy()
+        matched.extend(chunk.index[match])
+    if matched:
+        update_rows('expenses', pd.DataFrame(columns=EXP_COLUMNS), deleted=matched)
+    return matched
+
+def delete_expense(row_id):
+    deleted = delete_expenses(ids=[row_id])
+    print("Expense deleted successfully." if deleted else "Unknown expense id.")
+
+CONDITION_OPS = {
+    '<=': operator.le, '>=': operator.ge, '!=': operator.ne,
+    '=': operator.eq, '<': operator.lt, '>': operator.gt,
+}
+
+def parse_condition(text):
+    """Predicate over an expense frame for ``column OP value`` (OP is one of = != < <= > >=).
+
+    ``amount`` compares as a number and ``date`` as a date; other columns compare
+    as text. The predicate returns a boolean Series; rows whose cell does not parse
+    never match. Raises ValueError for an unknown column or an unparseable value.
+    """
+    for symbol, op in CONDITION_OPS.items():
+        column, sep, value = text.partition(symbol)
+        if sep:
+            break
+    else:
+        raise ValueError(f"Not a condition: {text!r} (expected column=value, amount<10, date>=2024-01-01, ...)")
+    column, value = column.strip(), value.strip()
+    if column not in EXP_COLUMNS:
+        raise ValueError(f"Unknown column {column!r} (expected one of {', '.join(EXP_COLUMNS)})")
+    parse = {'amount': parse_amount, 'date': parse_date}.get(column, str.strip)
+    target = parse(value)
+    if target is None:
+        raise ValueError(f"Invalid {column} in condition: {value!r}")
+
+    def cond(df):
+        if column == 'amount':
+            return pd.to_numeric(df['amount'], errors='coerce').notna() & op(to_minor_array(df['amount']), target)
+        if column == 'date':
+            return df['date'].notna() & op(df['date'], pd.Timestamp(target))
+        return op(df[column].fillna('').astype(str).str.strip(), target)
+    return cond
+
+def parse_amount(value):
+    """Amount in integer minor units (see ledger.to_minor), or None if it is not a number."""
+    try:
+        return to_minor(value)
+    except ValueError:
+        return None
+
+def report_totals(by=('category',)):
+    """Expense totals keyed by a tuple of the ``by`` groups (category and/or month), or None.
+
+    The ledger is streamed from the storage engine CHUNK_ROWS rows at a time; each
+    chunk is summed as a columnar ledger.Ledger in integer minor units, so totals are exact.
+    """
+    totals = None
+    for chunk in iter_expenses():
+        totals = totals or {}
+        for key, amount in Ledger.from_frame(chunk, 'expenses').totals(tuple(by)).items():
+            totals[key] = totals.get(key, 0) + amount
+    return totals
+
+def generate_report(by=('category',), as_csv=False, out=None):
+    out = out or sys.stdout
+    report = report_totals(by)
+    if report is None:
+        print("No expenses recorded yet.", file=out)
+        return
+    if as_csv:
+        writer = csv.writer(out)
+        writer.writerow(list(by) + ['total'])
+        for key, total in sorted(report.items()):
+            writer.writerow(list(key) + [format_minor(total)])
+        return
+    for key, total in sorted(report.items()):
+        label = ", ".join(f"{g.capitalize()}: {v}" for g, v in zip(by, key))
+        print(f"{label}, Total Spent: ${format_minor(total)}", file=out)
+
+def calculate_balance(by_month=False, as_csv=False, out=None):
+    out = out or sys.stdout
+    totals = balance_totals(by_month)
+    if as_csv:
+        writer = csv.writer(out)
+        writer.writerow(['month' if by_month else 'period', 'income', 'expenses', 'balance'])
+        for key, (income, expenses) in totals.items():
+            writer.writerow([key, format_minor(income), format_minor(expenses), format_minor(income - expenses)])
+        return
+    if not by_month:
+        income, expenses = totals.get('all', (0, 0))
+        print(f"Total Income: ${format_minor(income)}", file=out)
+        print(f"Total Expenses: ${format_minor(expenses)}", file=out)
+        print(f"Remaining Balance: ${format_minor(income - expenses)}", file=out)
+        return
+    for month, (income, expenses) in totals.items():
+        print(f"Month: {month}, Income: ${format_minor(income)}, Expenses: ${format_minor(expenses)}, "
+              f"Balance: ${format_minor(income - expenses)}", file=out)
+
+def interactive():
+    while True:
+        print("\nExpense Tracker")
+        print("1. Add Income")
+        print("2. Add Expense")
+        print("3. View Expenses")
+        print("4. Delete Expense")
+        print("5. Generate Report")
+        print("6. Calculate Balance")
+        print("7. Exit")
+
+        choice = input("Select an option: ")
+
+        if choice == '1':
+            date = input("Set the date (DD-MM-YYYY): ")
+            source = input("Set the income source: ")
+            amount = input("Set the amount from income: ")
+            try:
+                add_income(date,  source,  amount)
+            except ValueError as e:
+                print(e)
+        elif choice == '2':
+            date = input("Set the date (DD-MM-YYYY): ")
+            print("Select a category:")
+            for i, category in enumerate(CATEGORIES, 1):
+                print(f"{i}. {category}")
+            category_choice = int(input("Set the the number corresponding to the category: "))
+            if 1 <= category_choice <= len(CATEGORIES):
+                category = CATEGORIES[category_choice - 1]
+            else:
+                category = 'Other'
+            description = input("Set the description of the expense: ")
+            amount = input("Set the amount in the expense: ")
+            try:
+                add_expense(date,  category,  description,  amount)
+            except ValueError as e:
+                print(e)
+        elif choice == '3':
+            view_expenses()
+        elif choice == '4':
+            row_id = input("Set the id of the expense to be deleted: ").strip()
+            delete_expense(row_id)
+        elif choice == '5':
+            generate_report()
+        elif choice == '6':
+            calculate_balance()
+        elif choice == '7':
+            break
+        else:
+            print("Invalid choice. Please select a valid choice.")
+
+# ---------------------------
+# ---- Batch Mode  ----
+# ---------------------------
+
+def _open_input(name):
+    if name == '-':
+        return sys.stdin
+    return open(name, mode='r', newline='')
+
+def add_from_file(kind, source):
+    """Append CSV rows (with a header naming the ledger columns) from ``source``.
+
+    Rows are streamed and appended in batches of BATCH_ROWS. Rows with a missing
+    name, or an invalid date or amount, are not written. Returns (added, rejected).
+    """
+    _, columns, name_col = KINDS[kind]
+    added = rejected = 0
+    reader = csv.DictReader(source, skipinitialspace=True)
+    missing = [c for c in columns if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing columns for {kind}: {', '.join(missing)}")
+    while True:
+        chunk = list(islice(reader, BATCH_ROWS))
+        if not chunk:
+            return added, rejected
+        batch = []
+        for row in chunk:
+            if not (row[name_col] or '').strip():
+                rejected += 1
+                continue
+            try:
+                batch.append(RECORDS[kind](**{c: (row[c] or '').strip() for c in columns}))
+            except ValueError:
+                rejected += 1
+        added += add_records(batch)
+
+def cmd_add(args):
+    if args.file:
+        with _open_input(args.file) as source:
+            added, rejected = add_from_file(args.kind, source)
+        print(f"Added {added} {args.kind} rows, rejected {rejected} invalid rows.")
+        return 0
+    name_col = KINDS[args.kind][2]
+    name = args.category if args.kind == 'expense' else args.source
+    if args.amount is None or not args.date or not name:
+        print(f"add {args.kind} needs --date, --{name_col} and --amount (or --file).", file=sys.stderr)
+        return 2
+    try:
+        if args.kind == 'expense':
+            record = Expense(args.date, name, args.description, args.amount)
+        else:
+            record = Income(args.date, name, args.amount)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    add_records([record])
+    print(f"Added 1 {args.kind} row.")
+    return 0
+
+def cmd_import(args):
+    # Imports validate and de-duplicate against the ledger, which needs pandas
+    from importer import import_csv
+    try:
+        result = import_csv(sys.stdin if args.file == '-' else args.file, args.ledger)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"{args.ledger}: inserted {result.inserted}, skipped {result.skipped} duplicates, "
+          f"rejected {result.rejected} invalid rows")
+    return 0
+
+def cmd_view(args):
+    view_expenses()
+    return 0
+
+def cmd_delete(args):
+    ids = list(args.ids)
+    if args.file:
+        with _open_input(args.file) as source:
+            ids += [line.strip() for line in source if line.strip()]
+    if not ids and not args.where:
+        print("delete needs row ids, --file or --where.", file=sys.stderr)
+        return 2
+    try:
+        deleted = delete_expenses(ids, args.where)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    print(f"Deleted {len(deleted)} expenses.")
+    unknown = [i for i in dict.fromkeys(ids) if i not in set(deleted)]
+    if unknown:
+        print(f"Unknown expense ids: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    return 0
+
+def cmd_compact(args):
+    backend = get_backend()
+    if backend.name != 'csv':
+        print(f"The {backend.name} storage engine keeps no journal; nothing to compact.")
+        return 0
+    kept = compact_ledger(KINDS[args.kind][0])
+    print("Nothing to compact." if kept is None else f"Compacted {args.kind}: {kept} rows kept.")
+    return 0
+
+def cmd_convert(args):
+    from backends import CsvBackend
+    try:
+        report = CsvBackend().convert(args.ledger)
+    except FileNotFoundError:
+        print(f"No {args.ledger} recorded yet.")
+        return 0
+    print(f"Converted {args.ledger} from the {report.layout} layout: {report.rows} rows kept, "
+          f"{len(report.rejected)} rejected.")
+    for line, reason, row in report.rejected:
+        print(f"  {'line ' + str(line) if line else 'row'}: {reason}: {row}")
+    return 0
+
+def cmd_report(args):
+    by = [g.strip() for g in args.by.split(',') if g.strip()]
+    unknown = [g for g in by if g not in REPORT_GROUPS]
+    if not by or unknown:
+        print(f"--by takes a comma-separated list of: {', '.join(REPORT_GROUPS)}", file=sys.stderr)
+        return 2
+    generate_report(tuple(by), as_csv=args.csv)
+    return 0
+
+def cmd_balance(args):
+    calculate_balance(by_month=args.by_month, as_csv=args.csv)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Expense tracker. Run without a command for the interactive menu.")
+    commands = parser.add_subparsers(dest='command')
+
+    add = commands.add_parser('add', help="add one transaction, or many from a CSV file or stdin")
+    add.add_argument('kind', choices=sorted(KINDS))
+    add.add_argument('--file', help="CSV with a header naming the ledger columns ('-' for stdin)")
+    add.add_argument('--date', help="DD-MM-YYYY or YYYY-MM-DD")
+    add.add_argument('--category', help="expense category")
+    add.add_argument('--source', help="income source")
+    add.add_argument('--description', default='', help="expense description")
+    add.add_argument('--amount')
+    add.set_defaults(func=cmd_add)
+
+    imp = commands.add_parser('import', help="import a CSV, skipping rows already in the ledger")
+    imp.add_argument('ledger', choices=['expenses', 'income', 'recurring'])
+    imp.add_argument('file', help="CSV file ('-' for stdin)")
+    imp.set_defaults(func=cmd_import)
+
+    view = commands.add_parser('view', help="list expenses with their row ids")
+    view.set_defaults(func=cmd_view)
+
+    delete = commands.add_parser('delete', help="delete expenses by id or by condition, in one pass")
+    delete.add_argument('ids', nargs='*', help="row ids as shown by view")
+    delete.add_argument('--file', help="file with one row id per line ('-' for stdin)")
+    delete.add_argument('--where', action='append', default=[],
+                        help="condition such as category=Fun, amount<5 or date<01-01-2024; repeat to AND them")
+    delete.set_defaults(func=cmd_delete)
+
+    compact = commands.add_parser('compact', help="fold pending edits and deletes into the ledger CSV")
+    compact.add_argument('kind', choices=sorted(KINDS), nargs='?', default='expense')
+    compact.set_defaults(func=cmd_compact)
+
+    convert = commands.add_parser('convert', help="rewrite a ledger CSV in the app format (header, ISO dates, row ids)")
+    convert.add_argument('ledger', choices=['expenses', 'income', 'recurring'])
+    convert.set_defaults(func=cmd_convert)
+
+    report = commands.add_parser('report', help="expense totals")
+    report.add_argument('--by', default='category', help="grouping: category, month or month,category")
+    report.add_argument('--csv', action='store_true', help="print CSV instead of text")
+    report.set_defaults(func=cmd_report)
+
+    balance = commands.add_parser('balance', help="income, expenses and balance")
+    balance.add_argument('--by-month', action='store_true', help="one line per month")
+    balance.add_argument('--csv', action='store_true', help="print CSV instead of text")
+    balance.set_defaults(func=cmd_balance)
+    return parser
+
+def main(argv=None):
+    get_backend().ensure()
+    register_derived_stores()
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        interactive()
+        return 0
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
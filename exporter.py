@@ -0,0 +1,100 @@
+import gzip
+import os
+import tempfile
+
+import pandas as pd
+
+from backends import flush_pending, get_backend
+from storage import LEDGERS
+
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPENSE_TRACKER_EXPORT_CHUNK', '100000'))
+
+# format -> (mime type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+# Exports up to this size stay in memory; larger ones spill to a temp file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+def _write_csv_chunks(chunks, out):
+    header = True
+    for chunk in chunks:
+        data = chunk.to_csv(index=False, header=header, date_format='%Y-%m-%d')
+        out.write(data.encode())
+        header = False
+    return header  # still True if nothing was written
+
+
+def _arrow_table(chunk, ledger: str):
+    """Convert a chunk with a fixed per-ledger schema, so every chunk matches the first."""
+    import pyarrow as pa
+
+    _, columns, date_col = LEDGERS[ledger]
+    fields, data = [], {}
+    for col in columns:
+        if col == date_col:
+            fields.append((col, pa.date32()))
+            data[col] = chunk[col].dt.date
+        elif col == 'amount':
+            fields.append((col, pa.float64()))
+            data[col] = chunk[col].astype(float)
+        else:
+            fields.append((col, pa.string()))
+            data[col] = chunk[col].astype('string')
+    return pa.Table.from_pandas(pd.DataFrame(data), schema=pa.schema(fields), preserve_index=False)
+
+
+def write_export(out, ledger: str, fmt: str = 'csv', filters: dict = None, chunk_rows: int = None):
+    """Stream ``ledger`` (optionally filtered) into the binary file object ``out``.
+
+    Rows are pulled from the storage engine ``chunk_rows`` at a time and encoded
+    chunk by chunk, so the export is never held as one DataFrame or bytes object.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt!r} (expected one of {sorted(EXPORT_FORMATS)})")
+    flush_pending(ledger)  # queued appends go out with the export
+    backend = get_backend()
+    chunks = backend.iter_query(ledger, chunk_rows or EXPORT_CHUNK_ROWS, **(filters or {}))
+
+    if fmt == 'csv':
+        if _write_csv_chunks(chunks, out):
+            out.write(backend.query(ledger, **(filters or {})).to_csv(index=False).encode())
+    elif fmt == 'csv.gz':
+        with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+            if _write_csv_chunks(chunks, gz):
+                gz.write(backend.query(ledger, **(filters or {})).to_csv(index=False).encode())
+    else:
+        # pyarrow ships with streamlit; import lazily so the CSV paths never need it
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = _arrow_table(chunk, ledger)
+                if writer is None:
+                    writer = pq.ParquetWriter(out, table.schema)
+                writer.write_table(table)
+            if writer is None:
+                pq.write_table(_arrow_table(backend.query(ledger, **(filters or {})), ledger), out)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def export_file(ledger: str, fmt: str = 'csv', filters: dict = None):
+    """Build an export on demand and return it as a rewound file object.
+
+    Small exports live in memory; larger ones spill to a temporary file on disk.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    write_export(out, ledger, fmt, filters)
+    out.seek(0)
+    return out
+
+
+def export_filename(ledger: str, fmt: str) -> str:
+    return ledger + EXPORT_FORMATS[fmt][1]
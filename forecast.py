@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import rollups
+from backends import ledger_fingerprint, read_ledger
+from ledger import AMOUNT_SCALE, to_minor_array
+from recurring import expand_occurrences
+
+# Longest projection, in days
+MAX_HORIZON_DAYS = int(os.environ.get('EXPENSE_TRACKER_FORECAST_MAX_DAYS', str(10 * 366)))
+# Projections kept in memory, keyed on the rules, the ledger versions, today and horizon
+FORECAST_CACHE_SIZE = 8
+
+# Rule type -> sign of its effect on the balance
+SIGNS = {'income': 1, 'expense': -1}
+
+# ---------------------------
+# ---- Projection  ----
+# ---------------------------
+
+def project_rules(rec: pd.DataFrame, until: date) -> pd.DataFrame:
+    """Every occurrence of the recurring rules from their next date through ``until``.
+
+    Uses ``expand_occurrences``, i.e. ``add_period`` semantics for all rules at once.
+    Columns: ``date`` (datetime64) and ``amount`` (signed int minor units). Due
+    occurrences that have not been posted yet (next date in the past) are included.
+    """
+    occ = expand_occurrences(rec['next_date'].to_numpy(), rec['frequency'].to_numpy(), until)
+    occ = occ[occ['date'] <= pd.Timestamp(until)]
+    sign = rec['type'].astype(str).str.strip().str.lower().map(SIGNS).fillna(0).to_numpy(dtype=np.int64)
+    amounts = to_minor_array(rec['amount']) * sign
+    return pd.DataFrame({'date': occ['date'].to_numpy(), 'amount': amounts[occ['rule'].to_numpy()]})
+
+
+def _ledger_flows(ledger: str, sign: int) -> pd.DataFrame:
+    # Per-day totals from the rollups, so no ledger scan once they are built
+    daily = rollups.daily_rollup(ledger)
+    daily = daily.groupby('date', as_index=False)['amount'].sum()
+    return pd.DataFrame({'date': daily['date'].to_numpy(), 'amount': to_minor_array(daily['amount']) * sign})
+
+
+class Forecast:
+    """Projected balances from ``today`` through ``until``.
+
+    ``daily`` has one row per day (``net`` flow and end-of-day ``balance``),
+    ``monthly`` one per month (``net`` and month-end ``balance``), both indexed by
+    date. ``opening`` is the balance at the end of today, including recurring
+    occurrences that are due but not posted yet. ``first_negative`` is the first
+    day the balance is below zero, or None.
+    """
+
+    __slots__ = ('today', 'until', 'opening', 'daily', 'monthly', 'first_negative')
+
+    def __init__(self, today: date, until: date, opening: float, daily: pd.DataFrame,
+                 monthly: pd.DataFrame, first_negative: date = None):
+        self.today = today
+        self.until = until
+        self.opening = opening
+        self.daily = daily
+        self.monthly = monthly
+        self.first_negative = first_negative
+
+    def copy(self) -> 'Forecast':
+        return Forecast(self.today, self.until, self.opening, self.daily.copy(), self.monthly.copy(),
+                        self.first_negative)
+
+    @property
+    def closing(self) -> float:
+        return float(self.daily['balance'].iloc[-1])
+
+
+def _project(today: date, horizon_days: int) -> Forecast:
+    until = today + timedelta(days=horizon_days)
+    flows = pd.concat([_ledger_flows('income', 1), _ledger_flows('expenses', -1),
+                       project_rules(read_ledger('recurring'), until)])
+    dates = flows['date'].to_numpy().astype('datetime64[D]')
+    amounts = flows['amount'].to_numpy(dtype=np.int64)
+
+    # Everything before today is the starting point; bucket the rest per day offset
+    start = np.datetime64(today, 'D')
+    before = int(amounts[dates < start].sum())
+    window = (dates >= start) & (dates <= np.datetime64(until, 'D'))
+    net = np.zeros(horizon_days + 1, dtype=np.int64)
+    np.add.at(net, (dates[window] - start).astype(np.int64), amounts[window])
+    balance = before + np.cumsum(net)
+
+    index = pd.date_range(today, until, freq='D', name='date')
+    daily = pd.DataFrame({'net': net / AMOUNT_SCALE, 'balance': balance / AMOUNT_SCALE}, index=index)
+    monthly = daily.resample('MS').agg({'net': 'sum', 'balance': 'last'})
+    monthly.index.name = 'month'
+    negative = np.flatnonzero(balance < 0)
+    first_negative = index[negative[0]].date() if len(negative) else None
+    return Forecast(today, until, float(balance[0] / AMOUNT_SCALE), daily, monthly, first_negative)
+
+
+# ---------------------------
+# ---- Cache  ----
+# ---------------------------
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def forecast(horizon_days: int = 365, today: date = None) -> Forecast:
+    """Projected daily and monthly balances over the next ``horizon_days``.
+
+    Memoized on the versions of the expense, income and recurring ledgers (pending
+    writes included), so reruns reuse the projection until one of them changes.
+    """
+    horizon_days = int(horizon_days)
+    if not 1 <= horizon_days <= MAX_HORIZON_DAYS:
+        raise ValueError(f"Forecast horizon must be 1-{MAX_HORIZON_DAYS} days, got {horizon_days}")
+    today = today or date.today()
+    # Versions are taken before computing: a write meanwhile just misses next time
+    key = (today, horizon_days) + tuple(ledger_fingerprint(ledger) for ledger in ('expenses', 'income', 'recurring'))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit.copy()
+
+    result = _project(today, horizon_days)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > FORECAST_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result.copy()
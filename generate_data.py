@@ -0,0 +1,157 @@
+"""Deterministic synthetic ledgers for benchmarking.
+
+Writes expenses.csv, income.csv, recurring.csv, settings.json and budgets.json in
+the current on-disk format (ISO dates, trailing id column) to a directory. The
+same --size/--seed/--end always produces byte-identical files, whatever the
+machine.
+
+    python generate_data.py --size 1m --out bench_data/1m
+"""
+import argparse
+import calendar
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from storage import EXP_COLUMNS, ID_COLUMN, INC_COLUMNS, REC_COLUMNS
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+CHUNK_ROWS = 500_000
+
+# category -> (weight, median amount, descriptions)
+CATEGORY_PROFILE = {
+    'Food': (0.38, 250.0, ['groceries', 'lunch', 'dinner', 'coffee', 'snacks', '']),
+    'Transport': (0.20, 120.0, ['metro', 'cab', 'fuel', 'bus pass', '']),
+    'Utilities': (0.08, 1500.0, ['electricity', 'water', 'internet', 'phone', 'gas']),
+    'Fun': (0.14, 700.0, ['movies', 'concert', 'games', 'books', '']),
+    'Health': (0.07, 900.0, ['pharmacy', 'doctor', 'gym', 'lab tests']),
+    'Other': (0.13, 500.0, ['gift', 'household', 'clothes', 'repairs', '']),
+}
+INCOME_SOURCES = ['Salary', 'Freelance', 'Interest', 'Dividends', 'Refund']
+INCOME_RATIO = 20  # one income row per this many expense rows
+
+
+def _ids(rng: np.random.Generator, n: int) -> np.ndarray:
+    raw = rng.integers(0, 2 ** 63, size=n, dtype=np.int64).astype('>u8').tobytes().hex()
+    return np.frombuffer(raw.encode(), dtype='S16').astype(str)
+
+
+def _dates(rng: np.random.Generator, first: np.datetime64, days: int, n: int) -> np.ndarray:
+    # Sorted within the chunk's slice of the date range, as appended ledgers are
+    return np.datetime_as_string(first + np.sort(rng.integers(0, max(days, 1), size=n)).astype('timedelta64[D]'))
+
+
+def _chunks(n: int, first: np.datetime64, span_days: int):
+    """(chunk number, rows, first day, days) covering ``n`` rows over the date span."""
+    k = max((n + CHUNK_ROWS - 1) // CHUNK_ROWS, 1)
+    for i in range(k):
+        rows = min(CHUNK_ROWS, n - i * CHUNK_ROWS)
+        lo, hi = span_days * i // k, span_days * (i + 1) // k
+        yield i, rows, first + np.timedelta64(lo, 'D'), hi - lo
+
+
+def expense_chunks(n: int, seed: int, first: np.datetime64, span_days: int):
+    cats = list(CATEGORY_PROFILE)
+    weights = np.array([CATEGORY_PROFILE[c][0] for c in cats])
+    medians = np.array([CATEGORY_PROFILE[c][1] for c in cats])
+    for i, rows, start, days in _chunks(n, first, span_days):
+        rng = np.random.default_rng([seed, 1, i])
+        cat = rng.choice(len(cats), size=rows, p=weights / weights.sum())
+        desc = np.empty(rows, dtype=object)
+        for j, c in enumerate(cats):
+            mask = cat == j
+            desc[mask] = rng.choice(CATEGORY_PROFILE[c][2], size=int(mask.sum()))
+        yield pd.DataFrame({
+            'date': _dates(rng, start, days, rows),
+            'category': np.array(cats, dtype=object)[cat],
+            'description': desc,
+            'amount': np.round(medians[cat] * rng.lognormal(0.0, 0.6, size=rows), 2),
+            ID_COLUMN: _ids(rng, rows),
+        }, columns=EXP_COLUMNS + [ID_COLUMN])
+
+
+def income_chunks(n: int, seed: int, first: np.datetime64, span_days: int):
+    for i, rows, start, days in _chunks(n, first, span_days):
+        rng = np.random.default_rng([seed, 2, i])
+        src = rng.choice(len(INCOME_SOURCES), size=rows, p=[0.5, 0.2, 0.1, 0.1, 0.1])
+        base = np.array([50000.0, 12000.0, 800.0, 2500.0, 600.0])[src]
+        yield pd.DataFrame({
+            'date': _dates(rng, start, days, rows),
+            'source': np.array(INCOME_SOURCES, dtype=object)[src],
+            'amount': np.round(base * rng.lognormal(0.0, 0.3, size=rows), 2),
+            ID_COLUMN: _ids(rng, rows),
+        }, columns=INC_COLUMNS + [ID_COLUMN])
+
+
+def recurring_rules(seed: int, end: date, n: int = 24) -> pd.DataFrame:
+    """Recurring rules whose next dates fall in the month before ``end``, so a
+    catch-up on ``end`` has occurrences to post."""
+    rng = np.random.default_rng([seed, 3])
+    freqs = np.array(['daily', 'weekly', 'monthly', 'yearly'])[rng.choice(4, size=n, p=[0.15, 0.3, 0.45, 0.1])]
+    is_income = rng.random(n) < 0.25
+    cats = np.array(list(CATEGORY_PROFILE), dtype=object)[rng.integers(0, len(CATEGORY_PROFILE), size=n)]
+    srcs = np.array(INCOME_SOURCES, dtype=object)[rng.integers(0, len(INCOME_SOURCES), size=n)]
+    next_dates = np.datetime64(end, 'D') - rng.integers(1, 31, size=n).astype('timedelta64[D]')
+    return pd.DataFrame({
+        'type': np.where(is_income, 'income', 'expense'),
+        'category_or_source': np.where(is_income, srcs, cats),
+        'description': np.where(is_income, '', 'subscription'),
+        'amount': np.round(rng.uniform(100, 5000, size=n), 2),
+        'frequency': freqs,
+        'next_date': np.datetime_as_string(next_dates),
+        ID_COLUMN: _ids(rng, n),
+    }, columns=REC_COLUMNS + [ID_COLUMN])
+
+
+def _write_chunks(path: str, chunks) -> int:
+    total = 0
+    with open(path, 'w', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=i == 0, index=False)
+            total += len(chunk)
+    return total
+
+
+def generate(out_dir: str, rows: int, seed: int = 42, end: date = date(2024, 12, 31), years: int = 5) -> dict:
+    """Write a synthetic dataset with ``rows`` expenses to ``out_dir``; returns row counts."""
+    os.makedirs(out_dir, exist_ok=True)
+    start_year = end.year - years
+    # Same day ``years`` back, clamped to the month's end (Feb 29 -> Feb 28), as in recurring.add_period
+    start = date(start_year, end.month, min(end.day, calendar.monthrange(start_year, end.month)[1]))
+    first = np.datetime64(start, 'D') + np.timedelta64(1, 'D')
+    span_days = int((np.datetime64(end, 'D') - first).astype(int)) + 1
+    counts = {
+        'expenses': _write_chunks(os.path.join(out_dir, 'expenses.csv'), expense_chunks(rows, seed, first, span_days)),
+        'income': _write_chunks(os.path.join(out_dir, 'income.csv'),
+                                income_chunks(max(rows // INCOME_RATIO, 1), seed, first, span_days)),
+    }
+    rec = recurring_rules(seed, end)
+    rec.to_csv(os.path.join(out_dir, 'recurring.csv'), index=False)
+    counts['recurring'] = len(rec)
+    with open(os.path.join(out_dir, 'settings.json'), 'w') as f:
+        json.dump({"categories": list(CATEGORY_PROFILE)}, f, indent=2)
+    with open(os.path.join(out_dir, 'budgets.json'), 'w') as f:
+        json.dump({c: round(p[1] * 40, 2) for c, p in CATEGORY_PROFILE.items()}, f, indent=2)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k', help="number of expense rows")
+    parser.add_argument('--rows', type=int, default=None, help="explicit expense row count (overrides --size)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end', type=date.fromisoformat, default=date(2024, 12, 31), help="last ledger date")
+    parser.add_argument('--years', type=int, default=5, help="years of history")
+    parser.add_argument('--out', default=None, help="output directory (default bench_data/<size>)")
+    args = parser.parse_args()
+    rows = args.rows or SIZES[args.size]
+    out = args.out or os.path.join('bench_data', args.size if args.rows is None else str(rows))
+    counts = generate(out, rows, args.seed, args.end, args.years)
+    print(f"Wrote {', '.join(f'{n:,} {k}' for k, n in counts.items())} to {out}")
+
+
+if __name__ == '__main__':
+    main()
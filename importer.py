@@ -0,0 +1,154 @@
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from backends import append_ledger, cached_read, flush_pending, get_backend, parse_dates
+from recurring import FREQUENCIES
+from storage import HASH_INDEX_FILE, LEDGERS, file_fingerprint, file_lock
+
+IMPORT_CHUNK_ROWS = int(os.environ.get('EXPENSE_TRACKER_IMPORT_CHUNK', '50000'))
+
+# Text columns that must be non-empty for a row to be accepted
+REQUIRED_TEXT = {
+    'expenses': ['category'],
+    'income': ['source'],
+    'recurring': ['category_or_source'],
+}
+
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    skipped: int = 0   # identical to rows already in the ledger
+    rejected: int = 0  # unparseable date/amount or missing required fields
+
+
+# ---------------------------
+# ---- Normalization  ----
+# ---------------------------
+
+def normalize_chunk(chunk: pd.DataFrame, ledger: str):
+    """Validate and coerce one raw chunk. Returns (clean rows, number rejected)."""
+    _, columns, date_col = LEDGERS[ledger]
+    missing = [c for c in columns if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"Missing columns for {ledger}: {', '.join(missing)}")
+
+    df = pd.DataFrame({c: chunk[c].fillna('').astype(str).str.strip() for c in columns})
+    df[date_col] = parse_dates(df[date_col])
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+
+    ok = df[date_col].notna() & df['amount'].notna()
+    for col in REQUIRED_TEXT[ledger]:
+        ok &= df[col] != ''
+    if ledger == 'recurring':
+        df['type'] = df['type'].str.lower()
+        df['frequency'] = df['frequency'].str.lower()
+        ok &= df['type'].isin(['expense', 'income']) & df['frequency'].isin(FREQUENCIES)
+    return df[ok].reset_index(drop=True), int((~ok).sum())
+
+
+def row_hashes(df: pd.DataFrame, ledger: str) -> np.ndarray:
+    """Stable 64-bit content hash per row over the canonical form of every column."""
+    _, columns, date_col = LEDGERS[ledger]
+    canon = {}
+    for col in columns:
+        if col == date_col:
+            canon[col] = pd.to_datetime(df[col], errors='coerce').dt.strftime('%Y-%m-%d').fillna('')
+        elif col == 'amount':
+            canon[col] = (pd.to_numeric(df[col], errors='coerce').fillna(0.0) * 100).round().astype('int64')
+        else:
+            canon[col] = df[col].fillna('').astype(str).str.strip()
+    return pd.util.hash_pandas_object(pd.DataFrame(canon), index=False).to_numpy(dtype=np.uint64)
+
+
+# ---------------------------
+# ---- Hash Index  ----
+# ---------------------------
+# Per ledger: sorted unique row hashes with their multiplicity, plus the ledger
+# fingerprint they were computed for. A stale index is rebuilt from the ledger.
+
+def _count(hashes: np.ndarray, counts: np.ndarray = None):
+    if counts is None:
+        counts = np.ones(len(hashes), dtype=np.int64)
+    uniq, inv = np.unique(hashes, return_inverse=True)
+    return uniq, np.bincount(inv, weights=counts, minlength=len(uniq)).astype(np.int64)
+
+
+def _load_index(ledger: str):
+    path = HASH_INDEX_FILE.format(ledger=ledger)
+    current = file_fingerprint(get_backend().fingerprint_path(ledger))
+    try:
+        with np.load(path) as data:
+            if current is not None and json.loads(str(data['fingerprint'])) == list(current):
+                return data['hashes'], data['counts']
+    except (FileNotFoundError, KeyError, ValueError, OSError):
+        pass
+    return _count(row_hashes(cached_read(get_backend(), ledger), ledger))
+
+
+def _save_index(ledger: str, hashes: np.ndarray, counts: np.ndarray):
+    path = HASH_INDEX_FILE.format(ledger=ledger)
+    current = file_fingerprint(get_backend().fingerprint_path(ledger))
+    tmp = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, hashes=hashes, counts=counts, fingerprint=np.array(json.dumps(list(current) if current else None)))
+    os.replace(tmp, path)
+
+
+# ---------------------------
+# ---- Streaming Import  ----
+# ---------------------------
+
+def import_csv(source, ledger: str, chunksize: int = None) -> ImportReport:
+    """Stream ``source`` (path or file object) into ``ledger`` chunk by chunk.
+
+    Each chunk is validated, normalized and checked against the hash index; only
+    rows not already present are appended. Duplicates are counted as a multiset:
+    an upload row is skipped while the ledger still holds an identical row that no
+    earlier upload row has been matched against, so genuinely repeated transactions
+    inside one file are kept, but importing the same file twice inserts nothing.
+    """
+    report = ImportReport()
+    flush_pending(ledger)  # rows still queued are hashed from disk like the rest
+    # Ledger lock first (the usual order): no other writer can append between the
+    # ledger being hashed and the index being stamped with its fingerprint
+    with file_lock(get_backend().fingerprint_path(ledger)), file_lock(HASH_INDEX_FILE.format(ledger=ledger)):
+        hashes, counts = _load_index(ledger)
+        seen = pd.Series(dtype=np.int64)  # upload rows seen so far, per hash
+        inserted = []
+
+        reader = pd.read_csv(source, chunksize=chunksize or IMPORT_CHUNK_ROWS,
+                             dtype=str, keep_default_na=False, skipinitialspace=True)
+        for chunk in reader:
+            clean, rejected = normalize_chunk(chunk, ledger)
+            report.rejected += rejected
+            if clean.empty:
+                continue
+
+            h = row_hashes(clean, ledger)
+            pos = np.searchsorted(hashes, h)
+            pos_ok = pos < len(hashes)
+            existing = np.zeros(len(h), dtype=np.int64)
+            existing[pos_ok] = np.where(hashes[pos[pos_ok]] == h[pos_ok], counts[pos[pos_ok]], 0)
+
+            # Occurrence number of each row among identical upload rows so far
+            hs = pd.Series(h)
+            rank = hs.groupby(hs).cumcount().to_numpy() + seen.reindex(h, fill_value=0).to_numpy()
+            seen = seen.add(hs.value_counts(), fill_value=0).astype(np.int64)
+
+            keep = rank >= existing
+            report.skipped += int((~keep).sum())
+            new_rows = clean[keep]
+            if not new_rows.empty:
+                report.inserted += append_ledger(ledger, new_rows)
+                inserted.append(h[keep])
+
+        if inserted:
+            added = np.concatenate(inserted)
+            hashes, counts = _count(np.concatenate([hashes, added]),
+                                    np.concatenate([counts, np.ones(len(added), dtype=np.int64)]))
+        _save_index(ledger, hashes, counts)
+    return report
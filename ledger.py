@@ -0,0 +1,370 @@
+import csv
+import io
+import re
+import warnings
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+import numpy as np
+import pandas as pd
+
+from storage import DATE_FORMATS, ID_COLUMN, LEDGERS, new_ids
+
+# Amounts are held as int64 fixed-point minor units (paise): 12.50 -> 1250
+AMOUNT_DECIMALS = 2
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMALS
+MAX_MINOR = 2 ** 63 - 1
+
+# ---------------------------
+# ---- Parsing  ----
+# ---------------------------
+
+def parse_dates(values, formats: list = None) -> pd.Series:
+    """Parse date strings to datetime64[ns] using explicit formats, never inference.
+
+    Each format is applied to the values the previous ones could not parse, so the
+    common case (every row in the first format) is a single vectorized pass.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('datetime64[ns]')
+    if pd.api.types.infer_dtype(values, skipna=True) in ('date', 'datetime', 'datetime64'):
+        return pd.to_datetime(values, errors='coerce').astype('datetime64[ns]')
+    text = values.astype(str).str.strip()
+    out = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    pending = pd.Series(True, index=values.index)
+    for fmt in formats or DATE_FORMATS:
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(text[pending], format=fmt, errors='coerce')
+        out[pending] = parsed
+        pending &= out.isna()
+    return out
+
+
+def parse_date(value):
+    """A single ledger date (string, date or datetime) as a date, or None."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def to_minor(value) -> int:
+    """Exact fixed-point amount in minor units, rounded half-even. Raises ValueError."""
+    if isinstance(value, (int, np.integer)):
+        return int(value) * AMOUNT_SCALE
+    try:
+        minor = int(Decimal(str(value).strip()).scaleb(AMOUNT_DECIMALS).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount: {value!r}") from None
+    if not -MAX_MINOR <= minor <= MAX_MINOR:
+        raise ValueError(f"Amount out of range: {value!r}")
+    return minor
+
+
+def to_minor_array(values) -> np.ndarray:
+    """Vectorized ``to_minor`` for bulk work; invalid amounts become 0.
+
+    Amounts with at most AMOUNT_DECIMALS decimals scale to whole numbers in float64
+    and are exact. The rest go through ``to_minor`` (from the text, or a float's
+    shortest repr), so they round half-even on their decimal value as well.
+    """
+    values = pd.Series(values)
+    amounts = pd.to_numeric(values, errors='coerce').fillna(0.0).to_numpy(dtype=np.float64)
+    scaled = amounts * AMOUNT_SCALE
+    whole = np.rint(scaled)
+    out = whole.astype(np.int64)
+    inexact = np.flatnonzero(np.abs(scaled - whole) > 1e-6)
+    if len(inexact):
+        raw = values.to_numpy(dtype=object)[inexact] if values.dtype == object else amounts[inexact]
+        out[inexact] = [to_minor(repr(float(v)) if isinstance(v, (float, np.floating)) else v) for v in raw]
+    return out
+
+
+def from_minor(minor) -> float:
+    return minor / AMOUNT_SCALE
+
+
+def format_minor(minor: int) -> str:
+    """``12.50`` for 1250, without going through a float."""
+    sign = '-' if minor < 0 else ''
+    whole, frac = divmod(abs(int(minor)), AMOUNT_SCALE)
+    return f"{sign}{whole}.{frac:0{AMOUNT_DECIMALS}d}"
+
+
+# ---------------------------
+# ---- CSV Layout  ----
+# ---------------------------
+
+# Layouts a ledger CSV can be found in (see ingest_csv)
+LAYOUT_HEADED = 'headed'          # app format: one header line, a unique id on every row
+LAYOUT_HEADERLESS = 'headerless'  # old CLI format: canonical column order, no header
+LAYOUT_MIXED = 'mixed'            # anything else: headers mid-file, rows without ids, extra fields
+
+_SKIPPED_LINE = re.compile(r'Skipping line (\d+)')
+
+
+@dataclass
+class IngestReport:
+    layout: str = LAYOUT_HEADED
+    rows: int = 0                                 # rows kept
+    rejected: list = field(default_factory=list)  # (line number or None, reason, raw row) per bad row
+
+
+def read_csv(path: str, ledger: str) -> pd.DataFrame:
+    """Rows of a ledger CSV in the app format, as read (no parsing or layout checks).
+
+    The fast path for every load; ``in_app_format`` (on the result indexed by id)
+    tells whether it can be used as is or the file needs ``ingest_csv`` first.
+    Raises pandas' ParserError on rows with more fields than the header.
+    """
+    try:
+        return pd.read_csv(path, dtype={ID_COLUMN: str})
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def in_app_format(df: pd.DataFrame, ledger: str) -> bool:
+    """Whether ``read_csv`` output, indexed by id, is complete: all columns, an id on
+    every row and no stray header rows. O(rows) but no parsing; ids are not checked
+    for uniqueness, which would cost more than the rest of the load's checks together.
+    """
+    _, columns, date_col = LEDGERS[ledger]
+    if df.index.name != ID_COLUMN or not all(col in df.columns for col in columns):
+        return False
+    return not df.index.hasnans and not df[date_col].eq(date_col).any()
+
+
+def _row_text(values) -> str:
+    out = io.StringIO()
+    csv.writer(out).writerow(values)
+    return out.getvalue().rstrip('\r\n')
+
+
+def _lines(path: str, numbers: list) -> dict:
+    wanted, found = set(numbers), {}
+    with open(path, mode='r', newline='') as file:
+        for number, line in enumerate(file, start=1):
+            if number in wanted:
+                found[number] = line.rstrip('\r\n')
+    return found
+
+
+def ingest_csv(path: str, ledger: str):
+    """Read a ledger CSV in any layout it was written in, in bulk.
+
+    Every line is read as strings in one pass. Header lines (the first one, or any
+    further one where files were concatenated) set the column order of the rows
+    after them; rows before any header are in the canonical order of the old CLI,
+    with or without a trailing id. Dates and amounts are parsed column-wise, rows
+    without an id (or with a duplicate one) get a fresh id, and rows that cannot be
+    read are left out and listed in the report.
+    Returns (frame indexed by id with a parsed date column, IngestReport).
+    """
+    _, columns, date_col = LEDGERS[ledger]
+    width = len(columns) + 1
+    report = IngestReport()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', pd.errors.ParserWarning)
+        try:
+            raw = pd.read_csv(path, header=None, names=range(width + 1), dtype=str, keep_default_na=False,
+                              index_col=False, on_bad_lines='warn')
+        except pd.errors.EmptyDataError:
+            raw = pd.DataFrame(columns=range(width + 1), dtype=str)
+    skipped = [int(n) for w in caught for n in _SKIPPED_LINE.findall(str(w.message))]
+    for number, text in sorted(_lines(path, skipped).items()):
+        report.rejected.append((number, 'too many fields', text))
+
+    cells = raw.apply(lambda col: col.str.strip())
+    is_header = np.logical_and.reduce([cells.eq(col).any(axis=1).to_numpy() for col in columns])
+    segment = np.cumsum(is_header)
+
+    parts = []
+    for seg in np.unique(segment):
+        rows = cells[(segment == seg) & ~is_header]
+        if seg == 0:
+            order = columns + [ID_COLUMN]  # before any header: old CLI rows
+        else:
+            order = cells[is_header].iloc[seg - 1].tolist()
+        positions = {name: pos for pos, name in enumerate(order) if name in columns + [ID_COLUMN]}
+        extra = [pos for pos in raw.columns if pos not in positions.values()]
+        part = pd.DataFrame({name: rows[pos] for name, pos in positions.items()}, index=rows.index)
+        part = part.reindex(columns=columns + [ID_COLUMN], fill_value='')
+        part['_extra'] = rows[extra].ne('').any(axis=1) if extra else False
+        parts.append(part)
+    df = pd.concat(parts) if parts else pd.DataFrame(columns=columns + [ID_COLUMN, '_extra'])
+
+    if is_header.any():
+        headed_ok = is_header[0] and is_header.sum() == 1 and not skipped
+        report.layout = LAYOUT_HEADED if headed_ok and df[ID_COLUMN].ne('').all() else LAYOUT_MIXED
+    else:
+        report.layout = LAYOUT_HEADERLESS if df['_extra'].eq(False).all() and not skipped else LAYOUT_MIXED
+
+    df = df[df[columns].ne('').any(axis=1)]  # rows of empty fields
+    dates = parse_dates(df[date_col])
+    amounts = pd.to_numeric(df['amount'], errors='coerce')
+    reasons = pd.Series('', index=df.index)
+    reasons[amounts.isna().to_numpy()] = 'invalid amount'
+    reasons[dates.isna().to_numpy()] = 'invalid date'
+    reasons[df['_extra'].astype(bool).to_numpy()] = 'too many fields'
+    bad = reasons.ne('').to_numpy()
+    for pos, reason in zip(np.flatnonzero(bad), reasons[bad]):
+        report.rejected.append((None, reason, _row_text(raw.iloc[df.index[pos]].tolist()).rstrip(',')))
+
+    df = df.loc[~bad, columns + [ID_COLUMN]].copy()
+    df[date_col] = dates[~bad].to_numpy()
+    df['amount'] = amounts[~bad].to_numpy()
+    ids = df[ID_COLUMN].to_numpy(dtype=object)
+    renew = (df[ID_COLUMN].eq('') | df[ID_COLUMN].duplicated()).to_numpy()
+    if renew.any():
+        ids[renew] = new_ids(int(renew.sum()))
+    report.rows = len(df)
+    return df.drop(columns=ID_COLUMN).set_axis(pd.Index(ids, name=ID_COLUMN)), report
+
+
+# ---------------------------
+# ---- Records  ----
+# ---------------------------
+# Single-row API: typed, slotted records for the CLI and one-off edits. Constructors
+# take amounts in major units (12.5, '12.50'); the ``amount`` attribute holds int
+# minor units and ``date`` a ``date``. ``as_row`` gives the storage form.
+
+class Expense:
+    __slots__ = ('date', 'category', 'description', 'amount', 'id')
+
+    def __init__(self, date, category: str, description: str = '', amount=0, id: str = None):
+        self.date = _record_date(date)
+        self.category = str(category)
+        self.description = str(description or '')
+        self.amount = to_minor(amount)
+        self.id = id
+
+    def as_row(self) -> dict:
+        return {'date': self.date, 'category': self.category, 'description': self.description,
+                'amount': from_minor(self.amount), ID_COLUMN: self.id or ''}
+
+
+class Income:
+    __slots__ = ('date', 'source', 'amount', 'id')
+
+    def __init__(self, date, source: str, amount=0, id: str = None):
+        self.date = _record_date(date)
+        self.source = str(source)
+        self.amount = to_minor(amount)
+        self.id = id
+
+    def as_row(self) -> dict:
+        return {'date': self.date, 'source': self.source, 'amount': from_minor(self.amount), ID_COLUMN: self.id or ''}
+
+
+RECORD_TYPES = {'expenses': Expense, 'income': Income}
+
+
+def _record_date(value) -> date:
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Invalid date: {value!r} (expected one of {', '.join(DATE_FORMATS)})")
+    return parsed
+
+
+# ---------------------------
+# ---- Columnar Ledger  ----
+# ---------------------------
+
+def _encode_ids(ids) -> np.ndarray:
+    # Row ids are 16 hex digits (storage.new_ids), so they fit in a uint64; other
+    # ids (hand-edited files) keep an object array.
+    ids = np.asarray(ids, dtype=object)
+    try:
+        if all(isinstance(i, str) and len(i) == 16 for i in ids):
+            return np.frombuffer(bytes.fromhex(''.join(ids)), dtype='>u8').astype(np.uint64)
+    except ValueError:
+        pass
+    return ids
+
+
+class Ledger:
+    """Compact columnar copy of one ledger.
+
+    Dates are datetime64[D], amounts int64 minor units, and every text column
+    (category, source, description, ...) an int32 code into a table of labels.
+    That is several times smaller than an object-dtype frame of the same rows.
+    """
+
+    __slots__ = ('name', 'ids', 'dates', 'amounts', 'codes', 'labels')
+
+    def __init__(self, name: str, ids, dates, amounts, codes: dict, labels: dict):
+        self.name = name
+        self.ids = ids
+        self.dates = dates
+        self.amounts = amounts
+        self.codes = codes
+        self.labels = labels
+
+    @classmethod
+    def text_columns(cls, name: str) -> list:
+        _, columns, date_col = LEDGERS[name]
+        return [c for c in columns if c not in (date_col, 'amount')]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, name: str) -> 'Ledger':
+        """Encode a frame in the ledger schema (indexed by row id) in one vectorized pass."""
+        date_col = LEDGERS[name][2]
+        codes, labels = {}, {}
+        for col in cls.text_columns(name):
+            values = df[col].fillna('').astype(str) if col in df.columns else pd.Series('', index=df.index)
+            c, uniques = pd.factorize(values, sort=False)
+            codes[col] = c.astype(np.int32)
+            labels[col] = np.asarray(uniques, dtype=object)
+        return cls(
+            name,
+            _encode_ids(df.index.to_numpy()),
+            parse_dates(df[date_col]).to_numpy().astype('datetime64[D]'),
+            to_minor_array(df['amount']),
+            codes,
+            labels,
+        )
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the columns and label tables."""
+        n = self.dates.nbytes + self.amounts.nbytes + sum(c.nbytes for c in self.codes.values())
+        n += self.ids.nbytes if self.ids.dtype != object else int(pd.Series(self.ids).memory_usage(deep=True))
+        n += sum(int(pd.Series(lab).memory_usage(deep=True)) for lab in self.labels.values())
+        return n
+
+    def _group(self, by: str):
+        # (code per row, label per code) for a text column or 'month'
+        if by == 'month':
+            keys, inverse = np.unique(self.dates.astype('datetime64[M]'), return_inverse=True)
+            return inverse, np.array(['unknown' if np.isnat(k) else str(k) for k in keys], dtype=object)
+        return self.codes[by], self.labels[by]
+
+    def totals(self, by) -> dict:
+        """Exact totals in minor units per label of a text column, or per 'month'.
+
+        With a tuple of groups, e.g. ``('month', 'category')``, keys are tuples of labels.
+        """
+        groups = [self._group(g) for g in ((by,) if isinstance(by, str) else by)]
+        if not len(self):
+            return {}
+        dims = [len(labels) for _, labels in groups]
+        keys, inverse = np.unique(np.ravel_multi_index([codes for codes, _ in groups], dims), return_inverse=True)
+        sums = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(sums, inverse, self.amounts)
+        labels = [labels[pos] for (_, labels), pos in zip(groups, np.unravel_index(keys, dims))]
+        if isinstance(by, str):
+            return {label: int(s) for label, s in zip(labels[0], sums)}
+        return {key: int(s) for key, s in zip(zip(*labels), sums)}
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Off unless set: "1" records every rerun and writes the log and textfile below.
+# The debug panel can also switch recording on for a single session.
+METRICS_ENABLED = os.environ.get('EXPENSE_TRACKER_METRICS', '').strip().lower() not in ('', '0', 'false', 'off')
+METRICS_LOG = os.environ.get('EXPENSE_TRACKER_METRICS_LOG', 'metrics.jsonl')
+METRICS_PROM = os.environ.get('EXPENSE_TRACKER_METRICS_PROM', 'metrics.prom')
+
+# ---------------------------
+# ---- Recording  ----
+# ---------------------------
+# Streamlit runs each session's script in its own thread, so the active rerun is
+# thread-local. With no active rerun every hook below is a single attribute check.
+
+_local = threading.local()
+
+
+class Stage:
+    __slots__ = ('name', 'seconds', 'rows', 'bytes')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def as_dict(self) -> dict:
+        return {'stage': self.name, 'seconds': round(self.seconds, 6), 'rows': self.rows, 'bytes': self.bytes}
+
+
+class Rerun:
+    """Stages of one script run, in the order they started."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = []
+        self.stack = []
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {'ts': round(self.started, 3), 'pid': os.getpid(), 'seconds': round(self.seconds, 6),
+                'stages': [s.as_dict() for s in self.stages]}
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def current():
+    return getattr(_local, 'run', None)
+
+
+@contextmanager
+def _timed(run: Rerun, name: str):
+    stage = Stage(name)
+    run.stages.append(stage)
+    run.stack.append(stage)
+    started = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage.seconds = time.perf_counter() - started
+        run.stack.pop()
+
+
+def stage(name: str):
+    """Time a block as a stage of the current rerun (a no-op when not recording)."""
+    run = current()
+    if run is None:
+        return _NO_STAGE
+    return _timed(run, name)
+
+
+def count(rows: int = 0, nbytes: int = 0):
+    """Credit rows processed and bytes read to the innermost running stage."""
+    run = current()
+    if run is None or not run.stack:
+        return
+    top = run.stack[-1]
+    top.rows += int(rows)
+    top.bytes += int(nbytes)
+
+
+@contextmanager
+def rerun(force: bool = False):
+    """Record the stages of one script run; yields the Rerun, or None when off.
+
+    When metrics are enabled the run is appended to METRICS_LOG and folded into
+    the Prometheus textfile METRICS_PROM, even if the run ends in an exception
+    (st.rerun() stops a script by raising).
+    """
+    if not (METRICS_ENABLED or force):
+        yield None
+        return
+    run = Rerun()
+    _local.run = run
+    started = time.perf_counter()
+    try:
+        yield run
+    finally:
+        run.seconds = time.perf_counter() - started
+        _local.run = None
+        if METRICS_ENABLED:
+            publish(run)
+
+
+# ---------------------------
+# ---- Publishing  ----
+# ---------------------------
+
+_totals = {}  # stage -> [runs, seconds, rows, bytes, last seconds]
+_reruns = [0, 0.0]  # count, seconds
+_totals_lock = threading.Lock()
+
+
+def _prom_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus() -> str:
+    """Process-wide totals in the Prometheus text exposition format."""
+    with _totals_lock:
+        totals = {k: list(v) for k, v in _totals.items()}
+        reruns = list(_reruns)
+    lines = [
+        '# HELP expense_tracker_reruns_total Script reruns recorded.',
+        '# TYPE expense_tracker_reruns_total counter',
+        f'expense_tracker_reruns_total {reruns[0]}',
+        '# HELP expense_tracker_rerun_seconds_total Wall time of recorded reruns.',
+        '# TYPE expense_tracker_rerun_seconds_total counter',
+        f'expense_tracker_rerun_seconds_total {reruns[1]:.6f}',
+    ]
+    series = [
+        ('stage_runs_total', 'counter', 'Times each stage ran.', 0, '{:d}'),
+        ('stage_seconds_total', 'counter', 'Wall time spent in each stage.', 1, '{:.6f}'),
+        ('stage_rows_total', 'counter', 'Rows processed in each stage.', 2, '{:d}'),
+        ('stage_bytes_total', 'counter', 'Bytes read in each stage.', 3, '{:d}'),
+        ('stage_last_seconds', 'gauge', 'Wall time of the latest run of each stage.', 4, '{:.6f}'),
+    ]
+    for name, kind, help_text, pos, fmt in series:
+        lines.append(f'# HELP expense_tracker_{name} {help_text}')
+        lines.append(f'# TYPE expense_tracker_{name} {kind}')
+        for stage_name, values in sorted(totals.items()):
+            lines.append(f'expense_tracker_{name}{{stage="{_prom_label(stage_name)}"}} {fmt.format(values[pos])}')
+    return '\n'.join(lines) + '\n'
+
+
+def publish(run: Rerun):
+    """Append ``run`` to the JSON-lines log and rewrite the Prometheus textfile."""
+    # storage reports its loads here, so it is imported only once there is a run to publish
+    from storage import file_lock, write_text_atomic
+    with _totals_lock:
+        _reruns[0] += 1
+        _reruns[1] += run.seconds
+        for s in run.stages:
+            t = _totals.setdefault(s.name, [0, 0.0, 0, 0, 0.0])
+            t[0] += 1
+            t[1] += s.seconds
+            t[2] += s.rows
+            t[3] += s.bytes
+            t[4] = s.seconds
+    if METRICS_LOG:
+        line = json.dumps(run.as_dict()) + '\n'
+        with file_lock(METRICS_LOG), open(METRICS_LOG, 'a') as f:
+            f.write(line)
+    if METRICS_PROM:
+        write_text_atomic(METRICS_PROM, render_prometheus())
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from backends import append_ledger, get_backend, ledger_lock, read_ledger, update_rows
+from storage import REC_STATE_FILE, file_lock, write_json_atomic
+
+FREQUENCIES = ['daily', 'weekly', 'monthly', 'yearly']
+
+# ---------------------------
+# ---- Period Arithmetic  ----
+# ---------------------------
+
+def add_period(d: date, freq: str) -> date:
+    if freq == 'daily':
+        return d + timedelta(days=1)
+    if freq == 'weekly':
+        return d + timedelta(weeks=1)
+    if freq == 'monthly':
+        # Add ~1 month by advancing to next month same day when possible
+        month = d.month + 1
+        year = d.year + (month - 1) // 12
+        month = (month - 1) % 12 + 1
+        day = min(d.day, [31, 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month-1])
+        return date(year, month, day)
+    if freq == 'yearly':
+        try:
+            return date(d.year + 1, d.month, d.day)
+        except ValueError:
+            # Feb 29 -> Feb 28 next year
+            return date(d.year + 1, d.month, 28)
+    return d
+
+
+def _month_start(month_index: np.ndarray) -> np.ndarray:
+    """First day of each month given as ``year * 12 + (month - 1)``."""
+    return (month_index - 1970 * 12).astype('datetime64[M]').astype('datetime64[D]')
+
+
+def expand_occurrences(starts, freqs, until: date) -> pd.DataFrame:
+    """Vectorized equivalent of repeatedly applying ``add_period`` from each start date.
+
+    ``starts`` and ``freqs`` describe one rule per position. Returns a frame with one
+    row per candidate occurrence: ``rule`` (position), ``k`` (step number) and
+    ``date`` (datetime64). For every rule the candidates run up to and including the
+    first date after ``until``, so callers can split them into due occurrences and the
+    new next date. Rules with a missing start or unknown frequency yield no rows.
+    """
+    starts = pd.to_datetime(pd.Series(starts), errors='coerce')
+    freqs = pd.Series(freqs).astype(str).str.strip().str.lower()
+    valid = starts.notna().to_numpy() & freqs.isin(FREQUENCIES).to_numpy()
+
+    rule_pos = np.flatnonzero(valid)
+    start = starts.to_numpy()[valid].astype('datetime64[D]')
+    freq = freqs.to_numpy()[valid]
+    if len(rule_pos) == 0:
+        return pd.DataFrame({'rule': np.array([], dtype=int), 'k': np.array([], dtype=int),
+                             'date': np.array([], dtype='datetime64[ns]')})
+
+    stamp = pd.DatetimeIndex(start)
+    year, month, day = stamp.year.to_numpy(), stamp.month.to_numpy(), stamp.day.to_numpy()
+    until64 = np.datetime64(until, 'D')
+    day_diff = (until64 - start).astype(int)
+    month_diff = (until.year * 12 + until.month - 1) - (year * 12 + month - 1)
+    year_diff = until.year - year
+
+    # Number of steps that may still fall on or before `until`, plus one past it
+    steps = np.select(
+        [freq == 'daily', freq == 'weekly', freq == 'monthly'],
+        [day_diff, np.floor_divide(day_diff, 7), month_diff],
+        default=year_diff,
+    )
+    counts = np.maximum(steps + 2, 1)
+
+    rule = np.repeat(np.arange(len(rule_pos)), counts)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    k = np.arange(counts.sum()) - offsets
+    f = freq[rule]
+
+    dates = start[rule] + np.where(f == 'weekly', 7 * k, k).astype('timedelta64[D]')
+
+    is_month = f == 'monthly'
+    if is_month.any():
+        r, kk = rule[is_month], k[is_month]
+        first = _month_start(year[r] * 12 + month[r] - 1 + kk)
+        days_in_month = ((first.astype('datetime64[M]') + 1).astype('datetime64[D]') - first).astype(int)
+        # add_period clamps to the month length and never grows the day back, so
+        # the day of step k is the running minimum over the months passed so far.
+        clamp = np.where(kk == 0, day[r], np.minimum(day[r], days_in_month))
+        clamp = pd.Series(clamp).groupby(r).cummin().to_numpy()
+        dates[is_month] = first + (clamp - 1).astype('timedelta64[D]')
+
+    is_year = f == 'yearly'
+    if is_year.any():
+        r, kk = rule[is_year], k[is_year]
+        first = _month_start((year[r] + kk) * 12 + month[r] - 1)
+        leap_day = (month[r] == 2) & (day[r] == 29) & (kk > 0)
+        dates[is_year] = first + (np.where(leap_day, 28, day[r]) - 1).astype('timedelta64[D]')
+
+    # Trim the step estimate down to the due dates plus exactly one upcoming date
+    due = dates <= until64
+    n_due = np.bincount(rule, weights=due, minlength=len(rule_pos)).astype(int)
+    keep = due | (k == n_due[rule])
+    return pd.DataFrame({'rule': rule_pos[rule[keep]], 'k': k[keep], 'date': dates[keep].astype('datetime64[ns]')})
+
+
+# ---------------------------
+# ---- Recurring Engine  ----
+# ---------------------------
+
+def due_transactions(rec: pd.DataFrame, today: date):
+    """Split recurring rules into due expense rows, due income rows and new next dates.
+
+    Everything is computed for all rules at once; nothing is written.
+    """
+    occ = expand_occurrences(rec['next_date'].to_numpy(), rec['frequency'].to_numpy(), today)
+    due = occ[occ['date'] <= pd.Timestamp(today)]
+
+    # First candidate past `today` is the new next_date for each rule
+    upcoming = occ[occ['date'] > pd.Timestamp(today)].groupby('rule')['date'].min()
+    next_dates = rec['next_date'].copy()
+    positions = upcoming.index.to_numpy()
+    next_dates.iloc[positions] = upcoming.to_numpy()
+
+    rules = rec.reset_index(drop=True).iloc[due['rule'].to_numpy()]
+    rows = pd.DataFrame({
+        'type': rules['type'].astype(str).str.strip().str.lower().to_numpy(),
+        'name': rules['category_or_source'].astype(str).to_numpy(),
+        'description': rules['description'].fillna('').to_numpy(),
+        'amount': pd.to_numeric(rules['amount'], errors='coerce').fillna(0.0).to_numpy(),
+        'date': due['date'].to_numpy(),
+    })
+    rows = rows.sort_values('date', kind='stable')
+
+    exp = rows[rows['type'] == 'expense']
+    inc = rows[rows['type'] == 'income']
+    expenses = pd.DataFrame({'date': exp['date'], 'category': exp['name'],
+                             'description': exp['description'], 'amount': exp['amount']})
+    income = pd.DataFrame({'date': inc['date'], 'source': inc['name'], 'amount': inc['amount']})
+    return expenses, income, next_dates, len(due) > 0
+
+
+def process_recurring_transactions(today: date = None):
+    """Apply due recurring transactions up to today, then bump next_date accordingly.
+
+    The recurring ledger stays locked from the read to the next_date update, so a
+    rule edited concurrently cannot be posted against stale values or overwritten.
+    """
+    today = today or date.today()
+    with ledger_lock('recurring'):
+        rec = read_ledger('recurring')
+        if rec.empty:
+            return
+        expenses, income, next_dates, changed = due_transactions(rec, today)
+        if changed:
+            # One append per ledger, however many occurrences were generated
+            append_ledger('expenses', expenses)
+            append_ledger('income', income)
+            moved = next_dates.notna() & next_dates.ne(rec['next_date'])
+            rec['next_date'] = next_dates
+            update_rows('recurring', rec[moved])
+
+
+# ---------------------------
+# ---- Catch-up Scheduler  ----
+# ---------------------------
+
+# ledger key -> date of the last catch-up this process knows about
+_last_run = {}
+_last_run_lock = threading.Lock()
+
+
+def _ledger_key() -> str:
+    return os.path.abspath(get_backend().fingerprint_path('recurring'))
+
+
+def _read_state() -> dict:
+    try:
+        with open(REC_STATE_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def run_catch_up(today: date = None, force: bool = False) -> bool:
+    """Post due recurring transactions at most once per day per ledger.
+
+    The last run date is persisted in REC_STATE_FILE. After the first call of the
+    day this only compares two dates in memory, so interactive reruns pay nothing.
+    The check-and-run happens under a file lock, so concurrent sessions (threads or
+    processes) never post the same occurrence twice. Returns True if a catch-up ran.
+    """
+    today = today or date.today()
+    key = _ledger_key()
+    if not force and _last_run.get(key) == today:
+        return False
+
+    with _last_run_lock, file_lock(REC_STATE_FILE):
+        state = _read_state()
+        if not force and state.get(key) == today.isoformat():
+            _last_run[key] = today
+            return False
+        process_recurring_transactions(today)
+        state[key] = today.isoformat()
+        write_json_atomic(REC_STATE_FILE, state)
+        _last_run[key] = today
+    return True
+
+
+def reset_catch_up():
+    """Forget today's run so edited or newly added rules are picked up on the next call."""
+    key = _ledger_key()
+    with _last_run_lock, file_lock(REC_STATE_FILE):
+        _last_run.pop(key, None)
+        state = _read_state()
+        if state.pop(key, None) is not None:
+            write_json_atomic(REC_STATE_FILE, state)
+
+
+def main():
+    # Cron-style entry point, e.g. `5 0 * * * cd /srv/tracker && python recurring.py`
+    parser = argparse.ArgumentParser(description="Post due recurring transactions.")
+    parser.add_argument('--date', type=date.fromisoformat, default=None,
+                        help="treat this ISO date as today (default: today)")
+    parser.add_argument('--force', action='store_true',
+                        help="run even if a catch-up already happened for this date")
+    args = parser.parse_args()
+    get_backend().ensure()
+    ran = run_catch_up(args.date, force=args.force)
+    print("Recurring catch-up done." if ran else "Recurring catch-up already ran for this date.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import json
+import os
+
+import pandas as pd
+
+from backends import filter_frame, fresh_derived, get_backend, with_pending
+from storage import ROLLUP_FILE, cached_load, file_lock, write_json_atomic
+
+# Grouping key per ledger
+ROLLUP_KEYS = {'expenses': 'category', 'income': 'source'}
+
+# ---------------------------
+# ---- Persisted State  ----
+# ---------------------------
+# rollups.json holds, per ledger:
+#   "fingerprint": fingerprint of the ledger's backing file the totals correspond to
+#   "daily":   {"YYYY-MM-DD": {key: total}}
+#   "monthly": {"YYYY-MM": {key: total}}
+# A fingerprint mismatch means some writer bypassed the delta path (e.g. the CLI),
+# and the ledger's rollup is rebuilt from scratch on the next read.
+
+def _read_state_file() -> dict:
+    try:
+        with open(ROLLUP_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _load_state() -> dict:
+    if not os.path.exists(ROLLUP_FILE):
+        return {}
+    return cached_load(ROLLUP_FILE, _read_state_file)
+
+
+def _group(df: pd.DataFrame, key: str, freq_fmt: str) -> dict:
+    if df is None or df.empty:
+        return {}
+    dates = pd.to_datetime(df['date'], errors='coerce')
+    df, dates = df[dates.notna()], dates[dates.notna()]
+    amounts = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0)
+    grouped = amounts.groupby([dates.dt.strftime(freq_fmt), df[key].fillna('').astype(str)]).sum()
+    out = {}
+    for (period, k), total in grouped.items():
+        out.setdefault(period, {})[k] = float(total)
+    return out
+
+
+def _merge(target: dict, delta: dict, sign: float):
+    for period, totals in delta.items():
+        bucket = target.setdefault(period, {})
+        for k, total in totals.items():
+            value = bucket.get(k, 0.0) + sign * total
+            if abs(value) < 1e-9:
+                bucket.pop(k, None)
+            else:
+                bucket[k] = value
+        if not bucket:
+            target.pop(period, None)
+
+
+def _build(ledger: str, df: pd.DataFrame) -> dict:
+    key = ROLLUP_KEYS[ledger]
+    return {
+        'fingerprint': None,  # set when the entry is stored
+        'daily': _group(df, key, '%Y-%m-%d'),
+        'monthly': _group(df, key, '%Y-%m'),
+    }
+
+
+# ---------------------------
+# ---- Incremental Upkeep  ----
+# ---------------------------
+
+def on_ledger_write(ledger: str, before, after, added=None, removed=None):
+    """Write listener: fold a ledger delta into the rollups under a lock."""
+    with file_lock(ROLLUP_FILE):
+        state = _read_state_file()
+        before = list(before) if before else None
+        after = list(after) if after else None
+
+        # Other ledgers stored in the same file (SQLite) are unaffected by this
+        # write; carry their fingerprint forward so they are not rebuilt.
+        dirty = ledger in ROLLUP_KEYS
+        for other, entry in state.items():
+            if other != ledger and entry.get('fingerprint') == before and before is not None:
+                entry['fingerprint'] = after
+                dirty = True
+        if not dirty:
+            return
+
+        if ledger in ROLLUP_KEYS:
+            entry = state.get(ledger)
+            if entry is not None and before is not None and entry.get('fingerprint') == before:
+                key = ROLLUP_KEYS[ledger]
+                for df, sign in ((added, 1.0), (removed, -1.0)):
+                    _merge(entry['daily'], _group(df, key, '%Y-%m-%d'), sign)
+                    _merge(entry['monthly'], _group(df, key, '%Y-%m'), sign)
+                entry['fingerprint'] = after
+            else:
+                state.pop(ledger, None)  # out of sync: rebuild lazily
+        write_json_atomic(ROLLUP_FILE, state)
+
+
+
+def _fresh(ledger: str) -> dict:
+    """Rollup entry for ``ledger``, rebuilding it if it no longer matches the ledger."""
+    def load():
+        entry = _load_state().get(ledger)
+        return entry, entry.get('fingerprint') if entry is not None else None
+
+    def save(entry, fingerprint):
+        state = _read_state_file()
+        state[ledger] = {**entry, 'fingerprint': fingerprint}
+        write_json_atomic(ROLLUP_FILE, state)
+
+    return fresh_derived(ledger, ROLLUP_FILE, load, lambda df: _build(ledger, df), save)
+
+
+def _with_pending(ledger: str) -> dict:
+    """Rollup entry plus the rows still in the write-behind queue."""
+    entry, extra = with_pending(ledger, lambda: _fresh(ledger))
+    if extra is None:
+        return entry
+    key = ROLLUP_KEYS[ledger]
+    merged = {}
+    for name, fmt in (('daily', '%Y-%m-%d'), ('monthly', '%Y-%m')):
+        merged[name] = {period: dict(totals) for period, totals in entry[name].items()}
+        _merge(merged[name], _group(extra, key, fmt), 1.0)
+    return merged
+
+
+# ---------------------------
+# ---- Queries  ----
+# ---------------------------
+
+def _frame(buckets: dict, period_name: str, key: str) -> pd.DataFrame:
+    rows = [(period, k, total) for period, totals in buckets.items() for k, total in totals.items()]
+    return pd.DataFrame(rows, columns=[period_name, key, 'amount'])
+
+
+def daily_rollup(ledger: str) -> pd.DataFrame:
+    """Daily totals as columns ``date`` (datetime64), key column and ``amount``."""
+    df = _frame(_with_pending(ledger)['daily'], 'date', ROLLUP_KEYS[ledger])
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
+    return df
+
+
+def monthly_rollup(ledger: str) -> pd.DataFrame:
+    """Monthly totals as columns ``month`` ('YYYY-MM'), key column and ``amount``."""
+    return _frame(_with_pending(ledger)['monthly'], 'month', ROLLUP_KEYS[ledger])
+
+
+def totals(ledger: str, by: str, start_date=None, end_date=None, categories=None,
+           min_amt: float = 0.0, max_amt: float = 0.0, ids=None) -> pd.DataFrame:
+    """Drop-in for ``backend.totals`` served from the rollups.
+
+    Per-row amount bounds and id sets (search matches) cannot be answered from
+    totals, so those queries fall through to the storage engine.
+    """
+    if min_amt or max_amt or ids is not None:
+        filters = dict(start_date=start_date, end_date=end_date, categories=categories,
+                       min_amt=min_amt, max_amt=max_amt, ids=ids)
+        stored, extra = with_pending(ledger, lambda: get_backend().totals(ledger, by, **filters))
+        if extra is None:
+            return stored
+        extra = filter_frame(extra, **filters)
+        return pd.concat([stored, extra[[by, 'amount']]]).groupby(by, as_index=False)['amount'].sum()
+    key = ROLLUP_KEYS[ledger]
+    daily = daily_rollup(ledger)
+    mask = pd.Series(True, index=daily.index)
+    if start_date is not None:
+        mask &= daily['date'] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        mask &= daily['date'] <= pd.Timestamp(end_date)
+    if key == 'category' and categories:
+        mask &= daily[key].isin(categories)
+    return daily.loc[mask].groupby(by, as_index=False)['amount'].sum()
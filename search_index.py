@@ -0,0 +1,259 @@
+import bisect
+import json
+import os
+import re
+import sys
+
+import pandas as pd
+
+from backends import carry_forward, fresh_derived, pending_rows
+from storage import (ID_COLUMN, SEARCH_INDEX_FILE, SEARCH_LOG_FILE, SharedValue, cached_load, file_lock,
+                     invalidate, write_json_atomic, write_text_atomic)
+
+# Text columns indexed per ledger
+SEARCH_COLUMNS = {'expenses': ['description'], 'income': ['source']}
+
+TOKEN_RE = re.compile(r'\w+')
+
+# The change log is folded into the index file once it exceeds this size or a
+# quarter of the index, whichever is larger
+SEARCH_LOG_MAX_BYTES = 256 * 1024
+
+# ---------------------------
+# ---- Persisted State  ----
+# ---------------------------
+# <ledger>_search.json holds:
+#   "fingerprint": fingerprint of the ledger's backing file the index corresponds to
+#   "postings":    {token: [row ids]}
+# <ledger>_search.log holds the changes since, one JSON object per line: the first
+# line repeats the index file's fingerprint, and every later one carries the
+# ledger fingerprint after a write plus the postings it added ("add") and removed
+# ("del"). Writes append a line, so their cost follows the size of the delta, not
+# of the index; the log is folded into the index file once it grows. As with the
+# rollups, a fingerprint mismatch means a writer bypassed the delta path, and the
+# index is rebuilt from the ledger on the next search.
+
+def _path(ledger: str) -> str:
+    return SEARCH_INDEX_FILE.format(ledger=ledger)
+
+
+def _log_path(ledger: str) -> str:
+    return SEARCH_LOG_FILE.format(ledger=ledger)
+
+
+def tokenize(text) -> list:
+    """Lower-cased word tokens of ``text``."""
+    return TOKEN_RE.findall(str(text).lower()) if text is not None and text == text else []
+
+
+def _postings(df: pd.DataFrame, ledger: str) -> dict:
+    """{token: [ids]} for the indexed columns of ``df``, built in one vectorized pass."""
+    if df is None or df.empty:
+        return {}
+    parts = []
+    for col in SEARCH_COLUMNS[ledger]:
+        if col in df.columns:
+            tokens = df[col].fillna('').astype(str).str.lower().str.findall(TOKEN_RE.pattern)
+            parts.append(tokens.explode().dropna())
+    if not parts:
+        return {}
+    pairs = pd.concat(parts)
+    frame = pd.DataFrame({'token': pairs.to_numpy(), 'id': pairs.index.to_numpy()}).drop_duplicates()
+    return {token: ids.tolist() for token, ids in frame.groupby('token', sort=False)['id']}
+
+
+class TextIndex(SharedValue):
+    """Read-only view of one ledger's postings with a sorted vocabulary for prefix lookups."""
+
+    __slots__ = ('postings', 'vocab', 'fingerprint')
+
+    def __init__(self, postings: dict, fingerprint=None):
+        self.postings = postings
+        self.vocab = sorted(postings)
+        self.fingerprint = fingerprint
+
+    @property
+    def nbytes(self) -> int:
+        n = sys.getsizeof(self.postings) + sys.getsizeof(self.vocab)
+        for token, ids in self.postings.items():
+            # Ids are equal-length hex strings, so the first one sizes them all
+            n += sys.getsizeof(token) + sys.getsizeof(ids) + (sys.getsizeof(ids[0]) * len(ids) if ids else 0)
+        return n
+
+    def prefix(self, prefix: str) -> set:
+        """Ids of rows with a token starting with ``prefix``."""
+        ids = set()
+        start = bisect.bisect_left(self.vocab, prefix)
+        for token in self.vocab[start:]:
+            if not token.startswith(prefix):
+                break
+            ids.update(self.postings[token])
+        return ids
+
+    def search(self, query: str) -> set:
+        """Ids matching every term of ``query``, each as a prefix."""
+        result = None
+        for term in sorted(set(tokenize(query)), key=len, reverse=True):
+            ids = self.prefix(term)
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result or set()
+
+
+def _read_base(ledger: str) -> TextIndex:
+    try:
+        with open(_path(ledger), 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return TextIndex({})
+    return TextIndex(state.get('postings', {}), state.get('fingerprint'))
+
+
+def _read_log(ledger: str) -> list:
+    try:
+        with open(_log_path(ledger), 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def _log_head(ledger: str):
+    """Fingerprint on the last line of the change log (what the index is current with), or None."""
+    try:
+        with open(_log_path(ledger), 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            pos, tail = end, b''
+            # Read backwards until the tail holds a whole last line
+            while pos > 0 and tail.rstrip(b'\n').count(b'\n') == 0:
+                step = min(pos, 64 * 1024)
+                pos -= step
+                f.seek(pos)
+                tail = f.read(step) + tail
+        return json.loads(tail.rstrip(b'\n').rsplit(b'\n', 1)[-1]).get('fingerprint')
+    except (FileNotFoundError, ValueError, IndexError):
+        return None
+
+
+def _append_log(ledger: str, entry: dict):
+    with open(_log_path(ledger), 'a') as f:
+        f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+    invalidate(_log_path(ledger))
+
+
+def _write_full(ledger: str, postings: dict, fingerprint):
+    """Write the whole index and start a new change log from it."""
+    write_json_atomic(_path(ledger), {'fingerprint': fingerprint, 'postings': postings})
+    write_text_atomic(_log_path(ledger), json.dumps({'fingerprint': fingerprint}) + '\n')
+
+
+def _drop(ledger: str):
+    for path in (_log_path(ledger), _path(ledger)):
+        if os.path.exists(path):
+            os.remove(path)
+        invalidate(path)
+
+
+def _replay(postings: dict, entries: list) -> dict:
+    """``postings`` with the changes in ``entries`` applied; lists it does not touch are shared."""
+    postings = dict(postings)
+    owned = set()  # tokens whose id list was copied here, so it may be changed in place
+    for entry in entries:
+        for token, ids in entry.get('del', {}).items():
+            kept = postings.get(token)
+            if kept is None:
+                continue
+            gone = set(ids)
+            kept = [i for i in kept if i not in gone]
+            owned.add(token)
+            if kept:
+                postings[token] = kept
+            else:
+                del postings[token]
+        for token, ids in entry.get('add', {}).items():
+            if token not in owned:
+                postings[token] = list(postings.get(token, ()))
+                owned.add(token)
+            postings[token].extend(ids)
+    return postings
+
+
+# ---------------------------
+# ---- Incremental Upkeep  ----
+# ---------------------------
+
+def _maybe_fold(ledger: str):
+    # Fold the log into the index file once replaying it on load would cost more
+    # than rewriting the index; the cost is amortized over the writes it absorbed
+    size = os.path.getsize(_log_path(ledger))
+    if size <= max(SEARCH_LOG_MAX_BYTES, os.path.getsize(_path(ledger)) // 4):
+        return
+    index = _load_index(ledger)
+    if index.fingerprint is None:
+        _drop(ledger)
+    else:
+        _write_full(ledger, index.postings, index.fingerprint)
+
+
+def on_ledger_write(ledger: str, before, after, added=None, removed=None):
+    """Write listener: append a ledger delta to its search index's change log under a lock."""
+    before = list(before) if before else None
+    after = list(after) if after else None
+    carry_forward(ledger, before, after, {other: _path(other) for other in SEARCH_COLUMNS}, _log_head,
+                  lambda other, fingerprint: _append_log(other, {'fingerprint': fingerprint}))
+    if ledger not in SEARCH_COLUMNS or not os.path.exists(_path(ledger)):
+        return  # nothing built yet; the first search builds it
+    with file_lock(_path(ledger)):
+        if before is not None and _log_head(ledger) == before:
+            # Edits arrive as the old rows in ``removed`` and the new ones in ``added``
+            _append_log(ledger, {'fingerprint': after, 'del': _postings(removed, ledger),
+                                 'add': _postings(added, ledger)})
+            _maybe_fold(ledger)
+        else:
+            _drop(ledger)  # out of sync: rebuild lazily
+
+
+
+def _fresh(ledger: str) -> TextIndex:
+    """Search index for ``ledger``, rebuilding it if it no longer matches the ledger."""
+    def load():
+        if not os.path.exists(_log_path(ledger)):
+            return None, None
+        # Keyed on the log, which every write (and every fold) changes
+        index = cached_load(_log_path(ledger), lambda: _load_index(ledger), name=f'search:{ledger}')
+        return index, index.fingerprint
+
+    return fresh_derived(ledger, _path(ledger), load, lambda df: TextIndex(_postings(df, ledger)),
+                         lambda index, fingerprint: _write_full(ledger, index.postings, fingerprint))
+
+
+def _load_index(ledger: str) -> TextIndex:
+    # Under the lock so the index file and its log are from the same generation
+    with file_lock(_path(ledger)):
+        entries = _read_log(ledger)
+        if not entries:
+            return TextIndex({})
+        base = cached_load(_path(ledger), lambda: _read_base(ledger), name=f'search-base:{ledger}')
+        if base.fingerprint is None or base.fingerprint != entries[0].get('fingerprint'):
+            return TextIndex({})  # from different generations: rebuild
+        if len(entries) == 1:
+            return base
+        return TextIndex(_replay(base.postings, entries[1:]), entries[-1].get('fingerprint'))
+
+
+# ---------------------------
+# ---- Queries  ----
+# ---------------------------
+
+def search(ledger: str, query: str) -> pd.Index:
+    """Ids of ``ledger`` rows whose indexed text matches every term of ``query`` as a prefix.
+
+    The result is meant for the ``ids`` filter of ``backends.filter_frame`` and
+    the storage engines' queries. Rows still in the write-behind queue are
+    matched in memory.
+    """
+    extra = pending_rows(ledger)  # before the index, as in backends.read_ledger
+    ids = _fresh(ledger).search(query)
+    if extra is not None:
+        ids |= TextIndex(_postings(extra, ledger)).search(query)
+    return pd.Index(sorted(ids), dtype=object, name=ID_COLUMN)
@@ -0,0 +1,527 @@
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# --------------------------
+# ---- File Definitions ----
+# --------------------------
+EXP_FILE = 'expenses.csv'
+INC_FILE = 'income.csv'
+REC_FILE = 'recurring.csv'
+REC_STATE_FILE = 'recurring_state.json'  # last recurring catch-up per ledger
+ROLLUP_FILE = 'rollups.json'  # daily/monthly totals per category and source
+HASH_INDEX_FILE = '{ledger}_hashes.npz'  # row content hashes used to de-duplicate imports
+SEARCH_INDEX_FILE = '{ledger}_search.json'  # inverted index over descriptions and sources
+SEARCH_LOG_FILE = '{ledger}_search.log'  # changes to the search index since it was last written in full
+BALANCE_INDEX_FILE = '{ledger}_balance.npz'  # running totals per day, overall and per category/source
+JOURNAL_SUFFIX = '.journal.csv'  # per-ledger log of row edits/deletes not yet folded into the CSV
+REJECTED_SUFFIX = '.rejected.csv'  # rows left out when a legacy ledger was converted to the app format
+
+# A ledger is compacted once deleted rows (tombstones in its journal) make up this share of it
+TOMBSTONE_RATIO = float(os.environ.get('EXPENSE_TRACKER_TOMBSTONE_RATIO', '0.2'))
+
+EXP_COLUMNS = ["date", "category", "description", "amount"]
+INC_COLUMNS = ["date", "source", "amount"]
+REC_COLUMNS = ["type", "category_or_source", "description", "amount", "frequency", "next_date"]
+
+DATE_COLUMNS = ("date", "next_date")
+
+# Date formats tried in order when parsing ledgers: ISO (app) and DD-MM-YYYY (CLI)
+DATE_FORMATS = [f.strip() for f in os.environ.get('EXPENSE_TRACKER_DATE_FORMATS', '%Y-%m-%d,%d-%m-%Y').split(',') if f.strip()]
+
+# Persistent row identifier, stored as the last column of every ledger file
+ID_COLUMN = "id"
+
+# ledger name -> (csv path, columns, date column)
+LEDGERS = {
+    'expenses': (EXP_FILE, EXP_COLUMNS, 'date'),
+    'income': (INC_FILE, INC_COLUMNS, 'date'),
+    'recurring': (REC_FILE, REC_COLUMNS, 'next_date'),
+}
+
+# Upper bound for the in-memory loader cache, shared by every session in the process
+CACHE_MAX_BYTES = int(os.environ.get('EXPENSE_TRACKER_CACHE_MB', '256')) * 1024 * 1024
+
+# ---------------------------
+# ---- Loader Cache  ----
+# ---------------------------
+
+_cache = OrderedDict()  # (path, loader name) -> (fingerprint, value, nbytes)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def file_fingerprint(path: str):
+    """Return ``(path, mtime_ns, size, inode)`` for ``path``, or None if it does not exist.
+
+    The inode changes on every atomic replace, even within the mtime resolution.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class SharedValue:
+    """Base for loaded values that are never mutated after construction.
+
+    ``cached_load`` hands out the cached instance itself rather than a copy, and
+    charges ``nbytes`` (the subclass's estimate of its footprint) to the cache.
+    """
+
+    __slots__ = ()
+
+    def copy(self):
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        raise NotImplementedError
+
+
+def _value_nbytes(value) -> int:
+    if isinstance(value, SharedValue):
+        return int(value.nbytes)
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(index=True, deep=True)  # per column for frames, a total for series
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    return sys.getsizeof(value)
+
+
+def _value_rows(value) -> int:
+    return len(value) if hasattr(value, 'memory_usage') else 0
+
+
+def _evict_locked(path=None):
+    global _cache_bytes
+    for key in [k for k in _cache if path is None or k[0] == path]:
+        _cache_bytes -= _cache.pop(key)[2]
+
+
+def cached_load(path: str, loader, name: str = None):
+    """Return ``loader()``, memoized on the fingerprint of ``path``.
+
+    Entries are reused until the file's mtime or size changes (or a writer calls
+    ``invalidate``) and are evicted least-recently-used once the cache grows past
+    ``CACHE_MAX_BYTES``. Callers always receive a copy, so they may mutate it freely.
+    ``name`` distinguishes several loaders over the same file and defaults to the
+    loader's qualified name.
+    """
+    global _cache_bytes
+    path = os.path.abspath(path)
+    key = (path, name or getattr(loader, '__qualname__', repr(loader)))
+    fingerprint = file_fingerprint(path)
+    if fingerprint is None:
+        return loader()
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            _cache.move_to_end(key)
+            value = entry[1].copy()
+            metrics.count(rows=_value_rows(value))
+            return value
+
+    # Load outside the lock; the fingerprint was taken first, so a concurrent
+    # write during the load simply causes a reload on the next call.
+    value = loader()
+    metrics.count(rows=_value_rows(value), nbytes=fingerprint[2])
+    nbytes = _value_nbytes(value)
+    with _cache_lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _cache_bytes -= old[2]
+        if nbytes <= CACHE_MAX_BYTES:
+            _cache[key] = (fingerprint, value, nbytes)
+            _cache_bytes += nbytes
+            while _cache_bytes > CACHE_MAX_BYTES:
+                _cache_bytes -= _cache.popitem(last=False)[1][2]
+    return value.copy()
+
+
+def invalidate(path=None):
+    """Drop cached loads for ``path`` (or everything). Every writer must call this."""
+    with _cache_lock:
+        _evict_locked(None if path is None else os.path.abspath(path))
+
+
+# ---------------------------
+# ---- Locking  ----
+# ---------------------------
+
+# abspath -> depth of file_lock() nesting held by the current thread
+_held = threading.local()
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive advisory lock on ``path + '.lock'`` across threads and processes.
+
+    The lock is re-entrant within a thread, so a writer holding a ledger's lock can
+    call helpers that lock the same ledger. Locks on different files must always be
+    taken in the same order (ledger before derived stores) to avoid deadlocks.
+    """
+    key = os.path.abspath(path)
+    depth = getattr(_held, 'depth', None)
+    if depth is None:
+        depth = _held.depth = {}
+    if depth.get(key):
+        depth[key] += 1
+        try:
+            yield
+        finally:
+            depth[key] -= 1
+        return
+
+    with open(path + '.lock', 'a+') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+        depth[key] = 1
+        try:
+            yield
+        finally:
+            depth.pop(key, None)
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _tmp_path(path: str) -> str:
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def write_json_atomic(path: str, data):
+    """Write ``data`` as JSON via a temp file and rename, so readers never see a torn file."""
+    write_text_atomic(path, json.dumps(data, indent=2))
+
+
+def write_text_atomic(path: str, text: str):
+    """Write ``text`` via a temp file and rename."""
+    tmp = _tmp_path(path)
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    invalidate(path)
+
+
+def read_json(path: str, default=None):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def update_json(path: str, update, default=None, retries: int = 5):
+    """Read-modify-write a JSON file with an optimistic version check.
+
+    ``update`` receives the current contents and returns the new ones. It runs
+    without the lock; the result is written (atomically, under the lock) only if
+    the file still has the version it was computed from, otherwise it is retried
+    on the fresh contents. The final attempt runs entirely under the lock.
+    Returns the contents written.
+    """
+    for _ in range(retries):
+        version = file_fingerprint(path)
+        data = update(read_json(path, default))
+        with file_lock(path):
+            if file_fingerprint(path) == version:
+                write_json_atomic(path, data)
+                return data
+    with file_lock(path):
+        data = update(read_json(path, default))
+        write_json_atomic(path, data)
+        return data
+
+
+# ---------------------------
+# ---- Append Path  ----
+# ---------------------------
+
+def _normalize_value(col: str, value):
+    """Coerce a single cell to the on-disk representation used by the ledgers."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if col in DATE_COLUMNS and isinstance(value, (date, datetime)):
+        if isinstance(value, datetime):
+            value = value.date()
+        return value.isoformat()
+    if col == 'amount':
+        return float(value)
+    return value
+
+
+def _read_header(path: str) -> list:
+    with open(path, mode='r', newline='') as file:
+        return next(csv.reader(file), [])
+
+
+def _file_header(path: str, columns: list):
+    """Return the column order to append with, and whether a header must be written.
+
+    Only the first line of the file is inspected, so this is O(1) in ledger size.
+    Headerless files (as written by older CLI versions) keep the canonical order.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return list(columns), True
+    first = ensure_id_column(path, columns) if ID_COLUMN in columns else _read_header(path)
+    if all(col in first for col in columns):
+        return first, False
+    return list(columns), False
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, mode='rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) in (b'\n', b'\r')
+
+
+def _append_frame(path: str, df, header: list, write_header: bool) -> int:
+    """Vectorized append for DataFrames (e.g. a batch of recurring occurrences)."""
+    import pandas as pd
+
+    if df.empty:
+        return 0
+    out = df.reindex(columns=header)
+    if ID_COLUMN in out.columns:
+        missing = out[ID_COLUMN].isna()
+        if missing.any():
+            out.loc[missing, ID_COLUMN] = new_ids(int(missing.sum()))
+    for col in DATE_COLUMNS:
+        if col in out.columns:
+            out[col] = pd.to_datetime(out[col], errors='coerce').dt.strftime('%Y-%m-%d')
+    if 'amount' in out.columns:
+        out['amount'] = pd.to_numeric(out['amount'], errors='raise').astype(float)
+    needs_newline = not write_header and not _ends_with_newline(path)
+    with open(path, mode='a', newline='') as file:
+        if needs_newline:
+            file.write('\n')
+        out.to_csv(file, header=write_header, index=False)
+    invalidate(path)
+    return len(out)
+
+
+def append_rows(path: str, rows, columns: list) -> int:
+    """Append ``rows`` to the CSV at ``path`` without rewriting existing content.
+
+    ``rows`` is an iterable of dicts or a DataFrame. A header is written when the
+    file is new or empty; otherwise values are laid out to match the existing
+    header. Dates are written as ISO strings and amounts as floats.
+    Rows without an ``id`` get a fresh one when the ledger has an id column.
+    Runs under the ledger's file lock. Returns the number of rows written.
+    """
+    with file_lock(path):
+        return _append_rows(path, rows, columns)
+
+
+def _append_rows(path: str, rows, columns: list) -> int:
+    header, write_header = _file_header(path, columns)
+    if hasattr(rows, 'to_csv'):
+        return _append_frame(path, rows, header, write_header)
+    records = [[_normalize_value(col, row.get(col, '')) for col in header] for row in rows]
+    if ID_COLUMN in header:
+        pos = header.index(ID_COLUMN)
+        for record in records:
+            if not record[pos]:
+                record[pos] = new_ids(1)[0]
+    if not records:
+        return 0
+    needs_newline = not write_header and not _ends_with_newline(path)
+    with open(path, mode='a', newline='') as file:
+        if needs_newline:
+            file.write('\n')
+        writer = csv.writer(file)
+        if write_header:
+            writer.writerow(header)
+        writer.writerows(records)
+    invalidate(path)
+    return len(records)
+
+
+def write_csv(df, path: str):
+    """Rewrite the whole CSV at ``path`` from ``df`` via a temp file and atomic rename."""
+    with file_lock(path):
+        tmp = _tmp_path(path)
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+    invalidate(path)
+
+
+# ---------------------------
+# ---- Row IDs & Journal  ----
+# ---------------------------
+# Every ledger row carries a random 64-bit hex id. Edits and deletes made by id are
+# appended to ``<ledger>.journal.csv`` (op, id, columns...) instead of rewriting the
+# ledger; readers apply the last op per id on top of the CSV. A full rewrite of
+# the ledger folds the journal in and removes it.
+
+def new_ids(n: int) -> list:
+    raw = os.urandom(8 * n).hex()
+    return [raw[i:i + 16] for i in range(0, 16 * n, 16)]
+
+
+def add_id_column(path: str) -> list:
+    """Give a ledger written before row ids existed an id column (one-time rewrite)."""
+    tmp = _tmp_path(path)
+    with open(path, mode='r', newline='') as src, open(tmp, mode='w', newline='') as dst:
+        reader, writer = csv.reader(src), csv.writer(dst)
+        header = next(reader, []) + [ID_COLUMN]
+        writer.writerow(header)
+        for row in reader:
+            if row:
+                writer.writerow(row + new_ids(1))
+    os.replace(tmp, path)
+    invalidate(path)
+    return header
+
+
+def ensure_id_column(path: str, columns: list) -> list:
+    """Header of the ledger at ``path``, adding the id column first if it lacks one."""
+    with file_lock(path):
+        first = _read_header(path)
+        if ID_COLUMN not in first and all(c in first for c in columns if c != ID_COLUMN):
+            first = add_id_column(path)
+        return first
+
+
+def journal_path(path: str) -> str:
+    return os.path.splitext(path)[0] + JOURNAL_SUFFIX
+
+
+def rejected_path(path: str) -> str:
+    return os.path.splitext(path)[0] + REJECTED_SUFFIX
+
+
+def append_rejected(path: str, rejected: list) -> int:
+    """Keep ``(line, reason, row)`` entries of rows dropped from the ledger at ``path``."""
+    if not rejected:
+        return 0
+    rpath = rejected_path(path)
+    write_header = not os.path.exists(rpath) or os.path.getsize(rpath) == 0
+    with open(rpath, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        if write_header:
+            writer.writerow(['line', 'reason', 'row'])
+        writer.writerows(['' if line is None else line, reason, row] for line, reason, row in rejected)
+    return len(rejected)
+
+
+def _touch(path: str):
+    # The journal is part of the ledger: move the ledger's mtime so fingerprints
+    # (and everything cached on them) see the change.
+    st = os.stat(path)
+    now = max(time.time_ns(), st.st_mtime_ns + 1)
+    os.utime(path, ns=(st.st_atime_ns, now))
+    invalidate(path)
+
+
+def append_journal(path: str, columns: list, puts=(), deletes=()) -> int:
+    """Record row replacements (dicts with an id) and deletions (ids) for ``path``."""
+    jpath = journal_path(path)
+    header = ['op', ID_COLUMN] + [c for c in columns if c != ID_COLUMN]
+    records = [['put', row[ID_COLUMN]] + [_normalize_value(c, row.get(c, '')) for c in header[2:]] for row in puts]
+    records += [['del', row_id] + [''] * (len(header) - 2) for row_id in deletes]
+    if not records:
+        return 0
+    with file_lock(path):
+        write_header = not os.path.exists(jpath) or os.path.getsize(jpath) == 0
+        with open(jpath, mode='a', newline='') as file:
+            writer = csv.writer(file)
+            if write_header:
+                writer.writerow(header)
+            writer.writerows(records)
+        _touch(path)
+    return len(records)
+
+
+def read_journal(path: str) -> dict:
+    """Last journal entry per id: a dict of column values, or None for a delete."""
+    try:
+        with open(journal_path(path), mode='r', newline='') as file:
+            reader = csv.DictReader(file)
+            return {row[ID_COLUMN]: (None if row['op'] == 'del' else row) for row in reader}
+    except FileNotFoundError:
+        return {}
+
+
+def drop_journal(path: str):
+    try:
+        os.remove(journal_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def _iter_ledger(path: str):
+    journal = read_journal(path)
+    with open(path, mode='r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        if ID_COLUMN not in header:
+            if header and header[0] != 'date':
+                yield header  # headerless file: the first line is data
+            yield from (row for row in reader if row)
+            return
+        pos = header.index(ID_COLUMN)
+        for row in reader:
+            if not row:
+                continue
+            if len(row) > pos and row[pos] in journal:
+                entry = journal[row[pos]]
+                if entry is None:
+                    continue
+                row = [entry.get(col, '') for col in header]
+            yield row
+
+
+def compact_ledger(path: str) -> int:
+    """Fold the journal into the ledger CSV in one streaming pass and drop it.
+
+    The ledger is rewritten via a temp file and atomic rename. Returns the number
+    of rows kept.
+    """
+    with file_lock(path):
+        header = _read_header(path)
+        if ID_COLUMN not in header or not os.path.exists(journal_path(path)):
+            return None
+        kept = 0
+        tmp = _tmp_path(path)
+        with open(tmp, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            for row in _iter_ledger(path):
+                writer.writerow(row)
+                kept += 1
+        os.replace(tmp, path)
+        drop_journal(path)
+        invalidate(path)
+    return kept
+
+
+def maybe_compact(path: str, live_rows: int) -> bool:
+    """Compact ``path`` if its tombstones exceed TOMBSTONE_RATIO of its rows."""
+    with file_lock(path):
+        tombstones = sum(1 for entry in read_journal(path).values() if entry is None)
+        if tombstones == 0 or tombstones <= TOMBSTONE_RATIO * (live_rows + tombstones):
+            return False
+        compact_ledger(path)
+    return True
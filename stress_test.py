@@ -0,0 +1,161 @@
+"""Concurrent-writer stress test for the ledger and settings write paths.
+
+Starts several writer processes, each running several threads, against a scratch
+directory. Every thread appends expenses (through the app's write-behind queue and,
+for CSV, the CLI path), edits and deletes some of its own rows by id, and merges budget
+entries. Small journal limits force CSV compactions to race with the appends.
+Afterwards the ledger must contain exactly the surviving rows with their final
+amounts, every id must be unique, every budget key must be present, and the
+rollup totals must match the ledger.
+
+    python stress_test.py --processes 4 --threads 4 --rows 60 --backend csv
+"""
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _writer_thread(proc: int, thread: int, rows: int, use_cli: bool, out: dict):
+    from datetime import date
+
+    import backends
+    import expense_tracker
+    import write_queue
+    from app import update_budgets  # importing app outside `streamlit run` is side-effect free
+
+    live, budgets = {}, []
+    for i in range(rows):
+        tag = f'p{proc}-t{thread}-{i}'
+        if use_cli and i % 3 == 0:
+            expense_tracker.add_expense(date(2024, 1, 1 + i % 28).strftime('%d-%m-%Y'), 'Other', tag, i)
+        else:
+            write_queue.submit_append('expenses', [{'date': date(2024, 1, 1 + i % 28), 'category': 'Food',
+                                                    'description': tag, 'amount': float(i)}])
+        live[tag] = float(i)
+
+        if i % 5 == 4:
+            # Edit one of this thread's earlier rows by id
+            target = f'p{proc}-t{thread}-{i - 2}'
+            if target in live:
+                df = backends.read_ledger('expenses')
+                row = df[df['description'] == target]
+                changed = row.assign(amount=1000.0 + i)
+                backends.update_rows('expenses', changed, original=row)
+                live[target] = 1000.0 + i
+        if i % 11 == 10:
+            target = f'p{proc}-t{thread}-{i - 5}'
+            if target in live:
+                df = backends.read_ledger('expenses')
+                backends.update_rows('expenses', df.iloc[:0], deleted=df.index[df['description'] == target])
+                del live[target]
+        if i % 7 == 0:
+            update_budgets({tag: float(i)})
+            budgets.append(tag)
+    out[(proc, thread)] = (live, budgets)
+
+
+def _writer_process(proc: int, threads: int, rows: int, use_cli: bool, workdir: str, queue):
+    os.chdir(workdir)
+    sys.path.insert(0, REPO)
+    import backends
+
+    backends.JOURNAL_MAX_BYTES = 2048  # compact often, so rewrites race with appends
+    backends.register_derived_stores()
+    out = {}
+    workers = [threading.Thread(target=_writer_thread, args=(proc, t, rows, use_cli, out)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    queue.put(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=60, help="rows appended per thread")
+    parser.add_argument('--backend', choices=['csv', 'sqlite', 'partitioned'], default='csv')
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='expense-stress-')
+    os.environ['EXPENSE_TRACKER_STORAGE'] = args.backend
+    os.environ['EXPENSE_TRACKER_DB'] = os.path.join(workdir, 'ledger.db')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO)
+    import backends
+    import rollups
+    from storage import read_json
+
+    backends.get_backend().ensure()
+    use_cli = args.backend == 'csv'
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    started = time.perf_counter()
+    procs = [ctx.Process(target=_writer_process, args=(p, args.threads, args.rows, use_cli, workdir, queue))
+             for p in range(args.processes)]
+    for p in procs:
+        p.start()
+    results = {}
+    for _ in procs:
+        results.update(queue.get())
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+
+    expected, budget_keys = {}, []
+    for live, budgets in results.values():
+        expected.update(live)
+        budget_keys += budgets
+
+    df = backends.read_ledger('expenses')
+    got = dict(zip(df['description'], df['amount'].astype(float)))
+    errors = []
+    if len(results) != args.processes * args.threads:
+        errors.append(f"only {len(results)} writer threads reported back")
+    if df.index.duplicated().any():
+        errors.append(f"{int(df.index.duplicated().sum())} duplicate row ids")
+    if df['description'].duplicated().any():
+        errors.append(f"{int(df['description'].duplicated().sum())} duplicated rows")
+    missing = sorted(set(expected) - set(got))
+    extra = sorted(set(got) - set(expected))
+    wrong = sorted(k for k in set(expected) & set(got) if abs(expected[k] - got[k]) > 1e-9)
+    if missing:
+        errors.append(f"{len(missing)} lost rows, e.g. {missing[:5]}")
+    if extra:
+        errors.append(f"{len(extra)} rows that should have been deleted, e.g. {extra[:5]}")
+    if wrong:
+        errors.append(f"{len(wrong)} rows with a lost edit, e.g. {wrong[:5]}")
+    budgets = read_json('budgets.json', {})
+    lost_budgets = [k for k in budget_keys if k not in budgets]
+    if lost_budgets:
+        errors.append(f"{len(lost_budgets)} lost budget entries, e.g. {lost_budgets[:5]}")
+    rolled = float(rollups.totals('expenses', 'category')['amount'].sum())
+    if abs(rolled - float(df['amount'].sum())) > 1e-6:
+        errors.append(f"rollup total {rolled} != ledger total {float(df['amount'].sum())}")
+
+    writes = args.processes * args.threads * args.rows
+    print(f"{args.backend}: {args.processes} processes x {args.threads} threads x {args.rows} rows "
+          f"({writes} appends) in {elapsed:.1f}s; {len(df)} rows, {len(budgets)} budgets")
+    for err in errors:
+        print("FAIL:", err)
+    if not errors:
+        print("OK: no lost or torn writes")
+    if args.keep:
+        print("scratch directory:", workdir)
+    else:
+        os.chdir(REPO)
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import atexit
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+
+import pandas as pd
+
+from backends import _as_frame, add_flusher, add_pending, append_ledger, drop_pending, set_flushing, with_ids
+
+# Write-behind for UI appends: set to 0 to write synchronously on the render path
+WRITE_BEHIND = os.environ.get('EXPENSE_TRACKER_WRITE_BEHIND', '1').strip() not in ('0', 'false', 'no', '')
+# Batches waiting to be written; when full, submitters wait briefly and then write themselves
+WRITE_QUEUE_SIZE = int(os.environ.get('EXPENSE_TRACKER_WRITE_QUEUE_SIZE', '256'))
+# Submissions arriving within this window of the first one share a single flush
+WRITE_WINDOW_MS = float(os.environ.get('EXPENSE_TRACKER_WRITE_WINDOW_MS', '50'))
+# Upper bound on submissions folded into one flush
+WRITE_BATCH_MAX = 500
+# Pause between attempts when a flush fails (e.g. disk full)
+RETRY_DELAY = 1.0
+# Attempts per batch before it is set aside as failed (see failed_writes)
+WRITE_RETRIES = int(os.environ.get('EXPENSE_TRACKER_WRITE_RETRIES', '5'))
+# How long interpreter shutdown waits for the queue to drain
+DRAIN_TIMEOUT = 30.0
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class FailedWrite:
+    ledger: str
+    rows: pd.DataFrame
+    error: str  # the last attempt's exception
+
+
+# ---------------------------
+# ---- Writer  ----
+# ---------------------------
+
+class WriteBehindQueue:
+    """Bounded queue of ledger appends drained by one background writer thread.
+
+    Each submission is published to the pending overlay (backends.add_pending)
+    before it is queued, so reads see it at once. The writer groups everything
+    that arrives within WRITE_WINDOW_MS into one ``append_ledger`` call per ledger
+    and removes the rows from the overlay only once they are stored. A single
+    writer keeps appends to a ledger in submission order. A batch that still fails
+    after WRITE_RETRIES attempts leaves the overlay and is kept in ``failed`` until
+    it is retried or discarded.
+    """
+
+    def __init__(self, maxsize: int = WRITE_QUEUE_SIZE, window_ms: float = WRITE_WINDOW_MS):
+        self._queue = queue.Queue(maxsize)
+        self._window = window_ms / 1000.0
+        self._keys = itertools.count()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._idle = threading.Condition()
+        self._waiting = {}  # ledger -> submissions not yet stored
+        self._failed = []  # FailedWrite batches, oldest first
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def submit(self, ledger: str, rows) -> int:
+        """Acknowledge ``rows`` for ``ledger`` now and store them in the background."""
+        rows = with_ids(_as_frame(rows, ledger))
+        if rows.empty:
+            return 0
+        key = next(self._keys)
+        add_pending(ledger, key, rows)
+        with self._idle:
+            self._waiting[ledger] = self._waiting.get(ledger, 0) + 1
+        self._start()
+        try:
+            self._queue.put((ledger, key, rows), timeout=max(self._window * 10, 0.5))
+        except queue.Full:
+            # Back-pressure: the writer is behind, so this session pays for its own write
+            self._write([(ledger, key, rows)], retry=False)
+        return len(rows)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window
+            while len(batch) < WRITE_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: list, retry: bool = True):
+        by_ledger = {}
+        for ledger, key, rows in batch:
+            by_ledger.setdefault(ledger, []).append((key, rows))
+        for ledger, items in by_ledger.items():
+            keys = [key for key, _ in items]
+            rows = pd.concat([rows for _, rows in items])
+            try:
+                for attempt in range(1, WRITE_RETRIES + 1):
+                    set_flushing(ledger, keys)
+                    try:
+                        append_ledger(ledger, rows)
+                        break
+                    except Exception as e:
+                        # The rows stay pending (and visible); retry in place to keep order
+                        set_flushing(ledger, keys, False)
+                        if not retry:
+                            raise
+                        if attempt == WRITE_RETRIES:
+                            log.exception("write-behind append of %d rows to %s failed %d times; giving up",
+                                          len(rows), ledger, attempt)
+                            with self._idle:
+                                self._failed.append(FailedWrite(ledger, rows, f"{type(e).__name__}: {e}"))
+                            break
+                        log.exception("write-behind append to %s failed; retrying", ledger)
+                        time.sleep(RETRY_DELAY)
+            finally:
+                # Stored, failed back to the submitter or set aside: either way no
+                # longer pending, and flush() must not wait for them
+                for key in keys:
+                    drop_pending(ledger, key)
+                with self._idle:
+                    self._waiting[ledger] -= len(items)
+                    self._idle.notify_all()
+
+    def flush(self, ledger: str = None, timeout: float = None) -> bool:
+        """Wait until queued rows of ``ledger`` (or all ledgers) are stored; False on timeout."""
+        def done():
+            if ledger is None:
+                return not any(self._waiting.values())
+            return not self._waiting.get(ledger)
+
+        with self._idle:
+            return self._idle.wait_for(done, timeout)
+
+    def failed(self, ledger: str = None) -> list:
+        """Batches that could not be stored, for ``ledger`` or all ledgers."""
+        with self._idle:
+            return [f for f in self._failed if ledger is None or f.ledger == ledger]
+
+    def take_failed(self, ledger: str = None) -> list:
+        """Remove and return the failed batches of ``ledger`` (or all ledgers)."""
+        with self._idle:
+            taken = [f for f in self._failed if ledger is None or f.ledger == ledger]
+            self._failed = [f for f in self._failed if not (ledger is None or f.ledger == ledger)]
+        return taken
+
+
+# ---------------------------
+# ---- Process-wide Queue  ----
+# ---------------------------
+
+_writer = WriteBehindQueue()
+
+
+def submit_append(ledger: str, rows) -> int:
+    """Append rows to a ledger off the render path (synchronously if write-behind is off)."""
+    if not WRITE_BEHIND:
+        return append_ledger(ledger, rows)
+    return _writer.submit(ledger, rows)
+
+
+def flush(ledger: str = None, timeout: float = None) -> bool:
+    return _writer.flush(ledger, timeout)
+
+
+def failed_writes(ledger: str = None) -> list:
+    return _writer.failed(ledger)
+
+
+def retry_failed(ledger: str = None) -> int:
+    """Queue the failed batches again; returns the number of rows resubmitted."""
+    return sum(submit_append(f.ledger, f.rows) for f in _writer.take_failed(ledger))
+
+
+def discard_failed(ledger: str = None) -> int:
+    """Drop the failed batches; returns the number of rows discarded."""
+    return sum(len(f.rows) for f in _writer.take_failed(ledger))
+
+
+def _drain():
+    if not flush(timeout=DRAIN_TIMEOUT):
+        log.error("write-behind queue not drained within %.0fs; queued rows were lost", DRAIN_TIMEOUT)
+    for f in failed_writes():
+        log.error("%d rows for %s were never stored (%s)", len(f.rows), f.ledger, f.error)
+
+
+add_flusher(flush)
+atexit.register(_drain)